@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+"""Benchmark the load, train, fit and predict hot paths.
+
+The benchmarks run against synthetic IDX files written to a temporary
+directory, so no MNIST download is needed. Results are printed (or
+written) as JSON; two result files can be compared to flag slowdowns:
+
+    ./bench_digits.py --output before.json
+    ./bench_digits.py --output after.json
+    ./bench_digits.py --compare before.json after.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy
+
+import gadigits
+import gafitness
+import nndigits
+from mnist_utils import open_image_file
+from mnist_utils import open_label_file
+from mnist_utils import read_image_file
+from mnist_utils import read_label_file
+from mnist_utils import write_image_file
+from mnist_utils import write_label_file
+
+
+IMAGE_COUNT = 2000
+REPEAT = 3
+SLOWDOWN_THRESHOLD = 0.10  # relative throughput loss reported by compare
+
+BENCHMARKS = []
+
+
+def benchmark(function):
+    """Register a benchmark: function(context) returns the items processed."""
+    BENCHMARKS.append(function)
+    return function
+
+
+class BenchmarkContext:
+    def __init__(self, dirname, image_count, seed=0):
+        rng = numpy.random.default_rng(seed)
+        pixels = rng.integers(0, 256, size=(image_count, 28 * 28))
+        pixels[pixels < 200] = 0  # ~80% zero, like MNIST
+        self.image_filename = os.path.join(dirname, "bench-images-idx3-ubyte")
+        self.label_filename = os.path.join(dirname, "bench-labels-idx1-ubyte")
+        write_image_file(self.image_filename, pixels, 28, 28)
+        write_label_file(
+            self.label_filename, rng.integers(0, 10, size=image_count))
+        self.images = open_image_file(self.image_filename)
+        self.labels = open_label_file(self.label_filename)
+        self.legacy_images = quiet(read_image_file, self.image_filename)
+        self.legacy_labels = quiet(read_label_file, self.label_filename)
+        random.seed(seed)
+        self.layer = nndigits.init_layer()
+
+
+def quiet(function, *args, **kwargs):
+    """Call function with its (tracing) output thrown away."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+@benchmark
+def read_files(context):
+    quiet(read_image_file, context.image_filename)
+    quiet(read_label_file, context.label_filename)
+    return len(context.images)
+
+
+@benchmark
+def open_files(context):
+    images = open_image_file(context.image_filename)
+    labels = open_label_file(context.label_filename)
+    int(images.pixels.sum()), int(labels.values.sum())  # touch every page
+    return len(images)
+
+
+@benchmark
+def calc_cell_output(context):
+    cell = context.layer.cells[0]
+    images = context.legacy_images[:200]
+    for image in images:
+        nndigits.calc_cell_output(cell, image)
+    return len(images)
+
+
+@benchmark
+def update_cell_weights(context):
+    cell = context.layer.cells[0]
+    images = context.legacy_images[:200]
+    for image in images:
+        nndigits.update_cell_weights(cell, image, 0.1)
+    return len(images)
+
+
+@benchmark
+def use_layer_epoch(context):
+    count = 200
+    quiet(nndigits.use_layer, context.layer, context.legacy_images[:count],
+          context.legacy_labels[:count], train=True)
+    return count
+
+
+@benchmark
+def use_matrix_layer_epoch(context):
+    quiet(nndigits.use_layer, context.layer, context.images, context.labels,
+          train=True, batch_size=32)
+    return len(context.images)
+
+
+@benchmark
+def predict_batch(context):
+    nndigits.predict_batch(context.layer, context.images, k=3)
+    return len(context.images)
+
+
+@benchmark
+def digit_recognizer_fit(context):
+    dr = gadigits.DigitRecognizer(digit=0)
+    images = context.legacy_images[:20]
+    for image in images:
+        quiet(dr.fit, image)
+    return len(images)
+
+
+@benchmark
+def weight_encode_decode(context):
+    count = 10000
+    for value in numpy.linspace(-30, 30, count).tolist():
+        gadigits.Weight(gadigits.Weight(value).as_string)
+    return count
+
+
+@benchmark
+def genome_encode_decode(context):
+    count = 100000
+    numbers = numpy.linspace(-30, 30, count)
+    gadigits.Genome.from_numbers(numbers).as_numbers()
+    return count
+
+
+def ga_generation(context, population_size=200):
+    """A converging population, its fitness and its single point children.
+
+    200: DigitsRecognizer.train scores the ten digit populations of 20
+    together. Built once per context, so the benchmarks time only scoring
+    against a 1000 image batch.
+    """
+    if not hasattr(context, "ga_generation"):
+        rng = numpy.random.default_rng(0)
+        ancestor = gadigits.Genome(rng.integers(0, 1 << 16, size=28 * 28))
+        population = [
+            gadigits.mutate(ancestor, 0.001, rng)
+            for i in range(population_size)
+        ]
+        children, parents = [], []
+        for i in range(0, population_size, 2):
+            for child in gadigits.single_point_crossover(
+                    population[i], population[i + 1], rng):
+                children.append(gadigits.mutate(child, 0.001, rng))
+                parents.append((i, i + 1))
+        bw_pixels = context.images.pixels[:1000] > 127
+        values = context.labels.values[:1000]
+        fitness = gafitness.IncrementalFitness(bw_pixels, values).fitness(
+            0, [genome.as_numbers() for genome in population])
+        context.ga_generation = (
+            population, fitness, children, parents, bw_pixels, values)
+    return context.ga_generation
+
+
+@benchmark
+def ga_generation_fitness(context):
+    population, fitness, children, parents, bw_pixels, values = (
+        ga_generation(context))
+    gadigits.recognition_fitness(
+        gafitness.fit_population(
+            [child.as_numbers() for child in children], bw_pixels),
+        values == 0)
+    return len(children)
+
+
+@benchmark
+def ga_generation_incremental_fitness(context):
+    """Including the reduction of the batch, as with batch_refresh=1."""
+    population, fitness, children, parents, bw_pixels, values = (
+        ga_generation(context))
+    gafitness.IncrementalFitness(bw_pixels, values).derive_population(
+        0, population, fitness, children, parents)
+    return len(children)
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_benchmarks(image_count=IMAGE_COUNT, repeat=REPEAT, names=None):
+    """Return the results as a JSON serializable dict.
+
+    Every benchmark runs `repeat` times, the fastest run is reported.
+    peak_rss_kb is the high-water mark of the process after the benchmark.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as dirname:
+        context = BenchmarkContext(dirname, image_count)
+        for function in BENCHMARKS:
+            if names and function.__name__ not in names:
+                continue
+            best = None
+            for i in range(repeat):
+                start = time.perf_counter()
+                items = function(context)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[function.__name__] = {
+                "items": items,
+                "seconds": best,
+                "items_per_sec": items / best if best else None,
+                "peak_rss_kb": peak_rss_kb(),
+            }
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "image_count": image_count,
+        "repeat": repeat,
+        "benchmarks": results,
+    }
+
+
+def compare(old, new, threshold=SLOWDOWN_THRESHOLD):
+    """Return the [(name, old_rate, new_rate, change)] of the slowdowns."""
+    slowdowns = []
+    for name, new_result in sorted(new["benchmarks"].items()):
+        old_result = old["benchmarks"].get(name)
+        if not old_result or not old_result["items_per_sec"]:
+            continue
+        old_rate = old_result["items_per_sec"]
+        new_rate = new_result["items_per_sec"]
+        change = new_rate / old_rate - 1
+        if change < -threshold:
+            slowdowns.append((name, old_rate, new_rate, change))
+    return slowdowns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=IMAGE_COUNT,
+                        help="synthetic images to generate")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--only", nargs="*", metavar="NAME",
+                        help="run only these benchmarks")
+    parser.add_argument("--output", help="write JSON here (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=SLOWDOWN_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as old_file, \
+                open(args.compare[1]) as new_file:
+            slowdowns = compare(
+                json.load(old_file), json.load(new_file), args.threshold)
+        for name, old_rate, new_rate, change in slowdowns:
+            print("SLOWER {}: {:.1f} -> {:.1f} items/sec ({:+.1%})".format(
+                name, old_rate, new_rate, change))
+        return 1 if slowdowns else 0
+
+    results = run_benchmarks(args.images, args.repeat, args.only)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,136 +2,97 @@
 
 """Convert MNIST images into uniform sized bounding boxes.
 
-Note: download and extract data files from http://yann.lecun.com/exdb/mnist/
+Every image is cropped to the square around the bounding box of its
+non-zero pixels and rescaled to BOX_SIZE x BOX_SIZE, so the recognizers
+get smaller, denser inputs. The images are processed in vectorized
+batches and written as new IDX files (the label files stay valid).
+
+Note: download data files from http://yann.lecun.com/exdb/mnist/ (extracting
+them is optional, the .gz files are read directly)
   train-images-idx3-ubyte.gz:  training set images (9912422 bytes)
   train-labels-idx1-ubyte.gz:  training set labels (28881 bytes)
   t10k-images-idx3-ubyte.gz:   test set images (1648877 bytes)
   t10k-labels-idx1-ubyte.gz:   test set labels (4542 bytes)
-
-TODO: https://www.imagemagick.org/script/command-line-options.php#trim
 """
 
-import struct
-from collections import namedtuple
-
-# from PIL import Image
-
-
-MNISTImageFileHeader = namedtuple(
-    "MNISTImageFileHeader", [
-        "magicNumber",
-        "maxImages",
-        "imgWidth",
-        "imgHeight",
-    ]
-)
-
-
-class MNISTImage:
-    def __init__(self, header, pixels):
-        self.pixels = pixels
-        assert header.imgWidth == header.imgHeight
-
-
-MNISTLabel = namedtuple(
-    "MNISTLabel", [
-        "value",
-    ]
-)
-
-MNISTLabelFileHeader = namedtuple(
-    "MNISTLabelFileHeader", [
-        "magicNumber",
-        "maxLabels",
-    ]
-)
-
-
-def main():
-    train_images = read_image_file("./train-images-idx3-ubyte")[:10]
-    train_labels = read_label_file("./train-labels-idx1-ubyte")[:10]
-    for (image, label) in zip(train_images, train_labels):
-        print_image(image.pixels)
-        print("label = {}".format(label))
-
-    test_images = read_image_file("./t10k-images-idx3-ubyte")[:10]
-    test_labels = read_label_file("./t10k-labels-idx1-ubyte")[:10]
-    for (image, label) in zip(test_images, test_labels):
-        print_image(image.pixels)
-        print("label = {}".format(label))
-
-
-def read_image_file(filename):
-    """ See file formats at http://yann.lecun.com/exdb/mnist/ """
-    with open(filename, "rb") as image_file:
-        data = image_file.read()
-        if not data:
-            print("No data!")
-            exit(1)
-
-    struct_fmt = '>4i'  # int[4]
-    struct_len = struct.calcsize(struct_fmt)
-    buffer = data[:struct_len]
-    image_struct = struct.unpack(struct_fmt, buffer)
-    print("%d %d %d %d" % image_struct)
-    header = MNISTImageFileHeader(*image_struct)
-
-    buffer = data[struct_len:]
-    struct_fmt = '>{}B'.format(header.imgHeight * header.imgWidth)
-    struct_len = struct.calcsize(struct_fmt)
-    images = [
-        MNISTImage(header, pixels)
-        for pixels in struct.iter_unpack(struct_fmt, buffer)
-    ]
-    # print("first image:\n{}".format(images[0]))
-    print("first image:")
-    print_image(images[0].pixels)
-    print("last image:")
-    print_image(images[-1].pixels)
-    return images
-
-
-def print_image(image_pixels):
-    for i, pixel in enumerate(image_pixels):
-        if pixel > 200:
-            print('■ ', end='')
-        elif pixel > 150:
-            print('▣ ', end='')
-        elif pixel > 100:
-            print('▩ ', end='')
-        elif pixel > 50:
-            print('▨ ', end='')
-        else:
-            print('□ ', end='')
-        # TODO: 28 => use imgWidth
-        if (i + 1) % 28 == 0:
-            print("")
-    print("")
-
-
-def read_label_file(filename):
-    """ See file formats at http://yann.lecun.com/exdb/mnist/ """
-    with open(filename, "rb") as label_file:
-        data = label_file.read()
-        if not data:
-            print("No data!")
-            exit(1)
-
-    struct_fmt = '>2i'  # int[2]
-    struct_len = struct.calcsize(struct_fmt)
-    buffer = data[:struct_len]
-    label_struct = struct.unpack(struct_fmt, buffer)
-    print("%d %d" % label_struct)
-    header = MNISTLabelFileHeader(*label_struct)
-
-    buffer = data[struct_len:]
-    struct_fmt = '>B'
-    struct_len = struct.calcsize(struct_fmt)
-    labels = [MNISTLabel(x[0]) for x in struct.iter_unpack(struct_fmt, buffer)]
-    assert header.maxLabels == len(labels)
-    print("first label: {}".format(labels[0]))
-    print("last label : {}".format(labels[-1]))
-    return labels
+import os
+
+import numpy
+
+import instrumentation
+from mnist_augment import bilinear_sample
+from mnist_utils import MNIST_FILES
+from mnist_utils import bbox_filename
+from mnist_utils import mnist_filenames
+from mnist_utils import open_image_file
+from mnist_utils import print_image
+from mnist_utils import write_image_file
+
+
+BOX_SIZE = 20
+CHUNK_SIZE = 4096  # images per vectorized batch
+
+
+def main(size=BOX_SIZE, data_dir="."):
+    for subset in ("train", "test"):
+        source_filename = mnist_filenames(subset, data_dir)[0]
+        target_filename = os.path.join(data_dir, bbox_filename(
+            MNIST_FILES[subset][0], size))
+        images = convert_image_file(source_filename, target_filename, size)
+        instrumentation.info("{} -> {} ({} images)",
+                             source_filename, target_filename, len(images))
+        if instrumentation.tracing:
+            print_image(images[0], width=size)
+
+
+def convert_image_file(source_filename, target_filename, size=BOX_SIZE):
+    """Write the normalized images of source into a new IDX file."""
+    images = open_image_file(source_filename)
+    height, width = images.header.imgHeight, images.header.imgWidth
+    normalized = numpy.empty((len(images), size * size), dtype=numpy.uint8)
+    for start in range(0, len(images), CHUNK_SIZE):
+        chunk = images.pixels[start:start + CHUNK_SIZE]
+        normalized[start:start + CHUNK_SIZE] = normalize_images(
+            chunk.reshape(-1, height, width), size).reshape(len(chunk), -1)
+    write_image_file(target_filename, normalized, size, size)
+    return normalized
+
+
+def bounding_boxes(images):
+    """Return (top, bottom, left, right) arrays of the non-zero pixels.
+
+    images: (count, height, width) array; bottom and right are exclusive.
+    Empty images get the box of the whole image.
+    """
+    count, height, width = images.shape
+    rows = (images != 0).any(axis=2)
+    cols = (images != 0).any(axis=1)
+    empty = ~rows.any(axis=1)
+    top = numpy.where(empty, 0, rows.argmax(axis=1))
+    bottom = numpy.where(empty, height, height - rows[:, ::-1].argmax(axis=1))
+    left = numpy.where(empty, 0, cols.argmax(axis=1))
+    right = numpy.where(empty, width, width - cols[:, ::-1].argmax(axis=1))
+    return top, bottom, left, right
+
+
+def normalize_images(images, size=BOX_SIZE):
+    """Crop images to their centered, square bounding box and rescale.
+
+    images: (count, height, width) uint8 array
+    Return (count, size, size) uint8 array, bilinearly resampled.
+    """
+    top, bottom, left, right = bounding_boxes(images)
+    side = numpy.maximum(bottom - top, right - left).astype(numpy.float64)
+    center_y = (top + bottom) / 2
+    center_x = (left + right) / 2
+
+    # source coordinates of the output pixel centers, per image
+    steps = (numpy.arange(size) + 0.5) / size - 0.5
+    src_y = center_y[:, None] + steps[None, :] * side[:, None] - 0.5
+    src_x = center_x[:, None] + steps[None, :] * side[:, None] - 0.5
+
+    result = bilinear_sample(images, src_y[:, :, None], src_x[:, None, :])
+    return numpy.clip(numpy.rint(result), 0, 255).astype(numpy.uint8)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+"""Command-line driver of the digit recognizers.
+
+    digits.py convert [--size N]
+    digits.py train {nn,ga} [--model FILE] [--bbox SIZE] [--retrain] ...
+    digits.py test {nn,ga} [--model FILE] [--bbox SIZE] [--json FILE] [-k K]
+    digits.py predict [--model FILE] [--images FILE | --bbox SIZE] [-k K]
+                      INDEX...
+    digits.py sweep {nn,ga} [--search {grid,random}] [--output FILE] ...
+    digits.py bench [bench_digits.py options]
+
+The data files are looked up in --data-dir; --bbox SIZE selects the
+images written by convert --size SIZE. Modules are imported by the
+subcommand that needs them, and predict memory-maps both the model and the
+image file, so it only touches the requested images.
+"""
+
+import argparse
+import os
+import sys
+
+
+def convert(args):
+    import convert_mnist_database
+
+    convert_mnist_database.main(args.size, args.data_dir)
+
+
+def train(args):
+    augment = None
+    if args.augment:
+        from mnist_augment import AugmentConfig
+
+        augment = AugmentConfig()
+    if args.method == "nn":
+        import nndigits
+
+        nndigits.train_layer(
+            batch_size=args.batch_size, workers=args.workers,
+            hidden_sizes=args.hidden, data_dir=args.data_dir,
+            model_filename=args.model or nndigits.MODEL_FILENAME,
+            retrain=args.retrain, checkpoint_filename=args.checkpoint,
+            epochs=args.epochs, shuffle=args.shuffle, seed=args.seed,
+            mode=args.mode,
+            augment=augment, augment_workers=args.augment_workers,
+            evaluate_epochs=args.evaluate, bbox=args.bbox)
+    else:
+        import gadigits
+
+        config = gadigits.GAConfig(
+            workers=args.workers, augment=augment,
+            augment_workers=args.augment_workers)
+        if args.generations is not None:
+            config = config._replace(generations=args.generations)
+        if args.batch_size is not None:
+            config = config._replace(batch_size=args.batch_size)
+        if args.islands:
+            config = config._replace(
+                islands=args.islands, topology=args.topology,
+                migration_interval=args.migration_interval)
+        gadigits.train_recognizers(
+            data_dir=args.data_dir,
+            model_filename=args.model or gadigits.MODEL_FILENAME,
+            config=config, population_size=args.population_size,
+            retrain=args.retrain, bbox=args.bbox)
+
+
+def test(args):
+    if args.method == "nn":
+        import nndigits
+
+        layer = nndigits.load_layer(args.model or nndigits.MODEL_FILENAME)
+        nndigits.test_layer(
+            layer, args.data_dir, args.json, args.k, args.bbox)
+    else:
+        import gadigits
+
+        recognizers = gadigits.load_recognizers(
+            args.model or gadigits.MODEL_FILENAME)
+        gadigits.test_recognizers(
+            recognizers, args.data_dir, args.json, args.k, args.bbox)
+
+
+def predict(args):
+    import model_io
+    from mnist_utils import mnist_filenames
+    from mnist_utils import open_image_file
+
+    images_filename = args.images or mnist_filenames(
+        "test", args.data_dir, args.bbox)[0]
+    images = open_image_file(images_filename)
+    for index in args.indices:
+        if not 0 <= index < len(images):
+            sys.exit("predict: INDEX {} out of range, {} has {} images".format(
+                index, images_filename, len(images)))
+    pixels = images.pixels[args.indices]
+    header = model_io.read_model_header(args.model)
+    if header.kind == model_io.GA_RECOGNIZERS:
+        import gadigits
+
+        digits, scores = gadigits.predict_with_genes(
+            gadigits.load_recognizer_genes(args.model), pixels, args.k)
+    else:
+        import nndigits
+
+        digits, scores = nndigits.predict_batch(
+            nndigits.load_layer(args.model), pixels, args.k)
+    for index, image_digits, image_scores in zip(args.indices, digits, scores):
+        print("{} {}: {}".format(
+            os.path.basename(images_filename), index,
+            ', '.join('{} ({:.3f})'.format(digit, score)
+                      for digit, score in zip(image_digits, image_scores))))
+
+
+def sweep(args):
+    import digits_sweep
+
+    space = {
+        name: values for name, values in (
+            ("learning_rate", args.learning_rate),
+            ("weight_range", args.weight_range),
+            ("population_size", args.population_size),
+        ) if values
+    }
+    digits_sweep.sweep(
+        args.method, args.data_dir, space or None,
+        digits_sweep.SweepConfig(
+            search=args.search, samples=args.samples,
+            min_budget=args.min_budget, max_budget=args.max_budget,
+            eta=args.eta, workers=args.workers, seed=args.seed,
+            batch_size=args.batch_size),
+        results_filename=args.output)
+
+
+def bench(args):
+    import bench_digits
+
+    return bench_digits.main(args.bench_args)
+
+
+def add_bbox_argument(parser):
+    parser.add_argument("--bbox", type=int, metavar="SIZE",
+                        help="use the bounding-box images written by "
+                        "convert --size SIZE")
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default=".",
+                        help="directory of the MNIST IDX files")
+    parser.add_argument("-v", "--verbose", action="count", default=0)
+    parser.add_argument("-q", "--quiet", action="store_true")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="write bounding-box normalized image files")
+    convert_parser.add_argument("--size", type=int, default=20)
+    convert_parser.set_defaults(run=convert)
+
+    train_parser = subparsers.add_parser(
+        "train", help="train (or load) and save a model")
+    train_parser.add_argument("method", choices=("nn", "ga"))
+    train_parser.add_argument("--model", help="model file to write")
+    add_bbox_argument(train_parser)
+    train_parser.add_argument("--retrain", action="store_true",
+                              help="ignore an existing model file")
+    train_parser.add_argument("--batch-size", type=int)
+    train_parser.add_argument("--workers", type=int)
+    train_parser.add_argument("--hidden", type=int, nargs="*",
+                              metavar="SIZE", help="nn hidden layer sizes")
+    train_parser.add_argument("--checkpoint", metavar="FILE",
+                              help="nn: checkpoint (and resume) training")
+    train_parser.add_argument("--epochs", type=int, default=1,
+                              help="nn training epochs")
+    train_parser.add_argument("--shuffle",
+                              action=argparse.BooleanOptionalAction,
+                              help="nn: shuffle the images every epoch "
+                              "(default: with several epochs)")
+    train_parser.add_argument("--seed", type=int,
+                              help="nn: seed of the image order")
+    train_parser.add_argument("--mode", default="average",
+                              choices=("average", "hogwild"),
+                              help="nn: data-parallel mode with --workers")
+    train_parser.add_argument("--evaluate", action="store_true",
+                              help="nn: evaluate on the test set after "
+                              "every epoch")
+    train_parser.add_argument("--augment", action="store_true",
+                              help="train on randomly augmented images")
+    train_parser.add_argument("--augment-workers", type=int,
+                              default=os.cpu_count(),
+                              help="threads augmenting the images "
+                              "(default: one per CPU, 0: none)")
+    train_parser.add_argument("--generations", type=int)
+    train_parser.add_argument("--population-size", type=int, default=4)
+    train_parser.add_argument("--islands", type=int,
+                              help="ga island processes")
+    train_parser.add_argument("--migration-interval", type=int, default=10)
+    train_parser.add_argument("--topology", default="ring",
+                              choices=("ring", "complete", "random"))
+    train_parser.set_defaults(run=train)
+
+    test_parser = subparsers.add_parser(
+        "test", help="print the per-digit evaluation on the test set")
+    test_parser.add_argument("method", choices=("nn", "ga"))
+    test_parser.add_argument("--model", help="model file to read")
+    add_bbox_argument(test_parser)
+    test_parser.add_argument("--json", metavar="FILE",
+                             help="save the evaluation as JSON")
+    test_parser.add_argument("-k", type=int, default=3,
+                             help="largest top-k accuracy")
+    test_parser.set_defaults(run=test)
+
+    predict_parser = subparsers.add_parser(
+        "predict", help="print the top digits of some images")
+    predict_parser.add_argument("--model", default="nn_trained_layer.model",
+                                help="nn or ga model file")
+    predict_parser.add_argument("--images",
+                                help="IDX image file (default: test set)")
+    add_bbox_argument(predict_parser)
+    predict_parser.add_argument("-k", type=int, default=1,
+                                help="digits printed per image")
+    predict_parser.add_argument("indices", type=int, nargs="+",
+                                metavar="INDEX")
+    predict_parser.set_defaults(run=predict)
+
+    sweep_parser = subparsers.add_parser(
+        "sweep", help="hyperparameter sweep with successive halving")
+    sweep_parser.add_argument("method", choices=("nn", "ga"))
+    sweep_parser.add_argument("--search", default="grid",
+                              choices=("grid", "random"))
+    sweep_parser.add_argument("--samples", type=int, default=10,
+                              help="random search configurations")
+    sweep_parser.add_argument("--learning-rate", type=float, nargs="+",
+                              metavar="RATE", help="nn learning rates")
+    sweep_parser.add_argument("--weight-range", type=float, nargs="+",
+                              metavar="RANGE", help="ga weight ranges")
+    sweep_parser.add_argument("--population-size", type=int, nargs="+",
+                              metavar="SIZE", help="ga population sizes")
+    sweep_parser.add_argument("--min-budget", type=int,
+                              help="epochs / generations of the first rung")
+    sweep_parser.add_argument("--max-budget", type=int,
+                              help="epochs / generations of the last rung")
+    sweep_parser.add_argument("--eta", type=int, default=3,
+                              help="1 / eta of the configurations go on")
+    sweep_parser.add_argument("--workers", type=int,
+                              help="processes (0: in-process)")
+    sweep_parser.add_argument("--seed", type=int)
+    sweep_parser.add_argument("--batch-size", type=int)
+    sweep_parser.add_argument("--output", metavar="FILE",
+                              help="write the results table as CSV")
+    sweep_parser.set_defaults(run=sweep)
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="run bench_digits.py (other options are passed on)",
+        add_help=False)
+    bench_parser.set_defaults(run=bench)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args, extra_args = parser.parse_known_args(argv)
+    args.bench_args = extra_args
+    if args.bench_args and args.command != "bench":
+        parser.error("unrecognized arguments: {}".format(
+            " ".join(args.bench_args)))
+    if args.verbose or args.quiet:
+        import instrumentation
+
+        instrumentation.configure(
+            instrumentation.QUIET if args.quiet
+            else instrumentation.INFO + args.verbose)
+    return args.run(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
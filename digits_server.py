@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""Local inference server for a trained nndigits layer.
+
+The layer is loaded once and served on a Unix socket. Concurrent requests
+are collected for up to batch_window seconds (or max_batch_size images)
+and answered by one vectorized predict_batch() call.
+
+Protocol (a connection can send any number of requests):
+  b'P' + image_size bytes  -> k uint8 digits + k little-endian float32
+                              scores (best first)
+  b'S'                     -> big-endian uint32 length + JSON statistics
+                              (latency percentiles and throughput)
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import struct
+import time
+
+import numpy
+
+import instrumentation
+from nndigits import Network
+from nndigits import load_layer
+from nndigits import predict_batch
+
+
+PREDICT = b'P'
+STATS = b'S'
+
+BATCH_WINDOW = 0.002  # seconds
+MAX_BATCH_SIZE = 256
+LATENCY_WINDOW = 10000  # latencies kept for the percentiles
+
+
+def image_size_of(layer):
+    if isinstance(layer, Network):
+        return layer.sizes[0]
+    return layer.weights.shape[1]
+
+
+class InferenceServer:
+    def __init__(self, layer, socket_path, k=1, batch_window=BATCH_WINDOW,
+                 max_batch_size=MAX_BATCH_SIZE):
+        self.layer = layer
+        self.socket_path = socket_path
+        self.k = min(k, 10)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.image_size = image_size_of(layer)
+        self.response_struct = struct.Struct(
+            '<{}B{}f'.format(self.k, self.k))
+        self._queue = None
+        self._server = None
+        self._batcher = None
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.request_count = 0
+        self.batch_count = 0
+        self.start_time = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self.start_time = time.perf_counter()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(
+            self._handle_client, path=self.socket_path)
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        instrumentation.info("Serving on {}", self.socket_path)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                opcode = await reader.read(1)
+                if not opcode:
+                    break
+                if opcode == PREDICT:
+                    pixels = await reader.readexactly(self.image_size)
+                    start = time.perf_counter()
+                    future = loop.create_future()
+                    await self._queue.put((pixels, future))
+                    writer.write(await future)
+                    self._latencies.append(time.perf_counter() - start)
+                elif opcode == STATS:
+                    payload = json.dumps(self.stats()).encode()
+                    writer.write(struct.pack('>I', len(payload)) + payload)
+                else:
+                    break  # protocol error: drop the connection
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(await asyncio.wait_for(
+                        self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            pixels = numpy.frombuffer(
+                b''.join(request[0] for request in requests),
+                dtype=numpy.uint8).reshape(len(requests), self.image_size)
+            try:
+                digits, scores = await loop.run_in_executor(
+                    None, predict_batch, self.layer, pixels, self.k)
+            except Exception as exc:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, future), image_digits, image_scores in zip(
+                    requests, digits.tolist(), scores.tolist()):
+                if not future.done():
+                    future.set_result(self.response_struct.pack(
+                        *image_digits, *image_scores))
+            self.request_count += len(requests)
+            self.batch_count += 1
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start_time
+        latencies = numpy.array(self._latencies)
+        percentiles = {}
+        if len(latencies):
+            for percentile in (50, 90, 99):
+                percentiles["p{}".format(percentile)] = float(
+                    numpy.percentile(latencies, percentile))
+        return {
+            "requests": self.request_count,
+            "batches": self.batch_count,
+            "mean_batch_size": (self.request_count / self.batch_count
+                                if self.batch_count else 0.0),
+            "requests_per_sec": self.request_count / elapsed,
+            "latency_seconds": percentiles,
+        }
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed by the server")
+        data += chunk
+    return bytes(data)
+
+
+def predict_remote(socket_path, images, k=1):
+    """Blocking client: return (digits, scores) lists for the images.
+
+    images: iterable of image_size uint8 pixel rows; k must match the k of
+    the server.
+    """
+    response_struct = struct.Struct('<{}B{}f'.format(k, k))
+    results = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        for pixels in images:
+            sock.sendall(PREDICT + numpy.asarray(
+                pixels, dtype=numpy.uint8).tobytes())
+            values = response_struct.unpack(
+                _recv_exactly(sock, response_struct.size))
+            results.append((list(values[:k]), list(values[k:])))
+    return results
+
+
+def request_stats(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(STATS)
+        size, = struct.unpack('>I', _recv_exactly(sock, 4))
+        return json.loads(_recv_exactly(sock, size))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="nn_trained_layer.model")
+    parser.add_argument("--socket", default="./digits.sock")
+    parser.add_argument("-k", type=int, default=1,
+                        help="digits returned per image")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    args = parser.parse_args(argv)
+    server = InferenceServer(
+        load_layer(args.model), args.socket, k=args.k,
+        batch_window=args.batch_window, max_batch_size=args.max_batch_size)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
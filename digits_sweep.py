@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+"""Hyperparameter sweeps over nndigits and gadigits training.
+
+The swept hyperparameters are module level settings of the trainers:
+
+  learning_rate    nndigits.LEARNING_RATE
+  weight_range     gadigits.Weight range, (-weight_range, weight_range)
+  population_size  recognizers per digit of the DigitsRecognizer
+
+A search space maps parameter names to lists of values. 'grid' search runs
+every combination; 'random' search draws config.samples configurations,
+every parameter uniformly between its smallest and largest value.
+
+The configurations are trained by successive halving: all of them get
+config.min_budget units of training (nn: epochs, ga: generations) and are
+scored on the validation tail of the training set; the best 1 / eta go on
+with eta times the budget, continuing from their trained model, until
+config.max_budget. The runs execute on a process pool; every worker
+memory-maps the same dataset cache (see mnist_utils.open_dataset), and
+only the hyperparameters and the trained models travel between processes.
+"""
+
+import concurrent.futures
+import contextlib
+import csv
+import itertools
+import random
+import time
+from collections import namedtuple
+
+import numpy
+
+import instrumentation
+import nndigits
+from gadigits import DigitsRecognizer
+from gadigits import GAConfig
+from gadigits import Weight
+from mnist_pipeline import split_ranges
+from mnist_utils import mnist_filenames
+from mnist_utils import open_dataset
+
+
+METHODS = ('nn', 'ga')
+SEARCHES = ('grid', 'random')
+DEFAULT_SPACES = {
+    'nn': {"learning_rate": [0.01, 0.05, 0.2]},
+    'ga': {"weight_range": [8.0, 32.766], "population_size": [4, 8]},
+}
+DEFAULT_BUDGETS = {'nn': (1, 9), 'ga': (10, 90)}  # (min_budget, max_budget)
+INTEGER_PARAMETERS = ("population_size",)
+MAX_WEIGHT_RANGE = 32.766  # largest magnitude of both Weight signs
+
+SweepConfig = namedtuple(
+    "SweepConfig", [
+        "search",  # 'grid' or 'random'
+        "samples",  # random: configurations drawn
+        "min_budget",  # epochs / generations of the first rung
+        "max_budget",  # epochs / generations of the last rung
+        "eta",  # 1 / eta of the configurations survive a rung
+        "workers",  # processes (None: one per CPU, 0: in-process)
+        "seed",
+        "batch_size",  # nn minibatch / ga images per generation
+        "validation_fraction",  # tail of the training set used for scoring
+    ],
+    defaults=['grid', 10, None, None, 3, None, None, None, 1 / 6]
+)
+
+SweepResult = namedtuple(
+    "SweepResult", [
+        "parameters",  # dict of the configuration
+        "budget",  # epochs / generations trained before it stopped
+        "accuracy",  # validation accuracy at that budget
+        "seconds",  # wall-clock training and scoring time, all rungs
+    ]
+)
+
+_dataset = {}
+
+
+def sweep_configurations(space, search='grid', samples=10, rng=None):
+    """Return the list of parameter dicts of a grid or random search."""
+    names = sorted(space)
+    if search == 'grid':
+        return [
+            dict(zip(names, values))
+            for values in itertools.product(*(space[name] for name in names))
+        ]
+    if search != 'random':
+        raise ValueError("unknown search: {}".format(search))
+    rng = numpy.random.default_rng(rng)
+    configurations = []
+    for sample in range(samples):
+        parameters = {}
+        for name in names:
+            low, high = min(space[name]), max(space[name])
+            if name in INTEGER_PARAMETERS:
+                parameters[name] = int(rng.integers(low, high + 1))
+            else:
+                parameters[name] = float(rng.uniform(low, high))
+        configurations.append(parameters)
+    return configurations
+
+
+@contextlib.contextmanager
+def hyperparameters(parameters):
+    """Set the module level hyperparameters for the duration of a run."""
+    saved = nndigits.LEARNING_RATE, Weight.min_value, Weight.max_value
+    try:
+        if "learning_rate" in parameters:
+            nndigits.LEARNING_RATE = parameters["learning_rate"]
+        if "weight_range" in parameters:
+            weight_range = parameters["weight_range"]
+            Weight.min_value, Weight.max_value = -weight_range, weight_range
+        yield
+    finally:
+        nndigits.LEARNING_RATE, Weight.min_value, Weight.max_value = saved
+
+
+def _check_space(method, space):
+    if method not in METHODS:
+        raise ValueError("unknown method: {}".format(method))
+    for name, values in space.items():
+        if name not in DEFAULT_SPACES[method]:
+            raise ValueError("not a {} hyperparameter: {}".format(
+                method, name))
+        if not values:
+            raise ValueError("no values for {}".format(name))
+    for weight_range in space.get("weight_range", ()):
+        if not 0 < weight_range <= MAX_WEIGHT_RANGE:
+            raise ValueError("weight_range out of (0, {}]: {}".format(
+                MAX_WEIGHT_RANGE, weight_range))
+
+
+def _load_dataset(image_filename, label_filename):
+    _dataset["images"], _dataset["labels"] = open_dataset(
+        image_filename, label_filename)
+
+
+def _init_worker(image_filename, label_filename):
+    instrumentation.configure(instrumentation.QUIET)  # the parent reports
+    _load_dataset(image_filename, label_filename)
+
+
+def _train(method, parameters, state, start, stop, seed, config):
+    """Train one configuration from budget start to stop and score it.
+
+    state: the model returned by the previous rung (None: a new model)
+    Return the (state, validation accuracy, seconds) of the run.
+    """
+    start_time = time.perf_counter()
+    pixels = _dataset["images"].pixels
+    values = _dataset["labels"].values
+    (train_start, train_stop), validation_range = split_ranges(
+        min(len(pixels), len(values)), config.validation_fraction)
+    validation = slice(*validation_range)
+    random.seed(seed)
+    with hyperparameters(parameters):
+        if method == 'nn':
+            if state is None:
+                layer = nndigits.MatrixLayer.from_layer(
+                    nndigits.init_layer(pixels.shape[1]))
+            else:
+                layer = nndigits.MatrixLayer(state)
+            batch_size = config.batch_size or 32
+            for epoch in range(start, stop):
+                order = train_start + numpy.random.default_rng(
+                    [seed, epoch]).permutation(train_stop - train_start)
+                batches = (
+                    (pixels[batch], values[batch])
+                    for batch in (order[i:i + batch_size]
+                                  for i in range(0, len(order), batch_size))
+                )
+                nndigits.use_layer_batches(layer, batches, train=True)
+            evaluation = nndigits.evaluate_layer(
+                layer, pixels[validation], values[validation])
+            state = layer.weights
+        else:
+            if state is None:
+                recognizer = DigitsRecognizer(
+                    parameters.get("population_size", 4),
+                    dim=int(round(pixels.shape[1] ** 0.5)))
+            else:
+                recognizer = DigitsRecognizer.from_genes(state)
+            ga_config = GAConfig(generations=stop - start, seed=[seed, start])
+            if config.batch_size:
+                ga_config = ga_config._replace(batch_size=config.batch_size)
+            recognizer.train(pixels[train_start:train_stop],
+                             values[train_start:train_stop], ga_config)
+            evaluation = recognizer.evaluate(
+                pixels[validation], values[validation])
+            state = recognizer.genes
+    return state, evaluation.accuracy, time.perf_counter() - start_time
+
+
+def run_sweep(method, image_filename, label_filename, space=None,
+              config=SweepConfig()):
+    """Run a successive halving sweep; return its SweepResults, best first.
+
+    space: parameter name -> values (None: DEFAULT_SPACES[method])
+    Budgets and batch_size of None take the method defaults.
+    The results are ordered by budget reached, then validation accuracy.
+    """
+    space = DEFAULT_SPACES.get(method) if space is None else space
+    _check_space(method, space)
+    min_budget, max_budget = DEFAULT_BUDGETS[method]
+    min_budget = config.min_budget or min_budget
+    max_budget = max(config.max_budget or max_budget, min_budget)
+    if config.eta < 2:
+        raise ValueError("eta must be at least 2")
+    rng = numpy.random.default_rng(config.seed)
+    configurations = sweep_configurations(
+        space, config.search, config.samples, rng)
+    seeds = [
+        int(seed.generate_state(1)[0])
+        for seed in numpy.random.SeedSequence(config.seed).spawn(
+            len(configurations))
+    ]
+    # build (or validate) the cache once, before the workers map it
+    open_dataset(image_filename, label_filename)
+
+    states = [None] * len(configurations)
+    budgets = [0] * len(configurations)
+    accuracies = [0.0] * len(configurations)
+    seconds = [0.0] * len(configurations)
+    alive = list(range(len(configurations)))
+    budget = min_budget
+    if config.workers == 0:
+        _load_dataset(image_filename, label_filename)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=config.workers, initializer=_init_worker,
+            initargs=(image_filename, label_filename))
+    try:
+        rung = 0
+        while alive:
+            arguments = [
+                (method, configurations[i], states[i], budgets[i], budget,
+                 seeds[i], config)
+                for i in alive
+            ]
+            if executor is None:
+                runs = [_train(*run_arguments) for run_arguments in arguments]
+            else:
+                runs = [
+                    future.result() for future in [
+                        executor.submit(_train, *run_arguments)
+                        for run_arguments in arguments
+                    ]
+                ]
+            for i, (state, accuracy, run_seconds) in zip(alive, runs):
+                states[i] = state
+                budgets[i] = budget
+                accuracies[i] = accuracy
+                seconds[i] += run_seconds
+            instrumentation.count("sweep.runs", len(alive))
+            instrumentation.info(
+                "rung {}: budget {}, {} configurations, best accuracy: {:.3f}",
+                rung, budget, len(alive), max(accuracies[i] for i in alive))
+            if budget >= max_budget or len(alive) == 1:
+                break
+            alive = sorted(alive, key=lambda i: -accuracies[i])[
+                :max(len(alive) // config.eta, 1)]
+            budget = min(budget * config.eta, max_budget)
+            rung += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    order = sorted(range(len(configurations)),
+                   key=lambda i: (-budgets[i], -accuracies[i]))
+    return [
+        SweepResult(configurations[i], budgets[i], accuracies[i], seconds[i])
+        for i in order
+    ]
+
+
+def results_table(results):
+    """Return the header and the rows of the results table."""
+    names = sorted({name for result in results for name in result.parameters})
+    header = [*names, "budget", "accuracy", "seconds"]
+    rows = [
+        [*(result.parameters.get(name, "") for name in names),
+         result.budget, result.accuracy, result.seconds]
+        for result in results
+    ]
+    return header, rows
+
+
+def write_results(results, filename):
+    """Write the results table as CSV."""
+    header, rows = results_table(results)
+    with open(filename, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def print_results(results):
+    header, rows = results_table(results)
+    cells = [header] + [
+        ['{:.4g}'.format(value) if isinstance(value, float) else str(value)
+         for value in row]
+        for row in rows
+    ]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    for row in cells:
+        instrumentation.info('  '.join(
+            value.rjust(width) for value, width in zip(row, widths)))
+
+
+def sweep(method, data_dir=".", space=None, config=SweepConfig(),
+          results_filename=None):
+    """Sweep on the training set of data_dir; print (and save) the table."""
+    results = run_sweep(
+        method, *mnist_filenames("train", data_dir), space=space,
+        config=config)
+    print_results(results)
+    if results_filename:
+        write_results(results, results_filename)
+    return results
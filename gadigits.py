@@ -2,19 +2,40 @@
 
 """Experimenting with Genetic Algorithms using the MNIST data set.
 
-Note: download and extract data files from http://yann.lecun.com/exdb/mnist/
+Note: download data files from http://yann.lecun.com/exdb/mnist/ (extracting
+them is optional, the .gz files are read directly)
   train-images-idx3-ubyte.gz:  training set images (9912422 bytes)
   train-labels-idx1-ubyte.gz:  training set labels (28881 bytes)
   t10k-images-idx3-ubyte.gz:   test set images (1648877 bytes)
   t10k-labels-idx1-ubyte.gz:   test set labels (4542 bytes)
 """
 
+import math
 import os
-import pickle
 import random
+import time
+from collections import namedtuple
 
-from mnist_utils import read_image_file
-from mnist_utils import read_label_file
+import numpy
+
+import instrumentation
+import model_io
+from mnist_augment import augment_images
+from mnist_evaluation import evaluate
+from mnist_evaluation import print_evaluation
+from mnist_evaluation import save_evaluation
+from mnist_utils import active_pixels
+from mnist_utils import bw_bits_as_array
+from mnist_utils import images_as_array
+from mnist_utils import labels_as_array
+from mnist_utils import mnist_filenames
+from mnist_utils import open_dataset
+from mnist_utils import pack_bw_pixels
+from mnist_utils import top_k_predictions
+from mnist_utils import unpack_bw_bits
+
+
+MODEL_FILENAME = "ga_trained_recognizers.model"
 
 
 class Weight():
@@ -33,6 +54,107 @@ class Weight():
         return 'Weight({})'.format(self.as_number)
 
 
+class Genome():
+    """Weights packed as uint16 genes using the Weight encoding.
+
+    Gene i holds the 16 bits of Weight(...).as_string of weight i, so the
+    genes of a DigitRecognizer are its weights_combined string in 2 bytes
+    per weight instead of 16 characters.
+    """
+
+    def __init__(self, genes):
+        self.genes = numpy.asarray(genes, dtype=numpy.uint16)
+
+    @classmethod
+    def from_numbers(cls, numbers):
+        numbers = numpy.asarray(numbers, dtype=numpy.float64)
+        return cls(numpy.trunc(numbers * 1000 + 32766))
+
+    @classmethod
+    def from_weights(cls, weights):
+        return cls([int(weight.as_string, base=2) for weight in weights])
+
+    @classmethod
+    def from_string(cls, weights_combined):
+        return cls([
+            int(weights_combined[i:i + 16], base=2)
+            for i in range(0, len(weights_combined), 16)
+        ])
+
+    def as_numbers(self):
+        return (self.genes.astype(numpy.float64) - 32766) / 1000
+
+    def clamped(self):
+        """Return the genome with every weight within the Weight range.
+
+        Crossover and mutation work on bits, so with a narrowed range (see
+        digits_sweep.hyperparameters) they make genes outside of it.
+        """
+        lowest = max(math.ceil(round(Weight.min_value * 1000, 6)) + 32766, 0)
+        highest = min(
+            math.floor(round(Weight.max_value * 1000, 6)) + 32766, 0xFFFF)
+        if lowest == 0 and highest == 0xFFFF:
+            return self
+        return Genome(numpy.clip(self.genes, lowest, highest))
+
+    def as_string(self):
+        return ''.join(format(gene, '016b') for gene in self.genes.tolist())
+
+    def as_weights(self):
+        return [Weight(format(gene, '016b')) for gene in self.genes.tolist()]
+
+    def __len__(self):
+        return len(self.genes)
+
+    def __eq__(self, other):
+        return (isinstance(other, Genome) and
+                numpy.array_equal(self.genes, other.genes))
+
+    def __str__(self):
+        return 'Genome({})'.format(self.as_numbers().tolist())
+
+
+def single_point_crossover(parent1, parent2, rng=None):
+    """Swap the tails of the two bit strings after a random bit position."""
+    rng = rng or numpy.random.default_rng()
+    point = int(rng.integers(1, len(parent1) * 16))
+    index, bit = divmod(point, 16)
+    mask = numpy.zeros(len(parent1), dtype=numpy.uint16)
+    mask[:index] = 0xFFFF
+    if bit:
+        mask[index] = (0xFFFF << (16 - bit)) & 0xFFFF
+    return _crossover(parent1, parent2, mask)
+
+
+def uniform_crossover(parent1, parent2, rng=None):
+    """Take every bit from either parent with equal probability."""
+    rng = rng or numpy.random.default_rng()
+    mask = rng.integers(0, 1 << 16, size=len(parent1), dtype=numpy.uint16)
+    return _crossover(parent1, parent2, mask)
+
+
+def _crossover(parent1, parent2, mask):
+    genes1, genes2 = parent1.genes, parent2.genes
+    return (Genome((genes1 & mask) | (genes2 & ~mask)).clamped(),
+            Genome((genes2 & mask) | (genes1 & ~mask)).clamped())
+
+
+def mutate(genome, rate, rng=None):
+    """Flip every bit of the genome with the given probability.
+
+    The genes are then clamped to the Weight range, see Genome.clamped().
+    """
+    rng = rng or numpy.random.default_rng()
+    bit_count = len(genome) * 16
+    flip_count = rng.binomial(bit_count, rate)
+    positions = rng.choice(bit_count, size=flip_count, replace=False)
+    genes = genome.genes.copy()
+    numpy.bitwise_xor.at(
+        genes, positions // 16,
+        (1 << (15 - positions % 16)).astype(numpy.uint16))
+    return Genome(genes).clamped()
+
+
 class DigitRecognizer():
     def __init__(self, digit, dim=28):
         self.digit = digit
@@ -40,21 +162,41 @@ class DigitRecognizer():
         self.weights = self.get_init_weight()
         self.weights_combined = ''.join(x.as_string for x in self.weights)
 
+    @classmethod
+    def from_genome(cls, digit, genome):
+        dr = cls.__new__(cls)
+        dr.digit = digit
+        dr.dim = int(len(genome) ** 0.5)
+        dr.weights = genome.as_weights()
+        dr.weights_combined = genome.as_string()
+        return dr
+
+    @property
+    def genome(self):
+        return Genome.from_weights(self.weights)
+
     def fit(self, mnist_image):
-        """Return fitness in range [-1, 1]."""
+        """Return fitness in range [-1, 1].
+
+        Pixels are black or white, so only the weights of the white pixels
+        are summed; every pixel adds -min_value / (max_value - min_value).
+        """
 
+        tracing = instrumentation.tracing
+        weights = self.weights
         summa = 0
-        for pixel, weight in zip(mnist_image.bw_pixels, self.weights):
-            print("weight = {}".format(weight))
-            val = (
-                (pixel * weight.as_number - Weight.min_value) /
-                (Weight.max_value - Weight.min_value)
-            )
-            print("val = {}".format(val))
-            summa += val
-        summa /= len(self.weights)
+        for i in active_pixels(mnist_image):
+            if tracing:
+                instrumentation.trace("weight = {}", weights[i])
+            summa += weights[i].as_number
+        size = len(weights)
+        summa = (
+            (summa - size * Weight.min_value) /
+            (Weight.max_value - Weight.min_value)
+        )
+        summa /= size
         summa = summa * 2 - 1
-        print("==> summa = {}".format(summa))
+        instrumentation.trace("==> summa = {}", summa)
         return summa
 
     def get_init_weight(self):
@@ -70,9 +212,14 @@ class DigitRecognizer():
 
 
 class DigitRecognizers():
-    def __init__(self, digit):
+    def __init__(self, digit, size=4, dim=2):
         self.digit = digit
-        self.digit_recognizers = [DigitRecognizer(digit=digit, dim=2) for i in range(4)]
+        self.digit_recognizers = [DigitRecognizer(digit=digit, dim=dim) for i in range(size)]
+
+    @property
+    def best(self):
+        """The fittest recognizer (populations are kept sorted by train)."""
+        return self.digit_recognizers[0]
 
     def __str__(self):
         return 'DigitRecognizers(digit={}, recognizers=[{}])'.format(
@@ -80,16 +227,400 @@ class DigitRecognizers():
             ', '.join(str(dr) for dr in self.digit_recognizers))
 
 
+GAConfig = namedtuple(
+    "GAConfig", [
+        "generations",  # maximum number of generations
+        "selection",  # 'tournament' or 'roulette'
+        "tournament_size",
+        "crossover",  # 'single_point' or 'uniform'
+        "crossover_rate",
+        "mutation_rate",  # probability of flipping a bit
+        "elite_count",  # best individuals copied unchanged
+        "batch_size",  # random images per generation (None: all images)
+        "plateau_generations",  # stop after this many without improvement
+        "plateau_tolerance",
+        "workers",  # fitness worker processes (None: in-process)
+        "seed",
+        "incremental",  # score per batch, not per image (IncrementalFitness)
+        "batch_refresh",  # incremental: new batch every N generations
+        "islands",  # island processes (None: a single population)
+        "migration_interval",  # islands: generations between migrations
+        "migration_count",  # islands: elite individuals sent per digit
+        "topology",  # islands: 'ring', 'complete' or 'random'
+        "augment",  # AugmentConfig: train on augmented minibatches
+        "augment_workers",  # augment: threads (0: on the training thread)
+    ],
+    defaults=[
+        100, 'tournament', 3, 'uniform', 0.9, 0.001, 1, 1000,
+        20, 1e-4, None, None, False, 1,
+        None, 10, 1, 'ring',
+        None, 0,
+    ]
+)
+
+
+def tournament_selection(fitness, count, rng, tournament_size=3):
+    """Return indices of the winners of count random tournaments."""
+    contestants = rng.integers(0, len(fitness), size=(count, tournament_size))
+    winners = numpy.argmax(fitness[contestants], axis=1)
+    return contestants[numpy.arange(count), winners]
+
+
+def roulette_selection(fitness, count, rng):
+    """Return count indices drawn proportionally to the (shifted) fitness."""
+    shifted = fitness - fitness.min() + 1e-9
+    return rng.choice(len(fitness), size=count, p=shifted / shifted.sum())
+
+
+def recognition_fitness(image_fitness, is_digit):
+    """Score recognizers by how much better they fit their own digit.
+
+    image_fitness: (recognizers, images) output of fit_population()
+    is_digit: (images,) bool mask of the images showing the digit
+    """
+    def mean_over(mask):
+        if not mask.any():
+            return numpy.zeros(len(image_fitness))
+        return image_fitness[:, mask].mean(axis=1)
+    return mean_over(is_digit) - mean_over(~is_digit)
+
+
 class DigitsRecognizer():
-    def __init__(self):
-        self.digits_recognizers = [DigitRecognizers(i) for i in range(10)]
+    """The populations of recognizers of the 10 digits.
+
+    They are kept as (digits, recognizers, pixels) uint16 genes, and the
+    DigitRecognizers (with their Weight objects) are only built when
+    digits_recognizers is read; from then on they hold the populations.
+    """
+
+    def __init__(self, population_size=4, dim=28):
+        # the same draws as DigitRecognizer.get_init_weight()
+        self.genes = [
+            [
+                Genome.from_numbers([
+                    random.uniform(Weight.min_value, Weight.max_value)
+                    for pixel in range(dim ** 2)
+                ]).genes
+                for i in range(population_size)
+            ]
+            for digit in range(10)
+        ]
+
+    @classmethod
+    def from_genes(cls, genes):
+        """Build from (digits, recognizers, pixels) genes, see genes."""
+        digits_recognizer = cls.__new__(cls)
+        digits_recognizer.genes = genes
+        return digits_recognizer
+
+    @property
+    def digits_recognizers(self):
+        if self._digits_recognizers is None:
+            digits_recognizers = []
+            for digit, digit_genes in enumerate(self._genes):
+                drs = DigitRecognizers.__new__(DigitRecognizers)
+                drs.digit = digit
+                drs.digit_recognizers = [
+                    DigitRecognizer.from_genome(
+                        digit, Genome(recognizer_genes))
+                    for recognizer_genes in digit_genes
+                ]
+                digits_recognizers.append(drs)
+            self.digits_recognizers = digits_recognizers
+        return self._digits_recognizers
+
+    @digits_recognizers.setter
+    def digits_recognizers(self, digits_recognizers):
+        self._digits_recognizers = digits_recognizers
+        self._genes = None
+
+    @property
+    def genes(self):
+        """The (digits, recognizers, pixels) uint16 genes of all genomes."""
+        if self._genes is not None:
+            return self._genes
+        return numpy.array([
+            [dr.genome.genes for dr in drs.digit_recognizers]
+            for drs in self._digits_recognizers
+        ], dtype=numpy.uint16)
+
+    @genes.setter
+    def genes(self, genes):
+        self._genes = numpy.array(genes, dtype=numpy.uint16)
+        self._digits_recognizers = None
+
+    def train(self, images, labels, config=GAConfig()):
+        """Evolve the population of every digit in a generational GA.
+
+        All 10 populations are scored together against the same random
+        minibatch of images each generation. A digit stops evolving after
+        config.plateau_generations generations without improvement.
+
+        With config.incremental, every minibatch is reduced to one affine
+        function of the weights per digit, and children are scored from the
+        fitness of a parent (see gafitness.IncrementalFitness); this path is
+        always evaluated in-process. The minibatch is resampled every
+        config.batch_refresh generations (never if None).
+
+        With config.augment, every minibatch is replaced by randomly
+        augmented copies (see mnist_augment) when it is drawn, on
+        config.augment_workers threads; this path is also evaluated
+        in-process.
+
+        With config.islands, the populations are evolved by an island model
+        instead (see gaislands.train_islands).
+        Return the list of per-generation best fitness values per digit.
+        """
+        if config.islands:
+            from gaislands import train_islands
 
-    def train(self, images, labels):
-        pass
+            return train_islands(self, images, labels, config)
 
-    def test(self, images, labels):
-        # print recognized digits as top list with probability/confidence
-        pass
+        self.genes, history = self._train_genes(
+            self.genes, images, labels, config)
+        return history
+
+    @classmethod
+    def _train_genes(cls, genes, images, labels, config):
+        """train() of (digits, recognizers, pixels) genes, without islands.
+
+        Return the trained genes and the history.
+        """
+        # imported here: gafitness depends on this module
+        from gafitness import FitnessEvaluator
+        from gafitness import IncrementalFitness
+        from gafitness import fit_population
+
+        rng = numpy.random.default_rng(config.seed)
+        pixels = images_as_array(images)
+        values = labels_as_array(labels)
+        populations = [
+            [Genome(recognizer_genes) for recognizer_genes in digit_genes]
+            for digit_genes in genes
+        ]
+        history = [[] for digit in range(10)]
+        best_fitness = [-numpy.inf] * 10
+        stale_generations = [0] * 10
+        evaluator = None
+        if config.workers and not config.incremental and not config.augment:
+            evaluator = FitnessEvaluator(pixels, max_workers=config.workers)
+        else:
+            bw_bits = bw_bits_as_array(images)
+        incremental = None
+        population_fitness = [None] * 10
+
+        start_time = time.perf_counter()
+        generation = 0
+        try:
+            while generation < config.generations:
+                active = [
+                    digit for digit in range(10)
+                    if stale_generations[digit] < config.plateau_generations
+                ]
+                if not active:
+                    break
+                if (not config.incremental or incremental is None or
+                        (config.batch_refresh and
+                         generation % config.batch_refresh == 0)):
+                    indices = None
+                    if config.batch_size and config.batch_size < len(values):
+                        indices = numpy.sort(rng.choice(
+                            len(values), size=config.batch_size,
+                            replace=False))
+                    batch_values = (
+                        values if indices is None else values[indices])
+                    if evaluator is None:
+                        batch_bits = (
+                            bw_bits if indices is None else bw_bits[indices])
+                    if config.augment:
+                        dim = int(pixels.shape[1] ** 0.5)
+                        batch_bits = pack_bw_pixels(augment_images(
+                            pixels if indices is None else pixels[indices],
+                            dim, dim, config.augment,
+                            seed=rng.integers(2 ** 63),
+                            workers=config.augment_workers))
+                    if config.incremental:
+                        incremental = IncrementalFitness(unpack_bw_bits(
+                            batch_bits, pixels.shape[1]), batch_values)
+                        population_fitness = [None] * 10
+
+                image_fitness = {}
+                if incremental is not None:
+                    for digit in active:
+                        if population_fitness[digit] is None:
+                            population_fitness[digit] = incremental.fitness(
+                                digit, [genome.as_numbers()
+                                        for genome in populations[digit]])
+                else:
+                    weights = numpy.concatenate([
+                        [genome.as_numbers() for genome in populations[digit]]
+                        for digit in active
+                    ])
+                    if evaluator is not None:
+                        stacked = evaluator.evaluate(weights, indices)
+                    else:
+                        stacked = fit_population(
+                            weights, batch_bits, packed=True)
+                    offset = 0
+                    for digit in active:
+                        size = len(populations[digit])
+                        image_fitness[digit] = stacked[offset:offset + size]
+                        offset += size
+
+                for digit in active:
+                    population = populations[digit]
+                    if incremental is not None:
+                        fitness = population_fitness[digit]
+                    else:
+                        fitness = recognition_fitness(
+                            image_fitness[digit], batch_values == digit)
+                    history[digit].append(float(fitness.max()))
+                    if fitness.max() > (best_fitness[digit] +
+                                        config.plateau_tolerance):
+                        best_fitness[digit] = float(fitness.max())
+                        stale_generations[digit] = 0
+                    else:
+                        stale_generations[digit] += 1
+                    populations[digit], parents = cls._next_generation(
+                        population, fitness, config, rng)
+                    if incremental is not None:
+                        population_fitness[digit] = (
+                            incremental.derive_population(
+                                digit, population, fitness,
+                                populations[digit], parents))
+                generation += 1
+                if generation % 10 == 0:
+                    cls._print_progress(generation, history, start_time)
+        finally:
+            if evaluator is not None:
+                evaluator.close()
+        if generation == 0 or generation % 10:  # else printed in the loop
+            cls._print_progress(generation, history, start_time)
+
+        # last generation is unscored: keep the scored elite in front
+        return numpy.array([
+            [genome.genes for genome in population]
+            for population in populations
+        ]), history
+
+    @staticmethod
+    def _next_generation(population, fitness, config, rng):
+        """Return the next population and the parent indices per member."""
+        order = numpy.argsort(fitness)[::-1]
+        elite_count = min(config.elite_count, len(population))
+        next_population = [population[i] for i in order[:elite_count]]
+        next_parents = [(i,) for i in order[:elite_count]]
+        offspring_count = len(population) - elite_count
+        if config.selection == 'roulette':
+            parents = roulette_selection(fitness, offspring_count + 1, rng)
+        else:
+            parents = tournament_selection(
+                fitness, offspring_count + 1, rng, config.tournament_size)
+        if config.crossover == 'single_point':
+            crossover = single_point_crossover
+        else:
+            crossover = uniform_crossover
+        for i in range(0, offspring_count, 2):
+            parent1 = population[parents[i]]
+            parent2 = population[parents[i + 1]]
+            if rng.random() < config.crossover_rate:
+                children = crossover(parent1, parent2, rng)
+                child_parents = [(parents[i], parents[i + 1])] * 2
+            else:
+                children = (parent1, parent2)
+                child_parents = [(parents[i],), (parents[i + 1],)]
+            for child, its_parents in list(zip(
+                    children, child_parents))[:offspring_count - i]:
+                next_population.append(
+                    mutate(child, config.mutation_rate, rng))
+                next_parents.append(its_parents)
+        return next_population, next_parents
+
+    @staticmethod
+    def _print_progress(generation, history, start_time):
+        elapsed = time.perf_counter() - start_time
+        instrumentation.info(
+            "generation {} ({:.1f} generations/sec), best fitness: {}",
+            generation,
+            generation / elapsed if elapsed else 0.0,
+            ' '.join('{:.3f}'.format(h[-1]) if h else '-' for h in history))
+
+    def get_scores(self, images):
+        """Return the (images, 10) fitness of the best recognizer per digit."""
+        from gafitness import fit_population
+
+        if self._genes is None:
+            weights = [
+                drs.best.genome.as_numbers()
+                for drs in self._digits_recognizers
+            ]
+        else:
+            weights = Genome(self._genes[:, 0]).as_numbers()
+        return fit_population(
+            weights, bw_bits_as_array(images), packed=True).T
+
+    def predict_batch(self, images, k=1):
+        """Return the (images, k) top digits and their fitness as scores."""
+        return top_k_predictions(self.get_scores(images), k)
+
+    def evaluate(self, images, labels, k=3):
+        """Return the mnist_evaluation.Evaluation on the images."""
+        return evaluate(self.get_scores(images), labels, k)
+
+    def test(self, images, labels, k=3):
+        """Print the overall success rate and return it.
+
+        When tracing, every 100th misrecognized image is printed with its
+        top k list of digits and fitness values.
+        """
+        values = labels_as_array(labels)
+        digits, scores = self.predict_batch(images, k)
+        errors = numpy.flatnonzero(digits[:, 0] != values)
+        if instrumentation.tracing:
+            for error_index in errors[99::100]:
+                instrumentation.trace(
+                    "Prediction: {}, actual: {} at testing image {}",
+                    ', '.join('{} ({:.3f})'.format(digit, score)
+                              for digit, score in zip(digits[error_index],
+                                                      scores[error_index])),
+                    values[error_index],
+                    error_index)
+        error_count = len(errors)
+        success_rate = 1 - error_count / len(values)
+        instrumentation.info(
+            "Overall success rate: {:.02} "
+            "(error count: {}, image count: {}) [test]",
+            success_rate, error_count, len(values))
+        return success_rate
+
+
+def save_recognizers(digits_recognizer, filename):
+    """Save the genes of every population as uint16 model file."""
+    model_io.save_model(
+        filename, model_io.GA_RECOGNIZERS, digits_recognizer.genes)
+
+
+def load_recognizer_genes(filename):
+    """Return the memory-mapped (digits, recognizers, pixels) genes."""
+    return model_io.load_model(filename, model_io.GA_RECOGNIZERS)
+
+
+def load_recognizers(filename):
+    return DigitsRecognizer.from_genes(load_recognizer_genes(filename))
+
+
+def predict_with_genes(genes, images, k=1):
+    """predict_batch() straight from memory-mapped model genes.
+
+    Only the best (first) recognizer of every digit is decoded, so no
+    Weight objects are built.
+    """
+    from gafitness import fit_population
+
+    weights = [Genome(digit_genes[0]).as_numbers() for digit_genes in genes]
+    scores = fit_population(
+        weights, bw_bits_as_array(images), packed=True).T
+    return top_k_predictions(scores, k)
 
 
 def main():
@@ -97,30 +628,45 @@ def main():
     test_recognizers(digits_recognizer)
 
 
-def train_recognizers():
-    pickle_filename = "ga_trained_recognizers.dat"
+def train_recognizers(data_dir=".", model_filename=MODEL_FILENAME,
+                      config=GAConfig(), population_size=4, retrain=False,
+                      bbox=None):
+    """Load the trained recognizers or train (and save) new ones.
+
+    With bbox, the bounding-box images of that size are used (see
+    mnist_filenames).
+    """
     trained_recognizers = None
-    if os.path.isfile(pickle_filename):
-        print("Found pickle file: {}".format(pickle_filename))
-        with open(pickle_filename, "rb") as file_obj:
-            trained_recognizers = pickle.load(file_obj)
+    if os.path.isfile(model_filename) and not retrain:
+        instrumentation.info("Found model file: {}", model_filename)
+        trained_recognizers = load_recognizers(model_filename)
     else:
-        print("Could not find pickle file: {}".format(pickle_filename))
-        dr = DigitsRecognizer()
-
-        train_images = read_image_file("./train-images-idx3-ubyte")
-        train_labels = read_label_file("./train-labels-idx1-ubyte")
-        dr.train(train_images, train_labels)
-        # with open(pickle_filename, "wb") as file_obj:
-        #     pickle.dump(dr, file_obj)
+        instrumentation.info("Training model: {}", model_filename)
+        train_images, train_labels = open_dataset(
+            *mnist_filenames("train", data_dir, bbox))
+        dr = DigitsRecognizer(
+            population_size=population_size,
+            dim=train_images.header.imgWidth)
+        dr.train(train_images, train_labels, config)
+        save_recognizers(dr, model_filename)
         trained_recognizers = dr
     return trained_recognizers
 
 
-def test_recognizers(digits_recognizer):
-    test_images = read_image_file("./t10k-images-idx3-ubyte")
-    test_labels = read_label_file("./t10k-labels-idx1-ubyte")
-    digits_recognizer.test(test_images, test_labels)
+def test_recognizers(digits_recognizer, data_dir=".", evaluation_filename=None,
+                     k=3, bbox=None):
+    """Evaluate on the test set, print and return the Evaluation.
+
+    With an evaluation_filename, the Evaluation is also saved as JSON.
+    With bbox, the bounding-box test images of that size are used.
+    """
+    test_images, test_labels = open_dataset(
+        *mnist_filenames("test", data_dir, bbox))
+    evaluation = digits_recognizer.evaluate(test_images, test_labels, k)
+    print_evaluation(evaluation)
+    if evaluation_filename:
+        save_evaluation(evaluation, evaluation_filename)
+    return evaluation
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""Vectorized and parallel fitness evaluation of DigitRecognizer populations.
+
+DigitRecognizer.fit() scores one recognizer against one image; here a whole
+population (one row of weights per recognizer) is scored against a batch of
+images with a single matrix product, and population shards can be spread
+over worker processes that share the black/white image matrix through
+shared memory.
+"""
+
+import concurrent.futures
+
+import numpy
+
+import instrumentation
+from gadigits import Weight
+from mnist_utils import pack_bw_pixels
+from mnist_utils import unpack_bw_bits
+from shared_array import SharedArray
+
+
+CHUNK_SIZE = 4096  # images per matrix product (bounds temporary memory)
+
+
+def population_weights(recognizers):
+    """Return the (len(recognizers), dim**2) weight matrix."""
+    return numpy.array(
+        [[weight.as_number for weight in dr.weights] for dr in recognizers],
+        dtype=numpy.float64)
+
+
+def fit_population(weights, bw_pixels, chunk_size=CHUNK_SIZE, packed=False):
+    """Vectorized DigitRecognizer.fit() of every recognizer on every image.
+
+    weights: (recognizers, pixels) float matrix
+    bw_pixels: (images, pixels) 0/1 matrix, or with packed the (images,
+        bytes) pack_bw_pixels() rows, unpacked one chunk at a time
+    Return (recognizers, images) fitness matrix in range [-1, 1].
+    """
+    weights = numpy.asarray(weights, dtype=numpy.float64)
+    size = weights.shape[1]
+    summa = numpy.empty((len(weights), len(bw_pixels)))
+    with instrumentation.timer("fit"):
+        for start in range(0, len(bw_pixels), chunk_size):
+            chunk = bw_pixels[start:start + chunk_size]
+            if packed:
+                chunk = unpack_bw_bits(chunk, size)
+            chunk = chunk.astype(numpy.float64)
+            summa[:, start:start + chunk_size] = weights @ chunk.T
+    instrumentation.count("fit.evaluations", summa.size)
+    return fitness_from_sums(summa, size)
+
+
+def fitness_from_sums(summa, size):
+    """Map sums of pixel * weight over `size` pixels to fit() fitness."""
+    summa = summa - size * Weight.min_value
+    summa /= (Weight.max_value - Weight.min_value) * size
+    return summa * 2 - 1
+
+
+class IncrementalFitness:
+    """Recognition fitness of individuals against a fixed image batch.
+
+    fit() is affine in sum(pixel * weight) per image, and the recognition
+    fitness of a digit (see gadigits.recognition_fitness) is a difference of
+    two means of fit(), so it is affine in the weights too:
+    weights @ scales[digit] + offsets[digit]. The batch is reduced to these
+    once, and an individual costs one dot product over its pixels instead
+    of one per image. A child is scored from the fitness of a parent plus
+    the contribution of the genes in which it differs.
+    """
+
+    def __init__(self, bw_pixels, values):
+        bw_pixels = numpy.asarray(bw_pixels, dtype=numpy.float64)
+        values = numpy.asarray(values)
+        self.size = bw_pixels.shape[1]
+        is_digit = (numpy.arange(10)[:, None] == values).astype(
+            numpy.float64)
+        with instrumentation.timer("fit"):
+            digit_sums = is_digit @ bw_pixels
+        other_sums = digit_sums.sum(axis=0) - digit_sums
+        digit_counts = is_digit.sum(axis=1)
+        other_counts = len(values) - digit_counts
+        # d fit / d sum, see fitness_from_sums(); the mean of no images is 0
+        slope = 2 / ((Weight.max_value - Weight.min_value) * self.size)
+        self.scales = slope * (_mean(digit_sums, digit_counts) -
+                               _mean(other_sums, other_counts))
+        self.offsets = fitness_from_sums(numpy.zeros(1), self.size) * (
+            (digit_counts > 0).astype(numpy.float64) - (other_counts > 0))
+
+    def fitness(self, digit, weights):
+        """Return the recognition fitness of (recognizers, pixels) weights."""
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        instrumentation.count("fit.individuals", len(weights))
+        return weights @ self.scales[digit] + self.offsets[digit]
+
+    def derive(self, digit, parent_fitness, parent, child):
+        """Return the fitness of child genome from that of parent genome."""
+        return self.derive_population(
+            digit, [parent], [parent_fitness], [child], [(0,)])[0]
+
+    def derive_population(self, digit, population, population_fitness,
+                          next_population, parents):
+        """Return the fitness of next_population.
+
+        parents holds, per new individual, the indices of its (one or two)
+        parents in population; it is derived from its first parent.
+        """
+        base = numpy.array([its_parents[0] for its_parents in parents])
+        genes = numpy.array([genome.genes for genome in population])[base]
+        child_genes = numpy.array(
+            [genome.genes for genome in next_population])
+        # see Genome.as_numbers(); unchanged genes add nothing
+        deltas = (child_genes.astype(numpy.int32) - genes) / 1000
+        return (numpy.asarray(population_fitness)[base] +
+                deltas @ self.scales[digit])
+
+
+def _mean(sums, counts):
+    return numpy.divide(sums, counts[:, None], out=numpy.zeros_like(sums),
+                        where=counts[:, None] > 0)
+
+
+_worker_images = None  # SharedArray, keeps the segment mapped
+
+
+def _init_worker(spec):
+    global _worker_images
+    _worker_images = SharedArray(*spec)
+
+
+def _fit_shard(weights, image_indices):
+    images = _worker_images.array
+    if image_indices is not None:
+        images = images[image_indices]
+    return fit_population(weights, images, packed=True)
+
+
+class FitnessEvaluator:
+    """Score populations against a fixed image set on a process pool.
+
+    The black/white pixels are packed (8 per byte) once into shared memory;
+    workers map the same segment, so only weight shards and results are
+    pickled.
+    Use as a context manager (or call close()) to release the pool and the
+    shared memory segment.
+    """
+
+    def __init__(self, pixels, max_workers=None):
+        self._shared = SharedArray.copy_of(pack_bw_pixels(pixels))
+        self.bw_bits = self._shared.array
+        self.shape = self._shared.shape
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(self._shared.spec,))
+        self.max_workers = self._executor._max_workers
+
+    def __len__(self):
+        return self.shape[0]
+
+    def evaluate(self, weights, image_indices=None):
+        """Return the (recognizers, images) fitness matrix.
+
+        image_indices optionally selects a minibatch of the image set.
+        """
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        shards = [
+            shard for shard in numpy.array_split(weights, self.max_workers)
+            if len(shard)
+        ]
+        futures = [
+            self._executor.submit(_fit_shard, shard, image_indices)
+            for shard in shards
+        ]
+        return numpy.concatenate([future.result() for future in futures])
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            del self.bw_bits
+            self._shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""Island-model GA: DigitsRecognizer.train() on several islands at once.
+
+Every island evolves its own population of every digit in a worker process,
+for config.migration_interval generations per round. Between two rounds the
+best config.migration_count individuals of every digit migrate to the
+neighbouring islands of the topology, where they replace the newest
+offspring. The populations are kept in the order train() leaves them:
+scored elite first, then unscored offspring; so only the elite is known
+to be best, and at most config.elite_count individuals migrate.
+
+  'ring'      island i sends to island i + 1
+  'complete'  every island sends to every other island
+  'random'    every island sends to one other island, drawn every round
+
+The images are copied once into shared memory; only the genes of the
+islands travel between the parent and the workers.
+"""
+
+import concurrent.futures
+
+import numpy
+
+import instrumentation
+from gadigits import DigitsRecognizer
+from mnist_utils import images_as_array
+from mnist_utils import labels_as_array
+from shared_array import SharedArray
+
+
+TOPOLOGIES = ('ring', 'complete', 'random')
+
+_worker_arrays = {}  # the SharedArray objects keep the segments mapped
+
+
+def migration_targets(topology, islands, rng):
+    """Return the list of destination islands of every island."""
+    if islands < 2:
+        return [[] for island in range(islands)]
+    if topology == 'ring':
+        return [[(island + 1) % islands] for island in range(islands)]
+    if topology == 'complete':
+        return [
+            [other for other in range(islands) if other != island]
+            for island in range(islands)
+        ]
+    if topology == 'random':
+        return [
+            [(island + int(rng.integers(1, islands))) % islands]
+            for island in range(islands)
+        ]
+    raise ValueError("unknown topology: {}".format(topology))
+
+
+def migrate(island_genes, targets, count, keep=1):
+    """Copy the first count individuals of every digit along targets.
+
+    island_genes: per island (digits, recognizers, pixels) genes, changed
+    in place; the first `keep` individuals of an island are never replaced.
+    """
+    migrants = [genes[:, :count].copy() for genes in island_genes]
+    arrivals = [[] for genes in island_genes]
+    for source, destinations in enumerate(targets):
+        for destination in destinations:
+            arrivals[destination].append(migrants[source])
+    for genes, island_arrivals in zip(island_genes, arrivals):
+        if not island_arrivals:
+            continue
+        incoming = numpy.concatenate(island_arrivals, axis=1)
+        incoming = incoming[:, :max(genes.shape[1] - keep, 0)]
+        if incoming.shape[1]:
+            genes[:, -incoming.shape[1]:] = incoming
+    instrumentation.count(
+        "ga.migrants", sum(len(d) for d in targets) * count * 10)
+
+
+def _init_worker(specs):
+    instrumentation.configure(instrumentation.QUIET)  # the parent reports
+    for key, spec in specs.items():
+        _worker_arrays[key] = SharedArray(*spec)
+
+
+def _evolve(genes, config):
+    """Run one round of an island; return its genes and history."""
+    return DigitsRecognizer._train_genes(
+        genes, _worker_arrays["pixels"].array,
+        _worker_arrays["labels"].array, config)
+
+
+def train_islands(digits_recognizer, images, labels, config):
+    """DigitsRecognizer.train() with config.islands island processes.
+
+    The current population of digits_recognizer seeds the first island,
+    the other islands start from random populations of the same size.
+    Plateau stopping applies within a round (a migrant may revive a
+    digit). Afterwards digits_recognizer holds, for every digit, the
+    population of the island whose elite scored best in the last round.
+    Return the per-generation best fitness over all islands per digit.
+    """
+    if config.topology not in TOPOLOGIES:
+        raise ValueError("unknown topology: {}".format(config.topology))
+    rng = numpy.random.default_rng(config.seed)
+    pixels = images_as_array(images)
+    values = labels_as_array(labels)
+    genes = digits_recognizer.genes
+    population_size, size = genes.shape[1:]
+    dim = int(size ** 0.5)
+    island_genes = [genes] + [
+        DigitsRecognizer(population_size, dim).genes
+        for island in range(1, config.islands)
+    ]
+    # the islands already use the CPUs
+    island_config = config._replace(
+        islands=None, workers=None, augment_workers=0)
+    seeds = numpy.random.SeedSequence(config.seed)
+    history = [[] for digit in range(10)]
+    last_best = None
+
+    shared = {
+        "pixels": SharedArray.copy_of(pixels),
+        "labels": SharedArray.copy_of(values),
+    }
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(config.islands, config.workers or
+                                config.islands),
+                initializer=_init_worker,
+                initargs=({key: array.spec
+                           for key, array in shared.items()},)) as executor:
+            generation = 0
+            while generation < config.generations:
+                generations = min(config.migration_interval,
+                                  config.generations - generation)
+                futures = [
+                    executor.submit(_evolve, genes, island_config._replace(
+                        generations=generations, seed=seed))
+                    for genes, seed in zip(
+                        island_genes, seeds.spawn(config.islands))
+                ]
+                results = [future.result() for future in futures]
+                island_genes = [genes for genes, _ in results]
+                last_best = []
+                for digit in range(10):
+                    island_histories = [
+                        island_history[digit]
+                        for _, island_history in results
+                    ]
+                    rounds = max(len(h) for h in island_histories)
+                    history[digit].extend(
+                        max(h[min(i, len(h) - 1)]
+                            for h in island_histories if h)
+                        for i in range(rounds))
+                    last_best.append([
+                        h[-1] if h else -numpy.inf for h in island_histories
+                    ])
+                generation += generations
+                if generation < config.generations:
+                    migrate(island_genes,
+                            migration_targets(config.topology,
+                                              config.islands, rng),
+                            min(config.migration_count, config.elite_count),
+                            keep=config.elite_count)
+                instrumentation.info(
+                    "generation {} (islands: {}), best fitness: {}",
+                    generation, config.islands,
+                    ' '.join('{:.3f}'.format(h[-1]) if h else '-'
+                             for h in history))
+    finally:
+        for array in shared.values():
+            array.close()
+
+    best_genes = [
+        island_genes[int(numpy.argmax(last_best[digit]))][digit]
+        if last_best else genes[digit]
+        for digit in range(10)
+    ]
+    digits_recognizer.genes = best_genes
+    return history
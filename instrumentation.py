@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""Counters, timers and sampled trace events for the hot paths.
+
+Verbosity (configure() or the DIGITS_VERBOSITY environment variable):
+  QUIET  nothing is printed
+  INFO   summaries (success rates, model files, GA progress); the default
+  TRACE  per-image / per-weight details and image renders
+
+Hot loops check the module level `tracing` flag before building any
+message, and timer() returns a shared no-op context manager unless metrics
+are enabled, so disabled instrumentation costs one attribute lookup.
+
+    instrumentation.configure(metrics=True)
+    with instrumentation.capture("cprofile"):
+        use_layer(...)
+    print(instrumentation.report())
+"""
+
+import collections
+import contextlib
+import io
+import os
+import time
+
+
+QUIET = 0
+INFO = 1
+TRACE = 2
+
+verbosity = int(os.environ.get("DIGITS_VERBOSITY", INFO))
+tracing = verbosity >= TRACE
+metrics_enabled = False
+
+counters = collections.Counter()
+timings = collections.defaultdict(float)  # name -> total seconds
+timer_calls = collections.Counter()
+_event_calls = collections.Counter()
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def configure(level=None, metrics=None):
+    """Set the verbosity level and/or enable metric collection."""
+    global verbosity, tracing, metrics_enabled
+    if level is not None:
+        verbosity = level
+        tracing = level >= TRACE
+    if metrics is not None:
+        metrics_enabled = metrics
+
+
+def info(message, *args):
+    if verbosity >= INFO:
+        print(message.format(*args) if args else message)
+
+
+def trace(message, *args):
+    if tracing:
+        print(message.format(*args) if args else message)
+
+
+def sampled(name, every=100):
+    """Return True for every `every`-th call per name (only when tracing)."""
+    if not tracing:
+        return False
+    _event_calls[name] += 1
+    return _event_calls[name] % every == 0
+
+
+def count(name, n=1):
+    if metrics_enabled:
+        counters[name] += n
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        timings[self.name] += time.perf_counter() - self.start
+        timer_calls[self.name] += 1
+
+
+def timer(name):
+    """Context manager adding the elapsed time to timings[name]."""
+    if metrics_enabled:
+        return _Timer(name)
+    return _NULL_TIMER
+
+
+def report():
+    """Return the collected counters and timers as a dict."""
+    return {
+        "counters": dict(counters),
+        "timers": {
+            name: {"seconds": seconds, "calls": timer_calls[name]}
+            for name, seconds in timings.items()
+        },
+    }
+
+
+def reset():
+    counters.clear()
+    timings.clear()
+    timer_calls.clear()
+    _event_calls.clear()
+
+
+@contextlib.contextmanager
+def capture(mode, filename=None, limit=20):
+    """Profile the block with 'cprofile' or 'tracemalloc'.
+
+    The statistics are dumped to filename (cProfile binary stats or a text
+    report) or printed, limited to the top `limit` entries.
+    """
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            if filename:
+                profile.dump_stats(filename)
+            else:
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).sort_stats(
+                    "cumulative").print_stats(limit)
+                print(stream.getvalue())
+    elif mode == "tracemalloc":
+        import tracemalloc
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            yield None
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if not was_tracing:
+                tracemalloc.stop()
+            lines = ["current: {} bytes, peak: {} bytes".format(
+                current, peak)]
+            lines += [str(stat) for stat in
+                      snapshot.statistics("lineno")[:limit]]
+            if filename:
+                with open(filename, "w") as report_file:
+                    report_file.write("\n".join(lines) + "\n")
+            else:
+                print("\n".join(lines))
+    else:
+        raise ValueError("unknown capture mode: {}".format(mode))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""Random, vectorized augmentation of uint8 digit images.
+
+Every image of a batch gets its own random transformation:
+
+  thickness  the strokes are grown or thinned by up to `thickness` pixels
+  affine     a rotation by up to `max_rotation` degrees around the image
+             center and a shift by up to `max_shift` pixels
+  elastic    a smooth random displacement field (Gaussian filtered noise,
+             Simard et al. 2003) of up to `elastic_alpha` pixels
+
+The output is bilinearly resampled from the input. augment() is a
+mnist_pipeline style stage: the variants are computed per minibatch, as
+they are consumed, so every epoch sees new ones and nothing is stored.
+"""
+
+import collections
+import concurrent.futures
+from collections import namedtuple
+
+import numpy
+
+
+AUGMENT_CHUNK_SIZE = 250  # images per augment_images() chunk
+
+AugmentConfig = namedtuple(
+    "AugmentConfig", [
+        "max_shift",  # pixels
+        "max_rotation",  # degrees
+        "elastic_alpha",  # largest elastic displacement, pixels (0: none)
+        "elastic_sigma",  # smoothness of the elastic field, pixels
+        "thickness",  # largest stroke growth / thinning, pixels
+    ],
+    defaults=[2.0, 10.0, 1.5, 4.0, 1]
+)
+
+
+def bilinear_sample(images, src_y, src_x):
+    """Resample images at the source coordinates; outside is black.
+
+    images: (count, height, width) array
+    src_y, src_x: coordinates broadcastable to (count, out_h, out_w)
+    Return the float64 (count, out_h, out_w) result.
+    """
+    count, height, width = images.shape
+    y0 = numpy.floor(src_y).astype(numpy.intp)
+    x0 = numpy.floor(src_x).astype(numpy.intp)
+    wy = src_y - y0
+    wx = src_x - x0
+    index = numpy.arange(count)[:, None, None]
+
+    def sample(ys, xs):
+        valid = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+        values = images[index,
+                        numpy.clip(ys, 0, height - 1),
+                        numpy.clip(xs, 0, width - 1)]
+        return numpy.where(valid, values, 0)
+
+    return (
+        sample(y0, x0) * (1 - wy) * (1 - wx) +
+        sample(y0, x0 + 1) * (1 - wy) * wx +
+        sample(y0 + 1, x0) * wy * (1 - wx) +
+        sample(y0 + 1, x0 + 1) * wy * wx
+    )
+
+
+def _neighbourhood(images, reduce):
+    """Max or min over every pixel and its 4 neighbours (outside black)."""
+    padded = numpy.pad(images, ((0, 0), (1, 1), (1, 1)))
+    return reduce.reduce([
+        padded[:, 1:-1, 1:-1],
+        padded[:, :-2, 1:-1], padded[:, 2:, 1:-1],
+        padded[:, 1:-1, :-2], padded[:, 1:-1, 2:],
+    ])
+
+
+def change_thickness(images, steps):
+    """Dilate (steps > 0) or erode (steps < 0) every image |steps| times."""
+    images = images.copy()
+    for step in range(1, int(numpy.abs(steps).max(initial=0)) + 1):
+        grow = steps >= step
+        if grow.any():
+            images[grow] = _neighbourhood(images[grow], numpy.maximum)
+        shrink = steps <= -step
+        if shrink.any():
+            images[shrink] = _neighbourhood(images[shrink], numpy.minimum)
+    return images
+
+
+def gaussian_filter(fields, sigma):
+    """Separable Gaussian blur over the last two axes (zero padded)."""
+    radius = max(int(numpy.ceil(3 * sigma)), 1)
+    offsets = numpy.arange(-radius, radius + 1)
+    kernel = numpy.exp(-offsets ** 2 / (2 * sigma ** 2))
+    kernel /= kernel.sum()
+    height, width = fields.shape[-2:]
+    pad = [(0, 0)] * (fields.ndim - 2)
+    padded = numpy.pad(fields, pad + [(radius, radius), (0, 0)])
+    fields = sum(weight * padded[..., i:i + height, :]
+                 for i, weight in enumerate(kernel))
+    padded = numpy.pad(fields, pad + [(0, 0), (radius, radius)])
+    return sum(weight * padded[..., i:i + width]
+               for i, weight in enumerate(kernel))
+
+
+def augment_batch(pixels, width, height, config=AugmentConfig(), rng=None):
+    """Return randomly augmented copies of (count, height * width) pixels."""
+    rng = numpy.random.default_rng(rng)
+    images = numpy.asarray(pixels, dtype=numpy.uint8).reshape(
+        -1, height, width)
+    count = len(images)
+    if config.thickness:
+        images = change_thickness(images, rng.integers(
+            -config.thickness, config.thickness + 1, size=count))
+
+    # source coordinates of every output pixel: the inverse transformation
+    center_y, center_x = (height - 1) / 2, (width - 1) / 2
+    out_y, out_x = numpy.mgrid[0:height, 0:width]
+    angle = numpy.radians(rng.uniform(
+        -config.max_rotation, config.max_rotation, size=count))
+    cos = numpy.cos(angle)[:, None, None]
+    sin = numpy.sin(angle)[:, None, None]
+    shift = rng.uniform(-config.max_shift, config.max_shift, size=(2, count))
+    dy = out_y - center_y - shift[0][:, None, None]
+    dx = out_x - center_x - shift[1][:, None, None]
+    src_y = center_y + cos * dy - sin * dx
+    src_x = center_x + sin * dy + cos * dx
+    if config.elastic_alpha:
+        fields = gaussian_filter(
+            rng.uniform(-1, 1, size=(2, count, height, width)),
+            config.elastic_sigma)
+        scale = numpy.abs(fields).max(axis=(0, 2, 3))
+        fields *= config.elastic_alpha / numpy.maximum(scale, 1e-12)[
+            :, None, None]
+        src_y = src_y + fields[0]
+        src_x = src_x + fields[1]
+
+    result = bilinear_sample(images, src_y, src_x)
+    return numpy.clip(numpy.rint(result), 0, 255).astype(
+        numpy.uint8).reshape(count, height * width)
+
+
+def augment(batches, width, height, config=AugmentConfig(), seed=None,
+            workers=0):
+    """Yield the (pixels, labels) minibatches with augmented pixels.
+
+    Every minibatch gets its own child seed, so the output only depends on
+    seed, not on workers. With workers, minibatches are augmented on a
+    thread pool (NumPy releases the GIL), up to 2 * workers ahead.
+    """
+    seeds = numpy.random.SeedSequence(seed)
+
+    def augment_one(batch, batch_seed):
+        pixels, labels = batch
+        return augment_batch(
+            pixels, width, height, config,
+            numpy.random.default_rng(batch_seed)), labels
+
+    if not workers:
+        for batch in batches:
+            yield augment_one(batch, seeds.spawn(1)[0])
+        return
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(
+                augment_one, batch, seeds.spawn(1)[0]))
+            if len(pending) > 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def augment_images(pixels, width, height, config=AugmentConfig(), seed=None,
+                   workers=0, chunk_size=AUGMENT_CHUNK_SIZE):
+    """Return augmented copies of (count, height * width) pixels.
+
+    The images are augmented in chunks of chunk_size (see augment()), on
+    workers threads if given; the result does not depend on workers.
+    """
+    chunks = (
+        (pixels[start:start + chunk_size], None)
+        for start in range(0, len(pixels), chunk_size)
+    )
+    return numpy.concatenate([
+        augmented for augmented, _ in augment(
+            chunks, width, height, config, seed=seed, workers=workers)
+    ])
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+"""Streaming, bounded-memory minibatch pipeline over IDX files.
+
+Every stage is a generator of (pixels, labels) chunks, where pixels is a
+(n, height * width) uint8 array and labels a (n,) uint8 array. Only a few
+chunks (and the shuffle buffer) are held in memory at a time, whatever the
+size of the files:
+
+    read_chunks -> shuffle -> rebatch -> augment -> prefetch
+
+minibatches() chains them for the usual training loop, e.g.
+
+    layer = use_layer_batches(layer, minibatches(
+        "./train-images-idx3-ubyte", "./train-labels-idx1-ubyte",
+        batch_size=32, shuffle_buffer_size=10000, epochs=3), train=True)
+"""
+
+import queue
+import threading
+
+import numpy
+
+from mnist_augment import augment as augment_batches
+from mnist_utils import open_idx_file
+from mnist_utils import read_image_header
+from mnist_utils import read_label_header
+
+
+CHUNK_SIZE = 1024  # images per file read
+
+
+def split_ranges(count, validation_fraction):
+    """Return the (start, stop) ranges of the train and validation parts.
+
+    The validation part is the tail of the file, so both parts can be read
+    as contiguous ranges.
+    """
+    validation_count = int(round(count * validation_fraction))
+    return (0, count - validation_count), (count - validation_count, count)
+
+
+def read_chunks(image_filename, label_filename, start=0, stop=None,
+                chunk_size=CHUNK_SIZE):
+    """Yield (pixels, labels) chunks of the image range [start, stop)."""
+    image_header, image_offset = read_image_header(image_filename)
+    label_header, label_offset = read_label_header(label_filename)
+    count = min(image_header.maxImages, label_header.maxLabels)
+    stop = count if stop is None else min(stop, count)
+    image_size = image_header.imgWidth * image_header.imgHeight
+    with open_idx_file(image_filename) as image_file, \
+            open_idx_file(label_filename) as label_file:
+        image_file.seek(image_offset + start * image_size)
+        label_file.seek(label_offset + start)
+        for chunk_start in range(start, stop, chunk_size):
+            n = min(chunk_size, stop - chunk_start)
+            pixels = numpy.frombuffer(
+                image_file.read(n * image_size), dtype=numpy.uint8)
+            labels = numpy.frombuffer(label_file.read(n), dtype=numpy.uint8)
+            if len(labels) != n or len(pixels) != n * image_size:
+                raise ValueError("unexpected end of {} / {}".format(
+                    image_filename, label_filename))
+            yield pixels.reshape(n, image_size), labels
+
+
+def shuffle(chunks, buffer_size, rng):
+    """Shuffle a chunk stream through a buffer of at most buffer_size images.
+
+    Whenever the buffer overflows, the buffer is permuted and the overflow
+    is emitted, so at most buffer_size images plus one chunk are held.
+    """
+    buffer_pixels = buffer_labels = None
+    for pixels, labels in chunks:
+        if buffer_pixels is None:
+            buffer_pixels, buffer_labels = pixels, labels
+        else:
+            buffer_pixels = numpy.concatenate([buffer_pixels, pixels])
+            buffer_labels = numpy.concatenate([buffer_labels, labels])
+        overflow = len(buffer_labels) - buffer_size
+        if overflow > 0:
+            order = rng.permutation(len(buffer_labels))
+            emitted, kept = order[:overflow], order[overflow:]
+            yield buffer_pixels[emitted], buffer_labels[emitted]
+            buffer_pixels, buffer_labels = (
+                buffer_pixels[kept], buffer_labels[kept])
+    if buffer_pixels is not None and len(buffer_labels):
+        order = rng.permutation(len(buffer_labels))
+        yield buffer_pixels[order], buffer_labels[order]
+
+
+def rebatch(chunks, batch_size, drop_last=False):
+    """Turn a stream of arbitrary sized chunks into batch_size minibatches."""
+    pending_pixels, pending_labels = [], []
+    pending_count = 0
+    for pixels, labels in chunks:
+        pending_pixels.append(pixels)
+        pending_labels.append(labels)
+        pending_count += len(labels)
+        if pending_count < batch_size:
+            continue
+        pixels = numpy.concatenate(pending_pixels)
+        labels = numpy.concatenate(pending_labels)
+        full_count = len(labels) - len(labels) % batch_size
+        for start in range(0, full_count, batch_size):
+            yield (pixels[start:start + batch_size],
+                   labels[start:start + batch_size])
+        pending_pixels, pending_labels = (
+            [pixels[full_count:]], [labels[full_count:]])
+        pending_count = len(labels) - full_count
+    if pending_count and not drop_last:
+        yield numpy.concatenate(pending_pixels), numpy.concatenate(
+            pending_labels)
+
+
+_END = object()
+
+
+def prefetch(iterable, depth=2):
+    """Produce the items of iterable on a background thread.
+
+    At most depth items are produced ahead of the consumer. Exceptions of
+    the producer are re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as exc:
+            put(exc)
+        else:
+            put(_END)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def minibatches(image_filename, label_filename, batch_size=32, epochs=1,
+                shuffle_buffer_size=0, subset=None, validation_fraction=0.0,
+                prefetch_depth=0, seed=None, chunk_size=CHUNK_SIZE,
+                augment=None, augment_workers=0):
+    """Yield (pixels, labels) minibatches for the given number of epochs.
+
+    subset: None (all images), 'train' or 'validation' part of the split
+    shuffle_buffer_size: 0 keeps file order, otherwise shuffled per epoch
+    prefetch_depth: minibatches prepared ahead on a background thread
+    augment: AugmentConfig, every minibatch is randomly augmented (new
+    variants every epoch), on augment_workers threads if given
+    """
+    rng = numpy.random.default_rng(seed)
+    image_header = read_image_header(image_filename)[0]
+    start, stop = 0, None
+    if subset is not None:
+        count = min(image_header.maxImages,
+                    read_label_header(label_filename)[0].maxLabels)
+        train_range, validation_range = split_ranges(
+            count, validation_fraction)
+        start, stop = {
+            'train': train_range,
+            'validation': validation_range,
+        }[subset]
+
+    def epoch_batches():
+        for epoch in range(epochs):
+            chunks = read_chunks(
+                image_filename, label_filename, start, stop, chunk_size)
+            if shuffle_buffer_size:
+                chunks = shuffle(chunks, shuffle_buffer_size, rng)
+            yield from rebatch(chunks, batch_size)
+
+    batches = epoch_batches()
+    if augment is not None:
+        batches = augment_batches(
+            batches, image_header.imgWidth, image_header.imgHeight, augment,
+            seed=rng.integers(2 ** 63), workers=augment_workers)
+    if prefetch_depth:
+        return prefetch(batches, prefetch_depth)
+    return batches
@@ -1,13 +1,119 @@
 #!/usr/bin/env python3
 
 from collections import namedtuple
+import contextlib
+import gzip
+import hashlib
+import os
 import struct
 
+import numpy
+
+import instrumentation
+
+
+IMAGE_FILE_MAGIC = 2051
+LABEL_FILE_MAGIC = 2049
+GZIP_MAGIC = b'\x1f\x8b'
+READ_CHUNK_SIZE = 1 << 20  # bytes read (decompressed) at a time
+INDEX_CHUNK_SIZE = 4096  # images scanned at a time by build_active_index()
+
+MNIST_FILES = {
+    "train": ("train-images-idx3-ubyte", "train-labels-idx1-ubyte"),
+    "test": ("t10k-images-idx3-ubyte", "t10k-labels-idx1-ubyte"),
+}
+
+
+# bit positions (MSB first, as numpy.packbits) of the set bits of a byte
+_SET_BITS = [
+    tuple(bit for bit in range(8) if byte & (0x80 >> bit))
+    for byte in range(256)
+]
+
 
 class MNISTImage:
+    """One image; the black/white pixels are kept packed 8 per byte."""
+
+    __slots__ = ("pixels", "bw_bits")
+
     def __init__(self, pixels):
         self.pixels = pixels
-        self.bw_pixels = [int(bool(pixel)) for pixel in pixels]
+        self.bw_bits = pack_bw_pixels(pixels).tobytes()
+
+    @property
+    def bw_pixels(self):
+        return unpack_bw_bits(self.bw_bits, len(self.pixels)).tolist()
+
+
+class MNISTImageView:
+    """MNISTImage compatible view of one image of an IDXImages buffer."""
+
+    __slots__ = ("pixels",)
+
+    def __init__(self, pixels):
+        self.pixels = pixels  # uint8 array view, no copy
+
+    @property
+    def bw_pixels(self):
+        return (self.pixels != 0).view(numpy.uint8)
+
+    @property
+    def bw_bits(self):
+        return pack_bw_pixels(self.pixels).tobytes()
+
+
+def pack_bw_pixels(pixels):
+    """Pack the black/white pixels 8 per byte along the last axis."""
+    return numpy.packbits(numpy.asarray(pixels) != 0, axis=-1)
+
+
+def unpack_bw_bits(bw_bits, size):
+    """Inverse of pack_bw_pixels() for images of `size` pixels."""
+    if isinstance(bw_bits, bytes):
+        bw_bits = numpy.frombuffer(bw_bits, dtype=numpy.uint8)
+    return numpy.unpackbits(bw_bits, axis=-1, count=size)
+
+
+def active_pixels(image):
+    """Return the indices of the non-zero pixels of an image.
+
+    Decoded byte by byte from the packed bw_bits when the image has them,
+    so all-black bytes (most of an MNIST image) cost one test each.
+    """
+    bw_bits = getattr(image, "bw_bits", None)
+    if not isinstance(bw_bits, bytes):
+        return [i for i, pixel in enumerate(image.bw_pixels) if pixel]
+    return [
+        offset + bit
+        for offset, byte in zip(range(0, 8 * len(bw_bits), 8), bw_bits)
+        if byte
+        for bit in _SET_BITS[byte]
+    ]
+
+
+ActivePixels = namedtuple(
+    "ActivePixels", [
+        "offsets",  # (count + 1,) int64: image i is [offsets[i], offsets[i+1])
+        "indices",  # uint16 pixel offsets within the image, ascending
+        "values",  # uint8 pixel values
+    ]
+)
+
+
+def build_active_index(pixels):
+    """Return the CSR style ActivePixels of (count, size) pixels."""
+    pixels = numpy.asarray(pixels)
+    offsets = numpy.zeros(len(pixels) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.count_nonzero(pixels, axis=1), out=offsets[1:])
+    indices = numpy.empty(offsets[-1], dtype=numpy.uint16)
+    values = numpy.empty(offsets[-1], dtype=numpy.uint8)
+    for start in range(0, len(pixels), INDEX_CHUNK_SIZE):
+        chunk = pixels[start:start + INDEX_CHUNK_SIZE]
+        mask = chunk != 0
+        part = slice(offsets[start], offsets[start + len(chunk)])
+        indices[part] = numpy.nonzero(mask)[1]
+        values[part] = chunk[mask]
+    return ActivePixels(offsets, indices, values)
 
 
 MNISTLabel = namedtuple(
@@ -35,7 +141,7 @@ MNISTLabelFileHeader = namedtuple(
 
 def read_image_file(filename):
     """ See file formats at http://yann.lecun.com/exdb/mnist/ """
-    with open(filename, "rb") as image_file:
+    with open_idx_file(filename) as image_file:
         data = image_file.read()
         if not data:
             print("No data!")
@@ -45,7 +151,7 @@ def read_image_file(filename):
     struct_len = struct.calcsize(struct_fmt)
     buffer = data[:struct_len]
     image_struct = struct.unpack(struct_fmt, buffer)
-    print("%d %d %d %d" % image_struct)
+    instrumentation.trace("%d %d %d %d" % image_struct)
     header = MNISTImageFileHeader(*image_struct)
 
     buffer = data[struct_len:]
@@ -55,15 +161,15 @@ def read_image_file(filename):
         MNISTImage(x)
         for x in struct.iter_unpack(struct_fmt, buffer)
     ]
-    # print("first image:\n{}".format(images[0]))
-    print("first image:")
-    print_image(images[0].pixels)
-    print("last image:")
-    print_image(images[-1].pixels)
+    if instrumentation.tracing:
+        print("first image:")
+        print_image(images[0].pixels)
+        print("last image:")
+        print_image(images[-1].pixels)
     return images
 
 
-def print_image(image_pixels):
+def print_image(image_pixels, width=28):
     for i, pixel in enumerate(image_pixels):
         if pixel > 200:
             print('■ ', end='')
@@ -75,15 +181,14 @@ def print_image(image_pixels):
             print('▨ ', end='')
         else:
             print('□ ', end='')
-        # TODO: 28 => use imgWidth
-        if (i + 1) % 28 == 0:
+        if (i + 1) % width == 0:
             print("")
     print("")
 
 
 def read_label_file(filename):
     """ See file formats at http://yann.lecun.com/exdb/mnist/ """
-    with open(filename, "rb") as label_file:
+    with open_idx_file(filename) as label_file:
         data = label_file.read()
         if not data:
             print("No data!")
@@ -93,7 +198,7 @@ def read_label_file(filename):
     struct_len = struct.calcsize(struct_fmt)
     buffer = data[:struct_len]
     label_struct = struct.unpack(struct_fmt, buffer)
-    print("%d %d" % label_struct)
+    instrumentation.trace("%d %d" % label_struct)
     header = MNISTLabelFileHeader(*label_struct)
 
     buffer = data[struct_len:]
@@ -101,6 +206,463 @@ def read_label_file(filename):
     struct_len = struct.calcsize(struct_fmt)
     labels = [MNISTLabel(x[0]) for x in struct.iter_unpack(struct_fmt, buffer)]
     assert header.maxLabels == len(labels)
-    print("first label: {}".format(labels[0]))
-    print("last label : {}".format(labels[-1]))
+    instrumentation.trace("first label: {}", labels[0])
+    instrumentation.trace("last label : {}", labels[-1])
     return labels
+
+
+def is_gzip_file(filename):
+    with open(filename, "rb") as idx_file:
+        return idx_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def open_idx_file(filename):
+    """Open an IDX file for reading, decompressing it if it is gzipped."""
+    if is_gzip_file(filename):
+        return gzip.open(filename, "rb")
+    return open(filename, "rb")
+
+
+def read_payload(filename, offset, buffer, chunk_size=READ_CHUNK_SIZE,
+                 background=False):
+    """Fill buffer with the bytes of the file after offset.
+
+    Yield the (start, stop) byte range of buffer filled by every chunk.
+    A gzipped file is decompressed chunk by chunk straight into buffer, so
+    it is never held in memory in both forms. With background, reading
+    runs ahead on a thread while the consumer works on earlier chunks.
+    """
+    chunks = _read_payload(filename, offset, buffer, chunk_size)
+    if background:
+        # imported here: mnist_pipeline depends on this module
+        from mnist_pipeline import prefetch
+        chunks = prefetch(chunks, depth=64)
+    return chunks
+
+
+def _read_payload(filename, offset, buffer, chunk_size):
+    view = memoryview(buffer).cast("B")
+    with open_idx_file(filename) as idx_file:
+        idx_file.seek(offset)
+        for start in range(0, len(view), chunk_size):
+            stop = min(start + chunk_size, len(view))
+            filled = start
+            while filled < stop:
+                size = idx_file.readinto(view[filled:stop])
+                if not size:
+                    raise ValueError(
+                        "{}: file too short ({} < {} bytes)".format(
+                            filename, offset + filled, offset + len(view)))
+                filled += size
+            instrumentation.count("load.bytes", stop - start)
+            yield start, stop
+
+
+def _read_header(filename, struct_fmt, header_type, magic_number):
+    struct_len = struct.calcsize(struct_fmt)
+    with open_idx_file(filename) as idx_file:
+        buffer = idx_file.read(struct_len)
+    if len(buffer) < struct_len:
+        raise ValueError("{}: truncated IDX header".format(filename))
+    header = header_type(*struct.unpack(struct_fmt, buffer))
+    if header.magicNumber != magic_number:
+        raise ValueError("{}: bad magic number {} (expected {})".format(
+            filename, header.magicNumber, magic_number))
+    return header, struct_len
+
+
+def read_image_header(filename):
+    """Return the validated header and its length in bytes."""
+    return _read_header(
+        filename, '>4i', MNISTImageFileHeader, IMAGE_FILE_MAGIC)
+
+
+def read_label_header(filename):
+    """Return the validated header and its length in bytes."""
+    return _read_header(
+        filename, '>2i', MNISTLabelFileHeader, LABEL_FILE_MAGIC)
+
+
+def _map_payload(filename, offset, shape):
+    if is_gzip_file(filename):
+        payload = numpy.empty(shape, dtype=numpy.uint8)
+        for _ in read_payload(filename, offset, payload):
+            pass
+        payload.flags.writeable = False
+        return payload
+    expected_size = offset + int(numpy.prod(shape))
+    actual_size = os.path.getsize(filename)
+    if actual_size < expected_size:
+        raise ValueError("{}: file too short ({} < {} bytes)".format(
+            filename, actual_size, expected_size))
+    if expected_size == offset:
+        return numpy.zeros(shape, dtype=numpy.uint8)
+    return numpy.memmap(filename, dtype=numpy.uint8, mode="r",
+                        offset=offset, shape=shape)
+
+
+class IDXImages:
+    """Memory-mapped IDX image file.
+
+    `pixels` is a read-only (count, height * width) uint8 array backed by
+    the file itself; indexing yields MNISTImageView objects, so the dataset
+    can stand in for the list returned by read_image_file().
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header, offset = read_image_header(filename)
+        self.image_size = self.header.imgWidth * self.header.imgHeight
+        self.pixels = _map_payload(
+            filename, offset, (self.header.maxImages, self.image_size))
+        self._bw_bits = None
+        self._active_index = None
+
+    @classmethod
+    def from_arrays(cls, filename, header, pixels, bw_bits=None):
+        images = cls.__new__(cls)
+        images.filename = filename
+        images.header = header
+        images.image_size = header.imgWidth * header.imgHeight
+        images.pixels = pixels
+        images._bw_bits = bw_bits
+        images._active_index = None
+        return images
+
+    @property
+    def bw_bits(self):
+        """Black/white pixels packed 8 per byte, one row per image."""
+        if self._bw_bits is None:
+            self._bw_bits = pack_bw_pixels(self.pixels)
+        return self._bw_bits
+
+    @property
+    def active_index(self):
+        """ActivePixels of all images, built once per opened file."""
+        if self._active_index is None:
+            with instrumentation.timer("active_index"):
+                self._active_index = build_active_index(self.pixels)
+        return self._active_index
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [MNISTImageView(pixels) for pixels in self.pixels[index]]
+        return MNISTImageView(self.pixels[index])
+
+    def __iter__(self):
+        return (MNISTImageView(pixels) for pixels in self.pixels)
+
+
+class IDXLabels:
+    """Memory-mapped IDX label file.
+
+    `values` is a read-only uint8 array of the labels; indexing yields
+    MNISTLabel tuples like read_label_file() does.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header, offset = read_label_header(filename)
+        self.values = _map_payload(filename, offset, (self.header.maxLabels,))
+
+    @classmethod
+    def from_arrays(cls, filename, header, values):
+        labels = cls.__new__(cls)
+        labels.filename = filename
+        labels.header = header
+        labels.values = values
+        return labels
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [MNISTLabel(int(value)) for value in self.values[index]]
+        return MNISTLabel(int(self.values[index]))
+
+    def __iter__(self):
+        return (MNISTLabel(value) for value in self.values.tolist())
+
+
+@contextlib.contextmanager
+def atomic_write(filename):
+    """Yield a temporary filename that replaces filename at the end.
+
+    If the block raises, the temporary file is removed instead, so a
+    failed write leaves neither a partial filename nor a stray file.
+    """
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        yield tmp_filename
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def write_image_file(filename, pixels, width, height):
+    """Write a (count, height * width) uint8 array as IDX image file."""
+    pixels = numpy.ascontiguousarray(pixels, dtype=numpy.uint8)
+    with open(filename, "wb") as image_file:
+        image_file.write(struct.pack(
+            '>4i', IMAGE_FILE_MAGIC, len(pixels), width, height))
+        image_file.write(pixels.tobytes())
+
+
+def write_label_file(filename, values):
+    """Write a uint8 array of label values as IDX label file."""
+    values = numpy.ascontiguousarray(values, dtype=numpy.uint8)
+    with open(filename, "wb") as label_file:
+        label_file.write(struct.pack('>2i', LABEL_FILE_MAGIC, len(values)))
+        label_file.write(values.tobytes())
+
+
+def open_image_file(filename):
+    """Zero-copy alternative of read_image_file()."""
+    with instrumentation.timer("load"):
+        return IDXImages(filename)
+
+
+def open_label_file(filename):
+    """Zero-copy alternative of read_label_file()."""
+    with instrumentation.timer("load"):
+        return IDXLabels(filename)
+
+
+CACHE_MAGIC = b'DIGITSDS'
+CACHE_VERSION = 1
+CACHE_HEADER_FMT = '>8s4I2Q32s2Q32s'
+CACHE_HEADER_LEN = 128  # struct.calcsize(CACHE_HEADER_FMT) padded
+
+DatasetCacheHeader = namedtuple(
+    "DatasetCacheHeader", [
+        "magic",
+        "version",
+        "count",
+        "imgWidth",
+        "imgHeight",
+        "imageFileSize",
+        "imageFileMtime",
+        "imageFileHash",
+        "labelFileSize",
+        "labelFileMtime",
+        "labelFileHash",
+    ]
+)
+
+
+def _file_stat(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as source_file:
+        for chunk in iter(lambda: source_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _read_cache_header(cache_filename):
+    try:
+        with open(cache_filename, "rb") as cache_file:
+            buffer = cache_file.read(CACHE_HEADER_LEN)
+    except FileNotFoundError:
+        return None
+    if len(buffer) < CACHE_HEADER_LEN:
+        return None
+    header = DatasetCacheHeader(*struct.unpack_from(CACHE_HEADER_FMT, buffer))
+    if header.magic != CACHE_MAGIC or header.version != CACHE_VERSION:
+        return None
+    return header
+
+
+def _is_cache_valid(header, image_filename, label_filename, cache_filename):
+    """Check sizes and mtimes first, only hash the sources if they differ.
+
+    When the hashes still match, the new mtimes are written into the cache
+    header, so the next check is a stat again.
+    """
+    if header is None:
+        return False
+    image_stat = _file_stat(image_filename)
+    label_stat = _file_stat(label_filename)
+    if (image_stat == (header.imageFileSize, header.imageFileMtime) and
+            label_stat == (header.labelFileSize, header.labelFileMtime)):
+        return True
+    if not (image_stat[0] == header.imageFileSize and
+            label_stat[0] == header.labelFileSize and
+            _file_hash(image_filename) == header.imageFileHash and
+            _file_hash(label_filename) == header.labelFileHash):
+        return False
+    header = header._replace(
+        imageFileMtime=image_stat[1], labelFileMtime=label_stat[1])
+    try:
+        with open(cache_filename, "r+b") as cache_file:
+            cache_file.write(struct.pack(CACHE_HEADER_FMT, *header))
+    except OSError:
+        pass  # a read-only cache stays valid, it is just hashed again
+    return True
+
+
+def write_dataset_cache(cache_filename, image_filename, label_filename):
+    """Write pixels, packed black/white bits and labels into one file.
+
+    Layout: CACHE_HEADER_LEN bytes of header, then the (count, size) pixels,
+    the (count, ceil(size / 8)) packed bits and the count labels.
+    The sources (plain or gzipped) are read straight into the memory-mapped
+    cache file, and the pixels are packed while the next chunk is read.
+    """
+    image_header, image_offset = read_image_header(image_filename)
+    label_header, label_offset = read_label_header(label_filename)
+    count = image_header.maxImages
+    if count != label_header.maxLabels:
+        raise ValueError("{} images but {} labels".format(
+            count, label_header.maxLabels))
+    image_size = image_header.imgWidth * image_header.imgHeight
+    bits_size = (image_size + 7) // 8
+    header = DatasetCacheHeader(
+        CACHE_MAGIC, CACHE_VERSION, count,
+        image_header.imgWidth, image_header.imgHeight,
+        *_file_stat(image_filename), _file_hash(image_filename),
+        *_file_stat(label_filename), _file_hash(label_filename))
+    payload_size = count * (image_size + bits_size + 1)
+    with atomic_write(cache_filename) as tmp_filename:
+        with open(tmp_filename, "wb") as cache_file:
+            cache_file.write(struct.pack(CACHE_HEADER_FMT, *header).ljust(
+                CACHE_HEADER_LEN, b'\0'))
+            cache_file.truncate(CACHE_HEADER_LEN + payload_size)
+        if payload_size:
+            payload = numpy.memmap(
+                tmp_filename, dtype=numpy.uint8, mode="r+",
+                offset=CACHE_HEADER_LEN, shape=payload_size)
+            pixels = payload[:count * image_size].reshape(count, image_size)
+            bw_bits = payload[count * image_size:-count].reshape(
+                count, bits_size)
+            packed = 0
+            for _, stop in read_payload(image_filename, image_offset, pixels,
+                                        background=True):
+                complete = stop // image_size
+                bw_bits[packed:complete] = pack_bw_pixels(
+                    pixels[packed:complete])
+                packed = complete
+            for _ in read_payload(label_filename, label_offset,
+                                  payload[-count:]):
+                pass
+            payload.flush()
+            del payload, pixels, bw_bits
+    return header
+
+
+def open_dataset(image_filename, label_filename, cache_filename=None):
+    """Return (images, labels) memory-mapped from the dataset cache.
+
+    The cache (by default next to the image file) is rebuilt whenever the
+    content of either source file changes.
+    """
+    if cache_filename is None:
+        cache_filename = image_filename + ".cache"
+    with instrumentation.timer("load"):
+        return _open_dataset(image_filename, label_filename, cache_filename)
+
+
+def _open_dataset(image_filename, label_filename, cache_filename):
+    header = _read_cache_header(cache_filename)
+    if not _is_cache_valid(
+            header, image_filename, label_filename, cache_filename):
+        instrumentation.info("Writing dataset cache: {}", cache_filename)
+        header = write_dataset_cache(
+            cache_filename, image_filename, label_filename)
+
+    image_size = header.imgWidth * header.imgHeight
+    bits_size = (image_size + 7) // 8
+    offset = CACHE_HEADER_LEN
+    pixels = _map_payload(cache_filename, offset, (header.count, image_size))
+    offset += header.count * image_size
+    bw_bits = _map_payload(cache_filename, offset, (header.count, bits_size))
+    offset += header.count * bits_size
+    values = _map_payload(cache_filename, offset, (header.count,))
+
+    images = IDXImages.from_arrays(
+        image_filename,
+        MNISTImageFileHeader(IMAGE_FILE_MAGIC, header.count,
+                             header.imgWidth, header.imgHeight),
+        pixels, bw_bits)
+    labels = IDXLabels.from_arrays(
+        label_filename,
+        MNISTLabelFileHeader(LABEL_FILE_MAGIC, header.count),
+        values)
+    return images, labels
+
+
+def bbox_filename(image_filename, size):
+    """train-images-idx3-ubyte -> train-images-bbox20-idx3-ubyte"""
+    return image_filename.replace(
+        "-idx3-ubyte", "-bbox{}-idx3-ubyte".format(size))
+
+
+def mnist_filenames(subset, data_dir=".", bbox=None):
+    """Return the (image, label) filenames of the 'train' or 'test' set.
+
+    The downloaded .gz file is used where there is no extracted one.
+    With bbox, the images are the ones convert_mnist_database normalized
+    to bbox x bbox pixels (the label file is the same).
+    """
+    image_filename, label_filename = MNIST_FILES[subset]
+    if bbox:
+        image_filename = bbox_filename(image_filename, bbox)
+    filenames = []
+    for filename in (image_filename, label_filename):
+        filename = os.path.join(data_dir, filename)
+        if not os.path.exists(filename) and os.path.exists(filename + ".gz"):
+            filename += ".gz"
+        filenames.append(filename)
+    return tuple(filenames)
+
+
+def images_as_array(images):
+    """Return the (count, pixels) uint8 matrix of any image sequence."""
+    if isinstance(images, IDXImages):
+        return images.pixels
+    if isinstance(images, numpy.ndarray):
+        return images
+    return numpy.array([image.pixels for image in images], dtype=numpy.uint8)
+
+
+def bw_bits_as_array(images):
+    """Return the (count, bytes) packed black/white pixels of any images."""
+    if isinstance(images, IDXImages):
+        return images.bw_bits
+    return pack_bw_pixels(images_as_array(images))
+
+
+def active_index_of(images):
+    """Return the ActivePixels of any image sequence."""
+    if isinstance(images, IDXImages):
+        return images.active_index
+    return build_active_index(images_as_array(images))
+
+
+def labels_as_array(labels):
+    """Return the uint8 label values of any label sequence."""
+    if isinstance(labels, IDXLabels):
+        return labels.values
+    if isinstance(labels, numpy.ndarray):
+        return labels
+    return numpy.array([label.value for label in labels], dtype=numpy.uint8)
+
+
+def top_k_predictions(scores, k):
+    """Return the (images, k) most probable digits and their scores.
+
+    Ties are resolved towards the lower digit, like an argmax.
+    """
+    k = min(k, scores.shape[1])
+    digits = numpy.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return digits, numpy.take_along_axis(scores, digits, axis=1)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""Versioned binary model files.
+
+A model file is a fixed size header followed by one raw little-endian
+array, so it can be memory-mapped instead of unpickled:
+
+  magic (8 bytes) | version | kind | ndim | dims[4] | meta[7]
+  (big-endian uint32, HEADER_LEN bytes; unused dims and meta are 0)
+  payload: the weights in the dtype of the kind, C order
+
+meta holds kind specific settings, e.g. the layer sizes of a network.
+"""
+
+import os
+import struct
+from collections import namedtuple
+
+import numpy
+
+from mnist_utils import atomic_write
+
+
+MODEL_MAGIC = b'DIGITSMD'
+MODEL_VERSION = 1
+HEADER_FMT = '>8s14I'
+HEADER_LEN = 64
+MAX_DIMS = 4
+MAX_META = 7
+
+NN_LAYER = 1  # (cells, pixels) float32 weights of nndigits
+GA_RECOGNIZERS = 2  # (digits, recognizers, pixels) uint16 genes of gadigits
+NN_NETWORK = 3  # flat float32 parameters of an nndigits.Network
+
+KIND_DTYPES = {
+    NN_LAYER: numpy.dtype('<f4'),
+    GA_RECOGNIZERS: numpy.dtype('<u2'),
+    NN_NETWORK: numpy.dtype('<f4'),
+}
+
+ModelFileHeader = namedtuple(
+    "ModelFileHeader", [
+        "magic",
+        "version",
+        "kind",
+        "ndim",
+        "dims",
+        "meta",
+    ]
+)
+
+
+def save_model(filename, kind, array, meta=()):
+    """Atomically write the array as a model of the given kind."""
+    array = numpy.ascontiguousarray(array, dtype=KIND_DTYPES[kind])
+    if array.ndim > MAX_DIMS:
+        raise ValueError("at most {} dimensions are supported".format(
+            MAX_DIMS))
+    if len(meta) > MAX_META:
+        raise ValueError("at most {} meta values are supported".format(
+            MAX_META))
+    dims = list(array.shape) + [0] * (MAX_DIMS - array.ndim)
+    meta = list(meta) + [0] * (MAX_META - len(meta))
+    header = struct.pack(
+        HEADER_FMT, MODEL_MAGIC, MODEL_VERSION, kind, array.ndim,
+        *dims, *meta)
+    with atomic_write(filename) as tmp_filename:
+        with open(tmp_filename, "wb") as model_file:
+            model_file.write(header.ljust(HEADER_LEN, b'\0'))
+            model_file.write(array.tobytes())
+
+
+def read_model_header(filename):
+    with open(filename, "rb") as model_file:
+        buffer = model_file.read(HEADER_LEN)
+    if len(buffer) < HEADER_LEN:
+        raise ValueError("{}: truncated model header".format(filename))
+    magic, version, kind, ndim, *values = struct.unpack_from(
+        HEADER_FMT, buffer)
+    dims, meta = values[:MAX_DIMS], values[MAX_DIMS:]
+    if magic != MODEL_MAGIC:
+        raise ValueError("{}: not a model file".format(filename))
+    if version != MODEL_VERSION:
+        raise ValueError("{}: unsupported model version {}".format(
+            filename, version))
+    return ModelFileHeader(
+        magic, version, kind, ndim, tuple(dims[:ndim]), tuple(meta))
+
+
+def load_model(filename, kind):
+    """Return the read-only, memory-mapped array of the model file."""
+    return load_model_with_header(filename, kind)[1]
+
+
+def load_model_with_header(filename, kind=None):
+    """Return (header, memory-mapped array); kind None accepts any kind."""
+    header = read_model_header(filename)
+    if kind is not None and header.kind != kind:
+        raise ValueError("{}: model kind {} (expected {})".format(
+            filename, header.kind, kind))
+    dtype = KIND_DTYPES[header.kind]
+    expected_size = HEADER_LEN + dtype.itemsize * int(numpy.prod(header.dims))
+    if os.path.getsize(filename) != expected_size:
+        raise ValueError("{}: payload size mismatch".format(filename))
+    return header, numpy.memmap(filename, dtype=dtype, mode="r",
+                                offset=HEADER_LEN, shape=header.dims)
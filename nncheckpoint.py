@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+"""Resumable nndigits training with periodic, atomic checkpoints.
+
+A checkpoint is a single .npz file with the model parameters and a JSON
+encoded TrainingState: the epoch, the position in the image order of the
+epoch, the number of images that were shuffled at the start of the epoch
+and the state of the shuffling RNG at that moment (so the order can be
+drawn again). It is written to a temporary file and renamed, so an
+interrupted run always leaves the last complete checkpoint behind.
+
+The image order of an epoch is the (optionally shuffled) images known at
+its start, followed by any images appended to the IDX files since, in file
+order. So a resumed run, even of an already finished last epoch, only
+trains on the images it has not seen yet.
+"""
+
+import collections
+import json
+import os
+from collections import namedtuple
+
+import numpy
+
+import instrumentation
+from mnist_augment import augment as augment_batches
+from mnist_utils import atomic_write
+from mnist_utils import images_as_array
+from mnist_utils import labels_as_array
+from nndigits import Layer
+from nndigits import MatrixLayer
+from nndigits import build_model
+from nndigits import evaluate_layer
+from nndigits import model_parameters
+from nndigits import model_spec
+from nndigits import report_epoch_evaluation
+from nndigits import use_layer_batches
+
+
+CHECKPOINT_INTERVAL = 10000  # images between two checkpoints
+
+TrainingState = namedtuple(
+    "TrainingState", [
+        "epoch",
+        "position",  # images of the epoch order already trained on
+        "epoch_size",  # images shuffled at the start of the epoch
+        "rng_state",  # bit generator state at the start of the epoch
+    ]
+)
+
+
+def save_checkpoint(filename, layer, state):
+    """Atomically write the layer (or Network) and the training state."""
+    encoded_state = json.dumps({
+        "model": model_spec(layer),
+        "state": state._asdict(),
+    }).encode()
+    with atomic_write(filename) as tmp_filename:
+        with open(tmp_filename, "wb") as checkpoint_file:
+            numpy.savez(
+                checkpoint_file, parameters=model_parameters(layer),
+                state=numpy.frombuffer(encoded_state, dtype=numpy.uint8))
+    instrumentation.count("checkpoint.saves")
+
+
+def load_checkpoint(filename):
+    """Return the (writable layer, TrainingState) of a checkpoint."""
+    with numpy.load(filename) as checkpoint:
+        decoded = json.loads(checkpoint["state"].tobytes())
+        parameters = checkpoint["parameters"]
+    return (build_model(decoded["model"], parameters),
+            TrainingState(**decoded["state"]))
+
+
+def train_with_checkpoints(layer, images, labels, filename, epochs=1,
+                           batch_size=1, shuffle=False, seed=None,
+                           interval=CHECKPOINT_INTERVAL, augment=None,
+                           augment_workers=0, validation=None):
+    """Train a copy of layer, checkpointing every `interval` images.
+
+    If filename exists, training resumes from it and layer is ignored.
+    A checkpoint is also written at the end of every epoch.
+    With augment (an AugmentConfig), every minibatch is randomly augmented,
+    on augment_workers threads if given; the variants drawn after a resume
+    differ from an uninterrupted run.
+    validation: (images, labels) evaluated after every epoch
+    Return the trained MatrixLayer (or Network).
+    """
+    pixels = images_as_array(images)
+    values = labels_as_array(labels)
+    count = min(len(pixels), len(values))
+    rng = numpy.random.default_rng(seed)
+    if os.path.isfile(filename):
+        layer, state = load_checkpoint(filename)
+        instrumentation.info(
+            "Resuming from checkpoint: {} (epoch {}, image {} of {})",
+            filename, state.epoch, state.position, count)
+    else:
+        if isinstance(layer, Layer):
+            layer = MatrixLayer.from_layer(layer)
+        layer = build_model(
+            model_spec(layer), numpy.array(model_parameters(layer)))
+        state = TrainingState(0, 0, count, rng.bit_generator.state)
+    # the state after every drawn batch, in order; batches may be drawn
+    # ahead of training (augment_workers), so the state only advances in
+    # trained_batches()
+    pending_states = collections.deque()
+
+    def drawn_batches():
+        drawn_state = state
+        while True:
+            rng.bit_generator.state = drawn_state.rng_state
+            if shuffle:
+                order = rng.permutation(drawn_state.epoch_size)
+            else:
+                order = numpy.arange(drawn_state.epoch_size)
+            order = numpy.concatenate(
+                [order, numpy.arange(drawn_state.epoch_size, count)])
+            for position in range(drawn_state.position, count, batch_size):
+                batch = order[position:position + batch_size]
+                pending_states.append(
+                    drawn_state._replace(position=position + len(batch)))
+                yield pixels[batch], values[batch]
+            if drawn_state.epoch + 1 >= epochs:
+                return
+            drawn_state = TrainingState(
+                drawn_state.epoch + 1, 0, count, rng.bit_generator.state)
+
+    def trained_batches(batches):
+        nonlocal state
+        for batch_pixels, batch_values in batches:
+            yield batch_pixels, batch_values
+            # the batch has been trained on when the next is requested
+            state = pending_states.popleft()
+            position = state.position
+            if (position == count or
+                    position // interval !=
+                    (position - len(batch_values)) // interval):
+                save_checkpoint(filename, layer, state)
+            if position == count and validation is not None:
+                report_epoch_evaluation(
+                    state.epoch, evaluate_layer(layer, *validation))
+
+    batches = drawn_batches()
+    if augment is not None:
+        dim = int(round(pixels.shape[1] ** 0.5))
+        batches = augment_batches(
+            batches, dim, dim, augment, seed=rng.integers(2 ** 63),
+            workers=augment_workers)
+    return use_layer_batches(layer, trained_batches(batches), train=True)
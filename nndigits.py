@@ -4,7 +4,8 @@
 https://mmlind.github.io/Simple_1-Layer_Neural_Network_for_MNIST_Handwriting_Recognition/
 using Genetic Algorithms in the background.
 
-Note: download and extract data files from http://yann.lecun.com/exdb/mnist/
+Note: download data files from http://yann.lecun.com/exdb/mnist/ (extracting
+them is optional, the .gz files are read directly)
   train-images-idx3-ubyte.gz:  training set images (9912422 bytes)
   train-labels-idx1-ubyte.gz:  training set labels (28881 bytes)
   t10k-images-idx3-ubyte.gz:   test set images (1648877 bytes)
@@ -19,17 +20,33 @@ import pickle
 import random
 from collections import namedtuple
 
+import numpy
+
+import instrumentation
+import model_io
+from mnist_augment import augment as augment_batches
+from mnist_evaluation import evaluate
+from mnist_evaluation import print_evaluation
+from mnist_evaluation import save_evaluation
+from mnist_utils import active_index_of
+from mnist_utils import active_pixels
+from mnist_utils import images_as_array
+from mnist_utils import labels_as_array
+from mnist_utils import mnist_filenames
+from mnist_utils import open_dataset
 from mnist_utils import print_image
-from mnist_utils import read_image_file
-from mnist_utils import read_label_file
+from mnist_utils import top_k_predictions
 
 
 LEARNING_RATE = 0.05
+MODEL_FILENAME = "nn_trained_layer.model"
+PICKLE_FILENAME = "nn_trained_layer.dat"  # before model files
+PREDICT_CHUNK_SIZE = 4096  # images per forward pass in get_scores()
 
 
 class Cell:
-    def __init__(self):
-        self.weight = self._get_init_weight()  # 28x28
+    def __init__(self, size=28*28):
+        self.weight = self._get_init_weight(size)  # 28x28 by default
         self.size = len(self.weight)
         self.output = 0  # range: [0, 1]
 
@@ -38,9 +55,8 @@ class Cell:
         return "weight = {}".format(self.weight[300])
 
     @staticmethod
-    def _get_init_weight():
-        # TODO: use header.imgHeight * header.imgWidth
-        return [random.uniform(0, 1) for x in range(28*28)]
+    def _get_init_weight(size=28*28):
+        return [random.uniform(0, 1) for x in range(size)]
 
 
 Layer = namedtuple(
@@ -50,85 +66,589 @@ Layer = namedtuple(
 )
 
 
+class MatrixLayer:
+    """Layer of 10 cells stored as one (10, 28x28) weight matrix."""
+
+    def __init__(self, weights, dtype=numpy.float64):
+        self.weights = numpy.asarray(weights, dtype=dtype)
+        self.size = self.weights.shape[1]
+        self.outputs = numpy.zeros(len(self.weights))
+
+    @classmethod
+    def from_layer(cls, layer):
+        return cls([cell.weight for cell in layer.cells])
+
+
+ACTIVATIONS = ('linear', 'sigmoid', 'relu', 'softmax')
+
+
+class Network:
+    """Stack of fully connected layers, e.g. sizes=[784, 100, 10].
+
+    All weights and biases live in one contiguous `parameters` buffer,
+    layer after layer; `weights[i]` (outputs, inputs) and `biases[i]` are
+    views into it. The input pixels are scaled to [0, 1].
+    """
+
+    def __init__(self, sizes, hidden_activation='sigmoid',
+                 output_activation='softmax', learning_rate=0.1,
+                 parameters=None, dtype=numpy.float64, seed=None):
+        for activation in (hidden_activation, output_activation):
+            if activation not in ACTIVATIONS:
+                raise ValueError("unknown activation: {}".format(activation))
+        self.sizes = [int(size) for size in sizes]
+        self.hidden_activation = hidden_activation
+        self.output_activation = output_activation
+        self.learning_rate = learning_rate
+        shapes = list(zip(self.sizes[1:], self.sizes[:-1]))
+        total = sum(outputs * inputs + outputs for outputs, inputs in shapes)
+        if parameters is None:
+            self.parameters = numpy.zeros(total, dtype=dtype)
+        else:
+            self.parameters = numpy.asarray(parameters, dtype=dtype)
+            if self.parameters.shape != (total,):
+                raise ValueError("{} parameters for sizes {}".format(
+                    self.parameters.size, self.sizes))
+        self.weights = []
+        self.biases = []
+        offset = 0
+        for outputs, inputs in shapes:
+            self.weights.append(self.parameters[
+                offset:offset + outputs * inputs].reshape(outputs, inputs))
+            offset += outputs * inputs
+            self.biases.append(self.parameters[offset:offset + outputs])
+            offset += outputs
+        if parameters is None:
+            rng = numpy.random.default_rng(seed)
+            for weights in self.weights:
+                limit = numpy.sqrt(6 / sum(weights.shape))  # Glorot
+                weights[...] = rng.uniform(-limit, limit, size=weights.shape)
+
+    @property
+    def activations(self):
+        return ([self.hidden_activation] * (len(self.weights) - 1) +
+                [self.output_activation])
+
+
+def _activate(values, activation):
+    if activation == 'sigmoid':
+        return 1 / (1 + numpy.exp(-values))
+    if activation == 'relu':
+        return numpy.maximum(values, 0)
+    if activation == 'softmax':
+        exp_values = numpy.exp(values - values.max(axis=1, keepdims=True))
+        return exp_values / exp_values.sum(axis=1, keepdims=True)
+    return values
+
+
+def _activation_backward(gradient, activated, activation):
+    """Gradient before the activation from the one after (hidden layers).
+
+    Expressed with the activated values; softmax mixes the outputs of a
+    row, so its Jacobian-vector product replaces the elementwise
+    derivative.
+    """
+    if activation == 'sigmoid':
+        return gradient * activated * (1 - activated)
+    if activation == 'relu':
+        return gradient * (activated > 0)
+    if activation == 'softmax':
+        return activated * (
+            gradient - (gradient * activated).sum(axis=1, keepdims=True))
+    return gradient
+
+
+def calc_network_activations(network, pixels):
+    """Return the activations of every layer, from input to output."""
+    activations = [pixels / numpy.array(255, dtype=network.parameters.dtype)]
+    for weights, biases, activation in zip(
+            network.weights, network.biases, network.activations):
+        activations.append(
+            _activate(activations[-1] @ weights.T + biases, activation))
+    return activations
+
+
+def train_network(network, pixels, values):
+    """One backpropagation step on a minibatch; return the outputs.
+
+    The loss is cross entropy for a softmax output and the squared error
+    otherwise; the gradient is averaged over the minibatch.
+    """
+    with instrumentation.timer("forward"):
+        activations = calc_network_activations(network, pixels)
+    with instrumentation.timer("update"):
+        outputs = activations[-1]
+        delta = outputs - get_target_outputs(values)
+        if network.output_activation == 'sigmoid':
+            delta *= outputs * (1 - outputs)
+        elif network.output_activation == 'relu':
+            delta *= outputs > 0
+        rate = network.learning_rate / len(pixels)
+        for i in reversed(range(len(network.weights))):
+            gradient = delta.T @ activations[i]
+            bias_gradient = delta.sum(axis=0)
+            if i:
+                delta = _activation_backward(
+                    delta @ network.weights[i], activations[i],
+                    network.hidden_activation)
+            network.weights[i] -= rate * gradient
+            network.biases[i] -= rate * bias_gradient
+    instrumentation.count("update.images", len(pixels))
+    return outputs
+
+
+def init_network(size=28*28, hidden_sizes=(100,), **kwargs):
+    """Create a Network for images of size pixels and the 10 digits."""
+    return Network([size, *hidden_sizes, 10], **kwargs)
+
+
 def main():
     trained_layer = train_layer()
     test_layer(trained_layer)
 
 
-def train_layer():
-    pickle_filename = "nn_trained_layer.dat"
+def model_spec(layer):
+    """Picklable description to rebuild the model around its parameters."""
+    if isinstance(layer, Network):
+        return {
+            "sizes": layer.sizes,
+            "hidden_activation": layer.hidden_activation,
+            "output_activation": layer.output_activation,
+            "learning_rate": layer.learning_rate,
+        }
+    return None
+
+
+def model_parameters(layer):
+    if isinstance(layer, Network):
+        return layer.parameters
+    return layer.weights
+
+
+def build_model(spec, parameters):
+    """Wrap parameters (without copying) in a MatrixLayer or Network."""
+    if spec is None:
+        return MatrixLayer(parameters)
+    return Network(parameters=parameters, **spec)
+
+
+def save_layer(layer, filename):
+    """Save a Layer, MatrixLayer or Network as float32 model file."""
+    if isinstance(layer, Network):
+        if len(layer.sizes) > model_io.MAX_META - 2:
+            raise ValueError("too many layers for a model file")
+        model_io.save_model(
+            filename, model_io.NN_NETWORK, layer.parameters, meta=(
+                ACTIVATIONS.index(layer.hidden_activation),
+                ACTIVATIONS.index(layer.output_activation),
+                *layer.sizes))
+        return
+    if not isinstance(layer, MatrixLayer):
+        layer = MatrixLayer.from_layer(layer)
+    model_io.save_model(filename, model_io.NN_LAYER, layer.weights)
+
+
+def load_layer(filename, writable=False):
+    """Load a MatrixLayer or Network.
+
+    The weights stay memory-mapped (read-only float32) unless writable.
+    """
+    header, weights = model_io.load_model_with_header(filename)
+    dtype = numpy.float64 if writable else weights.dtype
+    if header.kind == model_io.NN_NETWORK:
+        hidden_activation, output_activation, *sizes = header.meta
+        return Network(
+            [size for size in sizes if size],
+            hidden_activation=ACTIVATIONS[hidden_activation],
+            output_activation=ACTIVATIONS[output_activation],
+            parameters=weights, dtype=dtype)
+    if header.kind != model_io.NN_LAYER:
+        raise ValueError("{}: not an nndigits model".format(filename))
+    return MatrixLayer(weights, dtype=dtype)
+
+
+def train_layer(batch_size=None, workers=None, hidden_sizes=None,
+                data_dir=".", model_filename=MODEL_FILENAME, retrain=False,
+                checkpoint_filename=None, epochs=1, augment=None,
+                augment_workers=0, evaluate_epochs=False, shuffle=None,
+                seed=None, mode='average', bbox=None):
+    """Load the trained layer or train (and save) a new one.
+
+    With workers, training is data-parallel (see nnparallel), for epochs
+    epochs in the given mode and on images shuffled from seed; it has no
+    checkpoints, augmentation or file order (ValueError). With
+    hidden_sizes, a multi-layer Network is trained instead of one layer.
+    With retrain, an existing model (and checkpoint) file is ignored and
+    overwritten.
+    Training runs for epochs epochs, every epoch on a new random image
+    order drawn from seed with shuffle (None: when there are several
+    epochs).
+    With a checkpoint_filename, training is checkpointed; if the
+    checkpoint exists, training resumes from it even when the model file
+    exists, e.g. to continue on images appended to the training files.
+    With augment (an AugmentConfig), training runs on randomly augmented
+    images (see mnist_augment), augmented on augment_workers threads.
+    With evaluate_epochs, the layer is evaluated on the test set after
+    every epoch. With bbox, the bounding-box images of that size are used
+    (see mnist_filenames).
+    """
+    if workers and (checkpoint_filename or augment is not None or
+                    shuffle is False):
+        raise ValueError("data-parallel training (workers) has no "
+                         "checkpoints, augmentation or file order")
+    pickle_filename = os.path.join(
+        os.path.dirname(model_filename), PICKLE_FILENAME)
+    resume = False
+    if checkpoint_filename and os.path.isfile(checkpoint_filename):
+        if retrain:
+            os.remove(checkpoint_filename)
+        else:
+            resume = True
     trained_layer = None
-    if os.path.isfile(pickle_filename):
-        print("Found pickle file: {}".format(pickle_filename))
+    if os.path.isfile(model_filename) and not (retrain or resume):
+        instrumentation.info("Found model file: {}", model_filename)
+        trained_layer = load_layer(model_filename)
+    elif os.path.isfile(pickle_filename) and not (retrain or resume):
+        instrumentation.info("Found pickle file: {}", pickle_filename)
         with open(pickle_filename, "rb") as file_obj:
             trained_layer = pickle.load(file_obj)
     else:
-        print("Could not find pickle file: {}".format(pickle_filename))
-        initial_layer = init_layer()
-        train_images = read_image_file("./train-images-idx3-ubyte")
-        train_labels = read_label_file("./train-labels-idx1-ubyte")
-        trained_layer = use_layer(initial_layer, train_images, train_labels,
-                                  train=True)
-        with open(pickle_filename, "wb") as file_obj:
-            pickle.dump(trained_layer, file_obj)
+        instrumentation.info("Training model: {}", model_filename)
+        train_images, train_labels = open_dataset(
+            *mnist_filenames("train", data_dir, bbox))
+        if hidden_sizes:
+            initial_layer = init_network(
+                train_images.image_size, hidden_sizes)
+            batch_size = batch_size or 32
+        else:
+            initial_layer = init_layer(train_images.image_size)
+        validation = None
+        if evaluate_epochs:
+            validation = open_dataset(
+                *mnist_filenames("test", data_dir, bbox))
+        if workers:
+            # imported here: nnparallel depends on this module
+            from nnparallel import train_parallel
+            trained_layer = train_parallel(
+                initial_layer, train_images, train_labels, workers=workers,
+                epochs=epochs, batch_size=batch_size or 32, mode=mode,
+                seed=seed, validation=validation)
+        else:
+            trained_layer = use_layer(
+                initial_layer, train_images, train_labels,
+                train=True, batch_size=batch_size, epochs=epochs,
+                shuffle=epochs > 1 if shuffle is None else shuffle,
+                seed=seed, augment=augment, augment_workers=augment_workers,
+                validation=validation,
+                checkpoint_filename=checkpoint_filename)
+        save_layer(trained_layer, model_filename)
     return trained_layer
 
 
-def test_layer(trained_layer):
-    test_images = read_image_file("./t10k-images-idx3-ubyte")
-    test_labels = read_label_file("./t10k-labels-idx1-ubyte")
-    use_layer(trained_layer, test_images, test_labels, train=False)
-
-
-def use_layer(layer, images, labels, train=False):
+def test_layer(trained_layer, data_dir=".", evaluation_filename=None, k=3,
+               bbox=None):
+    """Evaluate the layer on the test set, print and return the Evaluation.
+
+    With an evaluation_filename, the Evaluation is also saved as JSON.
+    With bbox, the bounding-box test images of that size are used.
+    """
+    test_images, test_labels = open_dataset(
+        *mnist_filenames("test", data_dir, bbox))
+    evaluation = evaluate_layer(trained_layer, test_images, test_labels, k)
+    print_evaluation(evaluation)
+    if evaluation_filename:
+        save_evaluation(evaluation, evaluation_filename)
+    return evaluation
+
+
+def use_layer(layer, images, labels, train=False, batch_size=None,
+              epochs=1, shuffle=False, seed=None, augment=None,
+              augment_workers=0, validation=None, checkpoint_filename=None,
+              interval=None):
+    """Run (and optionally train) the layer on the images.
+
+    With a batch_size (or a MatrixLayer or Network) the vectorized engine
+    is used and a MatrixLayer (or the Network) is returned; otherwise cells
+    are updated one by one.
+    Training runs for epochs epochs, every epoch on a new random image
+    order drawn from seed with shuffle (on the vectorized engine), and
+    evaluates validation (images, labels) after every epoch if given.
+    With augment (an AugmentConfig), the vectorized engine runs on randomly
+    augmented copies of every minibatch (see mnist_augment), augmented
+    ahead of training on augment_workers threads if given.
+    With a checkpoint_filename, training is resumable and checkpointed
+    every interval images (see nncheckpoint.train_with_checkpoints).
+    Training options without train, or an interval without a
+    checkpoint_filename, raise ValueError.
+    """
+    if not train and (epochs != 1 or shuffle or validation is not None or
+                      checkpoint_filename):
+        raise ValueError("epochs, shuffle, validation and checkpoints "
+                         "need train")
+    if interval is not None and not checkpoint_filename:
+        raise ValueError("interval needs a checkpoint_filename")
+    if checkpoint_filename:
+        # imported here: nncheckpoint depends on this module
+        from nncheckpoint import CHECKPOINT_INTERVAL
+        from nncheckpoint import train_with_checkpoints
+        return train_with_checkpoints(
+            layer, images, labels, checkpoint_filename, epochs=epochs,
+            batch_size=batch_size or 1, shuffle=shuffle, seed=seed,
+            interval=interval or CHECKPOINT_INTERVAL, augment=augment,
+            augment_workers=augment_workers, validation=validation)
+    if epochs != 1 or shuffle or validation is not None:
+        rng = numpy.random.default_rng(seed)
+        if shuffle:
+            pixels = images_as_array(images)
+            values = labels_as_array(labels)
+            if isinstance(layer, Layer):
+                layer = MatrixLayer.from_layer(layer)
+        for epoch in range(epochs):
+            if shuffle:
+                order = rng.permutation(min(len(pixels), len(values)))
+                images, labels = pixels[order], values[order]
+            layer = use_layer(layer, images, labels, train=True,
+                              batch_size=batch_size, augment=augment,
+                              augment_workers=augment_workers)
+            if validation is not None:
+                report_epoch_evaluation(
+                    epoch, evaluate_layer(layer, *validation))
+        return layer
+    if (batch_size is not None or augment is not None or
+            isinstance(layer, (MatrixLayer, Network))):
+        return use_matrix_layer(layer, images, labels, train=train,
+                                batch_size=batch_size or 1, augment=augment,
+                                augment_workers=augment_workers)
     error_count = 0
+    active_index = active_index_of(images)
+    offsets = active_index.offsets
     for index, (image, label) in enumerate(zip(images, labels)):
         target_output = get_target_output(label)
+        part = slice(offsets[index], offsets[index + 1])
+        active = active_index.indices[part].tolist()
+        intensities = (active_index.values[part] / 255).tolist()
         for cell, target in zip(layer.cells, target_output):
-            calc_cell_output(cell, image)
+            calc_cell_output(cell, image, active)
             if train:
-                train_cell(cell, image, target)
+                train_cell(cell, image, target, active, intensities)
         predicted_number = get_layer_prediction(layer)
         if predicted_number != label.value:
             error_count += 1
-            if error_count % 100 == 0:
-                print("Prediction: {}, actual: {}, "
-                      "success rate: {:.02} (error count: {}) "
-                      "at {} image {}".format(
-                          predicted_number,
-                          label.value,
-                          (1 - error_count / (index + 1)),
-                          error_count,
-                          'training' if train else 'testing',
-                          index)
-                      )
+            if instrumentation.sampled("use_layer.errors", every=100):
+                instrumentation.trace(
+                    "Prediction: {}, actual: {}, "
+                    "success rate: {:.02} (error count: {}) "
+                    "at {} image {}",
+                    predicted_number,
+                    label.value,
+                    (1 - error_count / (index + 1)),
+                    error_count,
+                    'training' if train else 'testing',
+                    index)
                 print_image(image.pixels)
-    print("Overall success rate: {:.02} "
-          "(error count: {}, image count: {}) [{}]"
-          .format(
-              (1 - error_count / (len(images))),
-              error_count,
-              len(images),
-              'train' if train else 'test')
-          )
+    instrumentation.info(
+        "Overall success rate: {:.02} "
+        "(error count: {}, image count: {}) [{}]",
+        (1 - error_count / (len(images))),
+        error_count,
+        len(images),
+        'train' if train else 'test')
+    return layer
+
+
+def use_matrix_layer(layer, images, labels, train=False, batch_size=1,
+                     augment=None, augment_workers=0):
+    if batch_size == 1 and augment is None and not isinstance(
+            layer, Network):
+        return use_sparse_layer(layer, images, labels, train=train)
+    pixels = images_as_array(images)
+    values = labels_as_array(labels)
+    batches = (
+        (pixels[start:start + batch_size], values[start:start + batch_size])
+        for start in range(0, len(pixels), batch_size)
+    )
+    if augment is not None:
+        dim = int(round(pixels.shape[1] ** 0.5))
+        batches = augment_batches(batches, dim, dim, augment,
+                                  seed=random.getrandbits(64),
+                                  workers=augment_workers)
+    return use_layer_batches(layer, batches, train=train)
+
+
+def use_sparse_layer(layer, images, labels, train=False):
+    """use_matrix_layer() one image at a time, on the active pixels only.
+
+    Only the weight columns of the non-zero pixels (see ActivePixels) are
+    read and updated; BLAS is faster for larger minibatches.
+    """
+    if not isinstance(layer, MatrixLayer):
+        layer = MatrixLayer.from_layer(layer)
+    active_index = active_index_of(images)
+    offsets = active_index.offsets
+    values = labels_as_array(labels)
+    weights = layer.weights
+    digits = numpy.arange(10)
+    image_count = min(len(offsets) - 1, len(values))
+    error_count = 0
+    with instrumentation.timer("sparse"):
+        for index in range(image_count):
+            part = slice(offsets[index], offsets[index + 1])
+            active = active_index.indices[part]
+            outputs = weights[:, active].sum(axis=1) / weights.shape[1]
+            if train:
+                errors = (digits == values[index]) - outputs
+                weights[:, active] += LEARNING_RATE * numpy.multiply.outer(
+                    errors, active_index.values[part] / 255)
+            predicted_number = outputs.argmax() if outputs.max() > 0 else 0
+            error_count += int(predicted_number != values[index])
+    if image_count:
+        layer.outputs = outputs
+    instrumentation.count("sparse.images", image_count)
+    _print_success_rate(error_count, image_count, train)
+    return layer
+
+
+def use_layer_batches(layer, batches, train=False):
+    """Run (and optionally train) the layer on (pixels, labels) minibatches.
+
+    Only one minibatch is needed at a time, so batches can be streamed
+    (see mnist_pipeline.minibatches()).
+    """
+    if not isinstance(layer, (MatrixLayer, Network)):
+        layer = MatrixLayer.from_layer(layer)
+    error_count = 0
+    image_count = 0
+    for batch_pixels, batch_values in batches:
+        if isinstance(layer, Network):
+            if train:
+                outputs = train_network(layer, batch_pixels, batch_values)
+            else:
+                outputs = calc_network_activations(layer, batch_pixels)[-1]
+        else:
+            outputs = calc_layer_outputs(layer, batch_pixels)
+            if train:
+                errors = get_target_outputs(batch_values) - outputs
+                update_layer_weights(layer, batch_pixels, errors)
+        predicted_numbers = get_layer_predictions(outputs)
+        error_count += int(numpy.count_nonzero(
+            predicted_numbers != batch_values))
+        image_count += len(batch_values)
+    _print_success_rate(error_count, image_count, train)
     return layer
 
 
+def _print_success_rate(error_count, image_count, train):
+    instrumentation.info(
+        "Overall success rate: {:.02} "
+        "(error count: {}, image count: {}) [{}]",
+        (1 - error_count / max(image_count, 1)),
+        error_count,
+        image_count,
+        'train' if train else 'test')
+
+
+def calc_layer_outputs(layer, pixels):
+    """Vectorized calc_cell_output() of all cells for a batch of images."""
+    with instrumentation.timer("forward"):
+        outputs = get_layer_outputs(layer.weights, pixels)
+    instrumentation.count("forward.images", len(pixels))
+    layer.outputs = outputs[-1]
+    return outputs
+
+
+def get_layer_outputs(weights, pixels):
+    """Return the (images, cells) outputs without touching any layer state."""
+    outputs = (pixels != 0) @ weights.T
+    outputs /= weights.shape[1]  # normalize output [0, 1]
+    return outputs
+
+
+def get_scores(layer, images):
+    """Return the (images, 10) cell outputs of the layer as scores.
+
+    Works on a Layer, MatrixLayer or Network without writing any outputs,
+    so a trained layer can be shared between threads. The scores of a
+    Network are its output activations.
+    """
+    if isinstance(layer, Network):
+        def get_outputs(chunk):
+            return calc_network_activations(layer, chunk)[-1]
+        dtype = layer.parameters.dtype
+    else:
+        if isinstance(layer, MatrixLayer):
+            weights = layer.weights
+        else:
+            weights = numpy.array([cell.weight for cell in layer.cells])
+
+        def get_outputs(chunk):
+            return get_layer_outputs(weights, chunk)
+        dtype = weights.dtype
+    pixels = images_as_array(images)
+    scores = numpy.empty((len(pixels), 10), dtype=dtype)
+    with instrumentation.timer("predict"):
+        for start in range(0, len(pixels), PREDICT_CHUNK_SIZE):
+            chunk = slice(start, start + PREDICT_CHUNK_SIZE)
+            scores[chunk] = get_outputs(pixels[chunk])
+    instrumentation.count("predict.images", len(pixels))
+    return scores
+
+
+def predict_batch(layer, images, k=1):
+    """Return the (images, k) top digits and their scores (get_scores())."""
+    return top_k_predictions(get_scores(layer, images), k)
+
+
+def evaluate_layer(layer, images, labels, k=3):
+    """Return the mnist_evaluation.Evaluation of the layer on the images."""
+    return evaluate(get_scores(layer, images), labels, k)
+
+
+def report_epoch_evaluation(epoch, evaluation):
+    instrumentation.info(
+        "Epoch {}: validation success rate: {:.3f}, top-{}: {:.3f} "
+        "(image count: {})",
+        epoch + 1,
+        evaluation.accuracy,
+        len(evaluation.top_k_accuracy),
+        evaluation.top_k_accuracy[-1],
+        evaluation.image_count)
+
+
+def update_layer_weights(layer, pixels, errors):
+    """Vectorized update_cell_weights(), summing the deltas of the batch."""
+    with instrumentation.timer("update"):
+        layer.weights += LEARNING_RATE * (errors.T @ (pixels / 255))
+    instrumentation.count("update.images", len(pixels))
+
+
+def get_target_outputs(values):
+    """Vectorized get_target_output() (one row per label value)."""
+    return (values[:, None] == numpy.arange(10)).astype(numpy.float64)
+
+
+def get_layer_predictions(outputs):
+    """Vectorized get_layer_prediction(): 0 unless some output is positive."""
+    return numpy.where(outputs.max(axis=1) > 0, outputs.argmax(axis=1), 0)
+
+
 def get_target_output(label):
     # print("label = {}, value = {}".format(label, label.value))
     """Create target vector according to target number."""
     return [1 if x == label.value else 0 for x in range(10)]
 
 
-def train_cell(cell, image, target):
+def train_cell(cell, image, target, active=None, intensities=None):
     error = get_cell_error(cell, target)
-    update_cell_weights(cell, image, error)
+    update_cell_weights(cell, image, error, active, intensities)
 
 
-def calc_cell_output(cell, image):
+def calc_cell_output(cell, image, active=None):
+    """active: the active_pixels() of image, if already known"""
+    if active is None:
+        active = active_pixels(image)
     cell.output = 0
-    for i in range(cell.size):
-        cell.output += image.bw_pixels[i] * cell.weight[i]
+    for i in active:  # black pixels add nothing
+        cell.output += cell.weight[i]
     cell.output /= cell.size  # normalize output [0, 1]
 
 
@@ -136,9 +656,14 @@ def get_cell_error(cell, target):  # target: 0 or 1
     return target - cell.output
 
 
-def update_cell_weights(cell, image, error):
-    for i in range(cell.size):
-        cell.weight[i] += LEARNING_RATE * (image.pixels[i] / 255) * error
+def update_cell_weights(cell, image, error, active=None, intensities=None):
+    """intensities: the pixels / 255 of the active pixels, if already known"""
+    if active is None:
+        active = active_pixels(image)
+    if intensities is None:
+        intensities = [image.pixels[i] / 255 for i in active]
+    for i, intensity in zip(active, intensities):
+        cell.weight[i] += LEARNING_RATE * intensity * error
 
 
 def get_layer_prediction(layer):
@@ -149,11 +674,11 @@ def get_layer_prediction(layer):
             max_output = layer.cells[i].output
             index_of_cell_with_max_output = i
     return index_of_cell_with_max_output
-    # TODO: show second most probable prediction
 
 
-def init_layer():
-    cells = [Cell() for x in range(10)]
+def init_layer(size=28*28):
+    """Create a layer for images of size (imgHeight * imgWidth) pixels."""
+    cells = [Cell(size) for x in range(10)]
     return Layer(cells)
 
 
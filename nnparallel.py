@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""Data-parallel training of the nndigits layer on a process pool.
+
+The training images are copied once into shared memory; every epoch the
+(seeded) shuffled image order is split into one shard per worker. Two
+merge modes are supported:
+
+  'average'  synchronous: every sync_batches minibatches each worker
+             returns its locally trained weights, and the parent averages
+             them into the weights of the next round (deterministic for a
+             given seed and worker count)
+  'hogwild'  asynchronous: the weights live in shared memory as well and
+             every worker applies its minibatch updates to them in place,
+             without locking
+"""
+
+import concurrent.futures
+import os
+
+import numpy
+
+import instrumentation
+from mnist_utils import images_as_array
+from mnist_utils import labels_as_array
+from nndigits import MatrixLayer
+from nndigits import Network
+from nndigits import build_model
+from nndigits import calc_layer_outputs
+from nndigits import evaluate_layer
+from nndigits import get_layer_predictions
+from nndigits import get_target_outputs
+from nndigits import model_parameters
+from nndigits import model_spec
+from nndigits import report_epoch_evaluation
+from nndigits import train_network
+from nndigits import update_layer_weights
+from shared_array import SharedArray
+
+
+_worker_arrays = {}  # the SharedArray objects keep the segments mapped
+
+
+def _init_worker(specs):
+    for key, (shape, dtype, name) in specs.items():
+        _worker_arrays[key] = SharedArray(shape, dtype, name)
+
+
+def _train_batches(layer, indices, batch_size):
+    """Train layer on the images at indices; return the error count."""
+    pixels = _worker_arrays["pixels"].array
+    values = _worker_arrays["labels"].array
+    error_count = 0
+    for start in range(0, len(indices), batch_size):
+        batch = indices[start:start + batch_size]
+        batch_pixels, batch_values = pixels[batch], values[batch]
+        if isinstance(layer, Network):
+            outputs = train_network(layer, batch_pixels, batch_values)
+        else:
+            outputs = calc_layer_outputs(layer, batch_pixels)
+            update_layer_weights(layer, batch_pixels,
+                                 get_target_outputs(batch_values) - outputs)
+        error_count += int(numpy.count_nonzero(
+            get_layer_predictions(outputs) != batch_values))
+    return error_count
+
+
+def _train_local(spec, parameters, indices, batch_size):
+    layer = build_model(spec, parameters.copy())
+    error_count = _train_batches(layer, indices, batch_size)
+    return model_parameters(layer), error_count
+
+
+def _train_shared(spec, indices, batch_size):
+    # the parameters are updated in place, in shared memory
+    layer = build_model(spec, _worker_arrays["parameters"].array)
+    return _train_batches(layer, indices, batch_size)
+
+
+def train_parallel(layer, images, labels, workers=None, epochs=1,
+                   batch_size=32, mode='average', sync_batches=None,
+                   seed=None, validation=None):
+    """Train the layer on shards of the images in worker processes.
+
+    sync_batches: minibatches per worker between two averaging steps
+                  (None: average once per epoch); ignored for 'hogwild'
+    validation: (images, labels) evaluated after every epoch
+    Return the trained MatrixLayer (or Network).
+    """
+    if mode not in ('average', 'hogwild'):
+        raise ValueError("unknown mode: {}".format(mode))
+    if not isinstance(layer, (MatrixLayer, Network)):
+        layer = MatrixLayer.from_layer(layer)
+    spec = model_spec(layer)
+    workers = workers or os.cpu_count()
+    rng = numpy.random.default_rng(seed)
+    pixels = SharedArray.copy_of(numpy.asarray(images_as_array(images)))
+    values = SharedArray.copy_of(numpy.asarray(labels_as_array(labels)))
+    shared = {"pixels": pixels, "labels": values}
+    if mode == 'hogwild':
+        shared["parameters"] = SharedArray.copy_of(model_parameters(layer))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=({key: array.spec
+                           for key, array in shared.items()},)) as executor:
+            for epoch in range(epochs):
+                shards = numpy.array_split(
+                    rng.permutation(len(values.array)), workers)
+                if mode == 'hogwild':
+                    error_count = sum(executor.map(
+                        _train_shared, [spec] * workers, shards,
+                        [batch_size] * workers))
+                else:
+                    error_count = _average_epoch(
+                        executor, layer, spec, shards, batch_size,
+                        sync_batches)
+                instrumentation.info(
+                    "Epoch {}: success rate: {:.02} "
+                    "(error count: {}, image count: {}) [{} x {}]",
+                    epoch + 1,
+                    1 - error_count / len(values.array),
+                    error_count,
+                    len(values.array),
+                    workers,
+                    mode)
+                if validation is not None:
+                    evaluated = layer
+                    if mode == 'hogwild':
+                        evaluated = build_model(
+                            spec, shared["parameters"].array)
+                    report_epoch_evaluation(
+                        epoch, evaluate_layer(evaluated, *validation))
+            if mode == 'hogwild':
+                model_parameters(layer)[...] = shared["parameters"].array
+    finally:
+        for array in shared.values():
+            array.close()
+    return layer
+
+
+def _average_epoch(executor, layer, spec, shards, batch_size, sync_batches):
+    step = (sync_batches * batch_size if sync_batches
+            else max(len(shard) for shard in shards))
+    error_count = 0
+    for start in range(0, max(len(shard) for shard in shards), step):
+        parts = [shard[start:start + step] for shard in shards]
+        parts = [part for part in parts if len(part)]
+        parameters = model_parameters(layer)
+        results = list(executor.map(
+            _train_local, [spec] * len(parts), [parameters] * len(parts),
+            parts, [batch_size] * len(parts)))
+        parameters[...] = numpy.mean(
+            [worker_parameters for worker_parameters, _ in results], axis=0)
+        error_count += sum(errors for _, errors in results)
+    return error_count
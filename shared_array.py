@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""NumPy arrays in named shared memory segments.
+
+The creating process copies an array in once (SharedArray.copy_of) and
+hands its picklable spec to worker processes, which attach to the same
+segment instead of receiving a pickled copy.
+"""
+
+from multiprocessing import shared_memory
+
+import numpy
+
+
+class SharedArray:
+    """NumPy array in a named shared memory segment."""
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        size = max(int(numpy.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(
+            name=name, create=self.owner, size=size if self.owner else 0)
+        self.array = numpy.ndarray(
+            self.shape, dtype=self.dtype, buffer=self.memory.buf)
+
+    @classmethod
+    def copy_of(cls, array):
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def spec(self):
+        """Picklable (shape, dtype, name) to attach from other processes."""
+        return self.shape, self.dtype.str, self.memory.name
+
+    def close(self):
+        del self.array
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
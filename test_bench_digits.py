@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import bench_digits
+
+
+class TestBenchDigits(unittest.TestCase):
+    def test_run_benchmarks(self):
+        results = bench_digits.run_benchmarks(
+            image_count=50, repeat=1,
+            names=["open_files", "use_matrix_layer_epoch", "predict_batch"])
+        self.assertEqual(50, results["image_count"])
+        self.assertEqual(
+            ["open_files", "predict_batch", "use_matrix_layer_epoch"],
+            sorted(results["benchmarks"]))
+        for result in results["benchmarks"].values():
+            self.assertEqual(50, result["items"])
+            self.assertGreater(result["items_per_sec"], 0)
+            self.assertGreater(result["peak_rss_kb"], 0)
+        json.dumps(results)
+
+    def test_compare(self):
+        old = {"benchmarks": {
+            "a": {"items_per_sec": 100.0},
+            "b": {"items_per_sec": 100.0},
+            "c": {"items_per_sec": 100.0},
+        }}
+        new = {"benchmarks": {
+            "a": {"items_per_sec": 95.0},
+            "b": {"items_per_sec": 50.0},
+            "c": {"items_per_sec": 200.0},
+            "d": {"items_per_sec": 1.0},
+        }}
+        self.assertEqual(
+            [("b", 100.0, 50.0, -0.5)], bench_digits.compare(old, new, 0.1))
+
+    def test_main_compare_exit_code(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            filenames = []
+            for rate in (100.0, 10.0):
+                filename = os.path.join(dirname, "{}.json".format(rate))
+                with open(filename, "w") as result_file:
+                    json.dump({"benchmarks": {
+                        "a": {"items_per_sec": rate}}}, result_file)
+                filenames.append(filename)
+            with unittest.mock.patch("builtins.print"):
+                self.assertEqual(
+                    1, bench_digits.main(["--compare"] + filenames))
+                self.assertEqual(
+                    0, bench_digits.main(["--compare"] + filenames[::-1]))
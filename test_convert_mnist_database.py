@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from convert_mnist_database import bounding_boxes
+from convert_mnist_database import convert_image_file
+from convert_mnist_database import normalize_images
+from mnist_utils import open_image_file
+from mnist_utils import write_image_file
+
+
+def make_square_images(positions, square=6, dim=28):
+    images = numpy.zeros((len(positions), dim, dim), dtype=numpy.uint8)
+    for image, (y, x) in zip(images, positions):
+        image[y:y + square, x:x + square] = 255
+    return images
+
+
+class TestBoundingBoxes(unittest.TestCase):
+    def test_bounding_boxes(self):
+        images = make_square_images([(0, 0), (10, 3), (22, 22)])
+        images[1, 12, 20] = 1
+        top, bottom, left, right = bounding_boxes(images)
+        self.assertEqual([0, 10, 22], top.tolist())
+        self.assertEqual([6, 16, 28], bottom.tolist())
+        self.assertEqual([0, 3, 22], left.tolist())
+        self.assertEqual([6, 21, 28], right.tolist())
+
+    def test_empty_image(self):
+        top, bottom, left, right = bounding_boxes(
+            numpy.zeros((1, 28, 28), dtype=numpy.uint8))
+        self.assertEqual(([0], [28], [0], [28]), (
+            top.tolist(), bottom.tolist(), left.tolist(), right.tolist()))
+
+
+class TestNormalizeImages(unittest.TestCase):
+    def test_position_does_not_matter(self):
+        normalized = normalize_images(
+            make_square_images([(0, 0), (5, 17), (22, 22)]), size=12)
+        self.assertEqual((3, 12, 12), normalized.shape)
+        numpy.testing.assert_array_equal(normalized[0], normalized[1])
+        numpy.testing.assert_array_equal(normalized[0], normalized[2])
+        self.assertEqual(255, normalized[0, 6, 6])
+
+    def test_box_is_filled(self):
+        normalized = normalize_images(make_square_images([(3, 4)]), size=6)
+        self.assertEqual(255, normalized.min())
+
+    def test_aspect_ratio_is_kept(self):
+        images = numpy.zeros((1, 28, 28), dtype=numpy.uint8)
+        images[0, 4:24, 10:15] = 255  # 20 x 5 vertical bar
+        normalized = normalize_images(images, size=20)
+        self.assertEqual(255, normalized[0, 10, 10])
+        self.assertEqual(0, normalized[0, 10, 0])
+        self.assertEqual(0, normalized[0, 10, 19])
+
+
+class TestConvertImageFile(unittest.TestCase):
+    def test_writes_idx_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, "source-idx3-ubyte")
+            target = os.path.join(tmpdir, "target-idx3-ubyte")
+            images = make_square_images([(1, 2), (20, 5)])
+            write_image_file(source, images.reshape(2, -1), 28, 28)
+            convert_image_file(source, target, size=10)
+            converted = open_image_file(target)
+            self.assertEqual(2, len(converted))
+            self.assertEqual((10, 10), (
+                converted.header.imgWidth, converted.header.imgHeight))
+            self.assertEqual(255, converted.pixels[:, 55].min())
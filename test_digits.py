@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy
+
+import digits
+import gadigits
+import instrumentation
+import nndigits
+import nnparallel
+from mnist_evaluation import load_evaluation
+from mnist_utils import MNIST_FILES
+from mnist_utils import mnist_filenames
+from mnist_utils import write_image_file
+from mnist_utils import write_label_file
+from test_nndigits import make_separable_images
+
+
+class TestDigitsCommand(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmpdir.name
+        for seed, subset in enumerate(MNIST_FILES):
+            pixels, values = make_separable_images(200, seed)
+            image_filename, label_filename = mnist_filenames(
+                subset, self.data_dir)
+            write_image_file(image_filename, pixels, 28, 28)
+            write_label_file(label_filename, values)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print = self.print_patcher.start()
+        self.verbosity = instrumentation.verbosity
+
+    def tearDown(self):
+        instrumentation.configure(self.verbosity)
+        self.print_patcher.stop()
+        self.tmpdir.cleanup()
+
+    def run_digits(self, *argv):
+        return digits.main(["--data-dir", self.data_dir] + list(argv))
+
+    def model_filename(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def printed(self):
+        return [call.args[0] for call in self.print.call_args_list]
+
+    def test_nn_train_test_predict(self):
+        model = self.model_filename("nn.model")
+        self.run_digits("train", "nn", "--model", model, "--batch-size", "20")
+        self.assertTrue(os.path.isfile(model))
+        self.run_digits("test", "nn", "--model", model)
+        self.assertIn("Overall success rate", self.printed()[-1])
+        evaluation_filename = self.model_filename("nn.json")
+        self.run_digits("test", "nn", "--model", model,
+                        "--json", evaluation_filename, "-k", "2")
+        self.assertEqual(
+            2, len(load_evaluation(evaluation_filename).top_k_accuracy))
+
+        self.print.reset_mock()
+        self.run_digits("predict", "--model", model, "-k", "2", "3", "7")
+        lines = self.printed()
+        self.assertEqual(len(lines), 2)
+        expected, _ = nndigits.predict_batch(
+            nndigits.load_layer(model),
+            nndigits.open_dataset(
+                *mnist_filenames("test", self.data_dir))[0].pixels[[3, 7]],
+            k=2)
+        for line, (digit, _) in zip(lines, expected):
+            self.assertTrue(line.startswith("t10k-images-idx3-ubyte"))
+            self.assertIn(": {} (".format(digit), line)
+
+    def test_retrain(self):
+        model = self.model_filename("nn.model")
+        self.run_digits("train", "nn", "--model", model, "--batch-size", "20")
+        mtime = os.stat(model).st_mtime_ns
+        self.run_digits("train", "nn", "--model", model)
+        self.assertEqual(os.stat(model).st_mtime_ns, mtime)
+        os.utime(model, ns=(0, 0))
+        self.run_digits("train", "nn", "--model", model, "--batch-size", "20",
+                        "--retrain")
+        self.assertNotEqual(os.stat(model).st_mtime_ns, 0)
+
+    def test_nn_train_epochs(self):
+        model = self.model_filename("nn.model")
+        self.run_digits("train", "nn", "--model", model, "--batch-size", "20",
+                        "--epochs", "3", "--evaluate")
+        self.assertEqual(
+            3, sum(line.startswith("Epoch ") for line in self.printed()))
+        self.assertTrue(os.path.isfile(model))
+
+    def test_nn_parallel_train_options(self):
+        model = self.model_filename("nn.model")
+        with unittest.mock.patch(
+                "nnparallel.train_parallel",
+                wraps=nnparallel.train_parallel) as train_parallel:
+            self.run_digits("train", "nn", "--model", model, "--workers",
+                            "2", "--epochs", "2", "--mode", "hogwild",
+                            "--seed", "3")
+        self.assertEqual(
+            (2, 'hogwild', 3),
+            tuple(train_parallel.call_args.kwargs[name]
+                  for name in ("epochs", "mode", "seed")))
+        self.assertTrue(os.path.isfile(model))
+        for options in (["--checkpoint", model + ".ckpt"], ["--augment"],
+                        ["--no-shuffle"]):
+            with self.assertRaises(ValueError):
+                self.run_digits("train", "nn", "--model", model, "--retrain",
+                                "--workers", "2", *options)
+
+    def test_ga_predict_matches_recognizers(self):
+        model = self.model_filename("ga.model")
+        self.run_digits("train", "ga", "--model", model, "--generations", "2")
+        recognizers = gadigits.load_recognizers(model)
+        images, _ = nndigits.open_dataset(
+            *mnist_filenames("test", self.data_dir))
+        expected = recognizers.predict_batch(images[:5], k=3)
+        actual = gadigits.predict_with_genes(
+            gadigits.load_recognizer_genes(model), images[:5], k=3)
+        numpy.testing.assert_array_equal(actual[0], expected[0])
+        numpy.testing.assert_allclose(actual[1], expected[1])
+
+        self.print.reset_mock()
+        self.run_digits("predict", "--model", model, "0", "1", "2")
+        self.assertEqual(len(self.printed()), 3)
+
+    def test_ga_islands(self):
+        model = self.model_filename("ga.model")
+        self.run_digits("train", "ga", "--model", model, "--generations", "4",
+                        "--islands", "2", "--migration-interval", "2")
+        self.assertEqual((10, 4, 784),
+                         gadigits.load_recognizer_genes(model).shape)
+
+    def test_convert(self):
+        self.run_digits("-q", "convert", "--size", "16")
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.data_dir, "t10k-images-bbox16-idx3-ubyte")))
+
+    def test_train_test_predict_on_bbox_images(self):
+        self.run_digits("convert", "--size", "16")
+        model = self.model_filename("nn.model")
+        self.run_digits("train", "nn", "--model", model, "--bbox", "16",
+                        "--batch-size", "20")
+        self.assertEqual(16 * 16, nndigits.load_layer(model).size)
+        self.run_digits("test", "nn", "--model", model, "--bbox", "16")
+        self.assertIn("Overall success rate", self.printed()[-1])
+        self.print.reset_mock()
+        self.run_digits("predict", "--model", model, "--bbox", "16", "0")
+        self.assertIn("t10k-images-bbox16-idx3-ubyte", self.printed()[0])
+
+    def test_predict_imports_lazily(self):
+        model = self.model_filename("nn.model")
+        nndigits.save_layer(nndigits.MatrixLayer.from_layer(
+            nndigits.init_layer()), model)
+        lazy_modules = ("gadigits", "gafitness", "nnparallel",
+                        "bench_digits", "convert_mnist_database")
+        saved = {name: sys.modules.pop(name) for name in lazy_modules
+                 if name in sys.modules}
+        try:
+            self.run_digits("predict", "--model", model, "0")
+            for name in lazy_modules:
+                self.assertNotIn(name, sys.modules)
+        finally:
+            sys.modules.update(saved)
+
+    def test_predict_index_out_of_range(self):
+        model = self.model_filename("nn.model")
+        nndigits.save_layer(nndigits.MatrixLayer.from_layer(
+            nndigits.init_layer()), model)
+        for index in ("200", "-1"):
+            with self.assertRaises(SystemExit) as raised:
+                self.run_digits("predict", "--model", model, "0", index)
+            self.assertIn("INDEX {} out of range".format(index),
+                          str(raised.exception.code))
+        self.assertEqual([], self.printed())
+
+    def test_unknown_arguments(self):
+        with unittest.mock.patch("sys.stderr"):
+            with self.assertRaises(SystemExit):
+                self.run_digits("predict", "--bogus", "0")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import asyncio
+import json
+import os
+import random
+import struct
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy
+
+import digits_server
+import nndigits
+
+
+class TestInferenceServer(unittest.TestCase):
+    def setUp(self):
+        random.seed(4)
+        self.layer = nndigits.MatrixLayer.from_layer(nndigits.init_layer())
+        rng = numpy.random.default_rng(0)
+        self.pixels = rng.integers(0, 256, size=(40, 784)).astype(numpy.uint8)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmpdir.name, "digits.sock")
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+        self.tmpdir.cleanup()
+
+    async def client(self, pixels):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        results = []
+        for row in pixels:
+            writer.write(digits_server.PREDICT + row.tobytes())
+            await writer.drain()
+            results.append(struct.unpack(
+                '<3B3f', await reader.readexactly(3 + 3 * 4)))
+        writer.write(digits_server.STATS)
+        await writer.drain()
+        size, = struct.unpack('>I', await reader.readexactly(4))
+        stats = json.loads(await reader.readexactly(size))
+        writer.close()
+        return results, stats
+
+    async def serve_clients(self):
+        server = digits_server.InferenceServer(
+            self.layer, self.socket_path, k=3, batch_window=0.01)
+        await server.start()
+        try:
+            results = await asyncio.gather(*[
+                self.client(self.pixels[i::4]) for i in range(4)])
+            blocking = await asyncio.get_running_loop().run_in_executor(
+                None, digits_server.predict_remote, self.socket_path,
+                self.pixels[:2], 3)
+            return results, blocking, server.stats()
+        finally:
+            await server.close()
+
+    def test_concurrent_clients_are_batched(self):
+        results, blocking, stats = asyncio.run(self.serve_clients())
+        digits, scores = nndigits.predict_batch(self.layer, self.pixels, k=3)
+        for i, (client_results, client_stats) in enumerate(results):
+            for row, values in zip(range(i, 40, 4), client_results):
+                self.assertEqual(digits[row].tolist(), list(values[:3]))
+                numpy.testing.assert_allclose(
+                    scores[row], values[3:], rtol=1e-6)
+        self.assertEqual(digits[:2].tolist(), [d for d, s in blocking])
+        self.assertEqual(42, stats["requests"])
+        self.assertLess(stats["batches"], 42)
+        self.assertIn("p99", stats["latency_seconds"])
+        self.assertGreater(stats["requests_per_sec"], 0)
+        self.assertFalse(os.path.exists(self.socket_path))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import csv
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import digits
+import instrumentation
+import nndigits
+from digits_sweep import SweepConfig
+from digits_sweep import hyperparameters
+from digits_sweep import run_sweep
+from digits_sweep import sweep_configurations
+from gadigits import Weight
+from mnist_utils import mnist_filenames
+from mnist_utils import write_image_file
+from mnist_utils import write_label_file
+from test_nndigits import make_separable_images
+
+
+class TestConfigurations(unittest.TestCase):
+    def test_grid(self):
+        self.assertEqual(
+            [{"population_size": 4, "weight_range": 8.0},
+             {"population_size": 4, "weight_range": 16.0},
+             {"population_size": 6, "weight_range": 8.0},
+             {"population_size": 6, "weight_range": 16.0}],
+            sweep_configurations(
+                {"weight_range": [8.0, 16.0], "population_size": [4, 6]}))
+
+    def test_random_within_ranges(self):
+        configurations = sweep_configurations(
+            {"weight_range": [16.0, 8.0, 12.0], "population_size": [2, 5]},
+            'random', samples=50, rng=0)
+        self.assertEqual(50, len(configurations))
+        for parameters in configurations:
+            self.assertTrue(8.0 <= parameters["weight_range"] <= 16.0)
+            self.assertIn(parameters["population_size"], range(2, 6))
+            self.assertIsInstance(parameters["population_size"], int)
+
+    def test_unknown_search(self):
+        with self.assertRaises(ValueError):
+            sweep_configurations({"learning_rate": [0.1]}, 'bayesian')
+
+    def test_hyperparameters_are_restored(self):
+        learning_rate = nndigits.LEARNING_RATE
+        weight_range = Weight.min_value, Weight.max_value
+        with hyperparameters({"learning_rate": 0.5, "weight_range": 4.0}):
+            self.assertEqual(0.5, nndigits.LEARNING_RATE)
+            self.assertEqual((-4.0, 4.0), (Weight.min_value, Weight.max_value))
+        self.assertEqual(learning_rate, nndigits.LEARNING_RATE)
+        self.assertEqual(weight_range, (Weight.min_value, Weight.max_value))
+
+
+class TestRunSweep(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmpdir.name
+        pixels, values = make_separable_images(240)
+        self.image_filename, self.label_filename = mnist_filenames(
+            "train", self.data_dir)
+        write_image_file(self.image_filename, pixels, 28, 28)
+        write_label_file(self.label_filename, values)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print = self.print_patcher.start()
+        self.verbosity = instrumentation.verbosity
+
+    def tearDown(self):
+        instrumentation.configure(self.verbosity)
+        self.print_patcher.stop()
+        self.tmpdir.cleanup()
+
+    def sweep(self, method, space, **config):
+        return run_sweep(method, self.image_filename, self.label_filename,
+                         space, SweepConfig(seed=0, **config))
+
+    def test_successive_halving(self):
+        results = self.sweep(
+            'nn', {"learning_rate": [0.001, 0.01, 0.05]},
+            min_budget=1, max_budget=3, workers=0)
+        self.assertEqual([3, 1, 1], [result.budget for result in results])
+        self.assertGreaterEqual(results[1].accuracy, results[2].accuracy)
+        for result in results:
+            self.assertGreater(result.seconds, 0)
+            self.assertTrue(0 <= result.accuracy <= 1)
+
+    def test_workers_match_in_process_runs(self):
+        space = {"learning_rate": [0.01, 0.05]}
+        expected = self.sweep('nn', space, min_budget=1, max_budget=2,
+                              eta=2, workers=0)
+        results = self.sweep('nn', space, min_budget=1, max_budget=2,
+                             eta=2, workers=2)
+        self.assertEqual(
+            [(r.parameters, r.budget, r.accuracy) for r in expected],
+            [(r.parameters, r.budget, r.accuracy) for r in results])
+
+    def test_ga_sweep(self):
+        results = self.sweep(
+            'ga', {"weight_range": [8.0, 32.766], "population_size": [2]},
+            min_budget=2, max_budget=4, eta=2, workers=2, batch_size=50)
+        self.assertEqual([4, 2], [result.budget for result in results])
+        self.assertEqual((-32.766, 32.769),
+                         (Weight.min_value, Weight.max_value))
+
+    def test_invalid_spaces(self):
+        for method, space in (
+                ('ga', {"learning_rate": [0.1]}),
+                ('ga', {"weight_range": [40.0]}),
+                ('nn', {"learning_rate": []}),
+                ('svm', {})):
+            with self.assertRaises(ValueError):
+                self.sweep(method, space, workers=0)
+
+    def test_command_writes_the_results_table(self):
+        output = os.path.join(self.data_dir, "sweep.csv")
+        digits.main(["--data-dir", self.data_dir, "sweep", "nn",
+                     "--learning-rate", "0.01", "0.05", "--search", "random",
+                     "--samples", "3", "--max-budget", "1", "--workers", "0",
+                     "--seed", "1", "--output", output])
+        with open(output, newline="") as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(["learning_rate", "budget", "accuracy", "seconds"],
+                         rows[0])
+        self.assertEqual(4, len(rows))
+        accuracies = [float(row[2]) for row in rows[1:]]
+        self.assertEqual(sorted(accuracies, reverse=True), accuracies)
+        self.assertTrue(all(0.01 <= float(row[0]) <= 0.05 for row in rows[1:]))
+        printed = [call.args[0] for call in self.print.call_args_list]
+        self.assertEqual(rows[0], printed[-4].split())
+
+
+if __name__ == '__main__':
+    unittest.main()
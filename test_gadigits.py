@@ -2,12 +2,24 @@
 
 """Run with pytest."""
 
+import random
 import unittest
 import unittest.mock
 
+import numpy
+
 from gadigits import Weight
 from gadigits import DigitRecognizer
 from gadigits import DigitRecognizers
+from gadigits import DigitsRecognizer
+from gadigits import GAConfig
+from gadigits import Genome
+from gadigits import mutate
+from gadigits import recognition_fitness
+from gadigits import roulette_selection
+from gadigits import single_point_crossover
+from gadigits import tournament_selection
+from gadigits import uniform_crossover
 
 
 class TestWeight(unittest.TestCase):
@@ -157,3 +169,220 @@ class TestDigitRecognizers(unittest.TestCase):
             'DigitRecognizer(digit=0, weights=[Weight(3), Weight(3), Weight(3), Weight(3)])'
             ']'
             ')', str(drs))
+
+
+class TestGenome(unittest.TestCase):
+    def test_encoding_matches_weight(self):
+        numbers = [Weight.min_value, -0.001, 0, 0.001, 1, Weight.max_value]
+        genome = Genome.from_numbers(numbers)
+        self.assertEqual(
+            ''.join(Weight(x).as_string for x in numbers), genome.as_string())
+        self.assertEqual(
+            [Weight(x).as_number for x in numbers], genome.as_numbers().tolist())
+
+    def test_random_encoding_matches_weight(self):
+        rng = numpy.random.default_rng(0)
+        numbers = rng.uniform(Weight.min_value, Weight.max_value, size=1000)
+        weights = [Weight(x) for x in numbers]
+        genome = Genome.from_numbers(numbers)
+        self.assertEqual(Genome.from_weights(weights), genome)
+        self.assertEqual(
+            [weight.as_number for weight in genome.as_weights()],
+            genome.as_numbers().tolist())
+
+    def test_string_round_trip(self):
+        bits = '01111111111111100000000000000000'
+        self.assertEqual(bits, Genome.from_string(bits).as_string())
+
+    def test_single_point_crossover(self):
+        parent1 = Genome([0x0000, 0x0000, 0x0000])
+        parent2 = Genome([0xFFFF, 0xFFFF, 0xFFFF])
+        rng = unittest.mock.Mock()
+        rng.integers.return_value = 20
+        child1, child2 = single_point_crossover(parent1, parent2, rng)
+        self.assertEqual(
+            '0000000000000000' '0000111111111111' '1111111111111111',
+            child1.as_string())
+        self.assertEqual(
+            '1111111111111111' '1111000000000000' '0000000000000000',
+            child2.as_string())
+
+    def test_uniform_crossover_keeps_every_bit(self):
+        rng = numpy.random.default_rng(0)
+        parent1 = Genome(rng.integers(0, 1 << 16, size=50))
+        parent2 = Genome(rng.integers(0, 1 << 16, size=50))
+        child1, child2 = uniform_crossover(parent1, parent2, rng)
+        numpy.testing.assert_array_equal(
+            parent1.genes ^ parent2.genes, child1.genes ^ child2.genes)
+        numpy.testing.assert_array_equal(
+            parent1.genes & parent2.genes, child1.genes & child2.genes)
+
+    def test_mutate(self):
+        rng = numpy.random.default_rng(0)
+        genome = Genome(numpy.zeros(100))
+        self.assertEqual(genome, mutate(genome, 0, rng))
+        self.assertEqual(Genome(numpy.full(100, 0xFFFF)),
+                         mutate(genome, 1, rng))
+        flipped_bits = sum(
+            bin(gene).count('1')
+            for gene in mutate(genome, 0.01, rng).genes.tolist())
+        self.assertTrue(0 < flipped_bits < 50)
+        self.assertEqual(Genome(numpy.zeros(100)), genome)
+
+    def test_operators_keep_the_weight_range(self):
+        rng = numpy.random.default_rng(0)
+        with unittest.mock.patch.object(Weight, "min_value", -4.0), \
+                unittest.mock.patch.object(Weight, "max_value", 4.0):
+            parent1 = Genome.from_numbers(rng.uniform(-4, 4, size=100))
+            parent2 = Genome.from_numbers(rng.uniform(-4, 4, size=100))
+            children = [
+                *single_point_crossover(parent1, parent2, rng),
+                *uniform_crossover(parent1, parent2, rng),
+                mutate(parent1, 0.1, rng),
+            ]
+        for child in children:
+            numbers = child.as_numbers()
+            self.assertTrue((numbers >= -4).all() and (numbers <= 4).all())
+        self.assertIn(4.0, children[-1].as_numbers())
+
+    def test_recognizer_from_genome(self):
+        genome = Genome.from_numbers([0, Weight.min_value, 0, 1])
+        dr = DigitRecognizer.from_genome(3, genome)
+        self.assertEqual(2, dr.dim)
+        self.assertEqual(genome.as_string(), dr.weights_combined)
+        self.assertEqual(genome, dr.genome)
+
+
+def make_digit_images(count, seed=0):
+    """Images of 4x4 pixels where digit d lights pixel d (plus noise)."""
+    rng = numpy.random.default_rng(seed)
+    values = rng.integers(0, 10, size=count)
+    pixels = (rng.random((count, 16)) < 0.1) * 255
+    pixels[numpy.arange(count), values] = 255
+    images = [unittest.mock.Mock(pixels=row) for row in pixels]
+    labels = [unittest.mock.Mock(value=value) for value in values]
+    return images, labels
+
+
+class TestSelection(unittest.TestCase):
+    def test_tournament_selection_prefers_fitter(self):
+        rng = numpy.random.default_rng(0)
+        fitness = numpy.array([0.0, 1.0, 2.0, 3.0])
+        selected = tournament_selection(fitness, 1000, rng, tournament_size=4)
+        self.assertGreater(numpy.count_nonzero(selected == 3), 500)
+        self.assertEqual(0, numpy.count_nonzero(
+            tournament_selection(fitness, 100, rng, tournament_size=1) > 3))
+
+    def test_roulette_selection_prefers_fitter(self):
+        rng = numpy.random.default_rng(0)
+        fitness = numpy.array([-1.0, -1.0, 1.0])
+        selected = roulette_selection(fitness, 1000, rng)
+        self.assertGreater(numpy.count_nonzero(selected == 2), 900)
+
+    def test_recognition_fitness(self):
+        image_fitness = numpy.array([[1.0, -1.0, -1.0], [0.0, 0.0, 1.0]])
+        is_digit = numpy.array([True, False, False])
+        self.assertEqual(
+            [2.0, -0.5],
+            recognition_fitness(image_fitness, is_digit).tolist())
+
+
+class TestDigitsRecognizer(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+
+    def test_train_improves_recognition(self):
+        images, labels = make_digit_images(500)
+        dr = DigitsRecognizer(population_size=10, dim=4)
+        success_rate_before = dr.test(images, labels)
+        history = dr.train(images, labels, GAConfig(
+            generations=30, batch_size=200, mutation_rate=0.01, seed=0))
+        self.assertEqual(10, len(history))
+        for digit_history in history:
+            self.assertEqual(30, len(digit_history))
+            self.assertGreater(max(digit_history), digit_history[0])
+        self.assertGreater(dr.test(images, labels), success_rate_before)
+        self.assertEqual(10, len(dr.digits_recognizers[0].digit_recognizers))
+
+    def test_training_keeps_the_genes(self):
+        images, labels = make_digit_images(100)
+        random.seed(0)
+        dr = DigitsRecognizer(population_size=4, dim=4)
+        with unittest.mock.patch.object(
+                Weight, "__init__", side_effect=AssertionError):
+            dr.train(images, labels, GAConfig(generations=3, seed=0))
+            genes = dr.genes
+            dr.predict_batch(images)
+        self.assertEqual((10, 4, 16), genes.shape)
+        self.assertEqual(
+            Genome(genes[3, 1]),
+            dr.digits_recognizers[3].digit_recognizers[1].genome)
+        numpy.testing.assert_array_equal(genes, dr.genes)
+
+    def test_progress_is_printed_once_per_generation(self):
+        images, labels = make_digit_images(20)
+        for generations, expected in ((3, [3]), (20, [10, 20]), (0, [0])):
+            dr = DigitsRecognizer(population_size=4, dim=4)
+            with unittest.mock.patch.object(
+                    DigitsRecognizer, "_print_progress") as print_progress:
+                dr.train(images, labels,
+                         GAConfig(generations=generations, seed=0))
+            self.assertEqual(
+                expected,
+                [call.args[0] for call in print_progress.call_args_list])
+
+    def test_predict_batch(self):
+        images, labels = make_digit_images(20)
+        dr = DigitsRecognizer(population_size=2, dim=4)
+        digits, scores = dr.predict_batch(images, k=3)
+        self.assertEqual((20, 3), digits.shape)
+        numpy.testing.assert_array_equal(
+            numpy.argmax(dr.get_scores(images), axis=1), digits[:, 0])
+        self.assertTrue((scores[:, 0] >= scores[:, 1]).all())
+
+    def test_train_stops_on_plateau(self):
+        images, labels = make_digit_images(100)
+        dr = DigitsRecognizer(population_size=4, dim=4)
+        history = dr.train(images, labels, GAConfig(
+            generations=1000, mutation_rate=0, crossover_rate=0,
+            elite_count=4, batch_size=None, plateau_generations=3, seed=0))
+        self.assertEqual([4] * 10, [len(h) for h in history])
+
+    def test_incremental_training_matches_full_evaluation(self):
+        images, labels = make_digit_images(200)
+        # all images: children derived from their parents; a new batch
+        # every generation: scored anew
+        for crossover, batch_size, batch_refresh in (
+                ('single_point', None, None), ('uniform', 50, 1)):
+            config = GAConfig(
+                generations=10, batch_size=batch_size, seed=0,
+                mutation_rate=0.01, crossover=crossover,
+                batch_refresh=batch_refresh)
+            histories = []
+            for incremental in (False, True):
+                random.seed(0)
+                dr = DigitsRecognizer(population_size=8, dim=4)
+                histories.append(dr.train(
+                    images, labels, config._replace(incremental=incremental)))
+            numpy.testing.assert_allclose(histories[0], histories[1])
+
+    def test_incremental_training_with_batch_refresh(self):
+        images, labels = make_digit_images(200)
+        dr = DigitsRecognizer(population_size=6, dim=4)
+        history = dr.train(images, labels, GAConfig(
+            generations=7, batch_size=50, incremental=True, batch_refresh=3,
+            crossover='single_point', seed=0))
+        self.assertEqual([7] * 10, [len(h) for h in history])
+
+    def test_train_with_workers(self):
+        images, labels = make_digit_images(100)
+        dr = DigitsRecognizer(population_size=6, dim=4)
+        history = dr.train(images, labels, GAConfig(
+            generations=3, selection='roulette', crossover='single_point',
+            batch_size=50, workers=2, seed=0))
+        self.assertEqual([3] * 10, [len(h) for h in history])
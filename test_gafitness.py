@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import random
+import unittest
+import unittest.mock
+
+import numpy
+
+from gadigits import DigitRecognizer
+from gadigits import Genome
+from gadigits import mutate
+from gadigits import recognition_fitness
+from gadigits import single_point_crossover
+from gafitness import FitnessEvaluator
+from gafitness import IncrementalFitness
+from gafitness import fit_population
+from gafitness import population_weights
+from mnist_utils import MNISTImage
+from mnist_utils import pack_bw_pixels
+
+
+class TestFitPopulation(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.recognizers = [DigitRecognizer(digit=0, dim=4) for i in range(5)]
+        rng = numpy.random.default_rng(0)
+        self.pixels = rng.integers(0, 256, size=(7, 16)).astype(numpy.uint8)
+        self.pixels[self.pixels < 128] = 0
+
+    def test_matches_digit_recognizer_fit(self):
+        fitness = fit_population(
+            population_weights(self.recognizers), self.pixels != 0)
+        self.assertEqual((5, 7), fitness.shape)
+        with unittest.mock.patch("builtins.print"):
+            for dr, dr_fitness in zip(self.recognizers, fitness):
+                for pixels, image_fitness in zip(self.pixels, dr_fitness):
+                    image = unittest.mock.Mock(bw_pixels=(pixels != 0))
+                    self.assertAlmostEqual(dr.fit(image), image_fitness)
+
+    def test_chunked_product(self):
+        weights = population_weights(self.recognizers)
+        numpy.testing.assert_allclose(
+            fit_population(weights, self.pixels != 0),
+            fit_population(weights, self.pixels != 0, chunk_size=2))
+
+    def test_packed_pixels(self):
+        weights = population_weights(self.recognizers)
+        numpy.testing.assert_allclose(
+            fit_population(weights, self.pixels != 0),
+            fit_population(weights, pack_bw_pixels(self.pixels),
+                           chunk_size=3, packed=True))
+
+    def test_fit_of_packed_image(self):
+        with unittest.mock.patch("builtins.print"):
+            for dr in self.recognizers:
+                for pixels in self.pixels:
+                    legacy = unittest.mock.Mock(bw_pixels=(pixels != 0))
+                    self.assertAlmostEqual(
+                        dr.fit(legacy), dr.fit(MNISTImage(pixels.tolist())))
+
+    def test_evaluator_shards_population_over_workers(self):
+        weights = population_weights(self.recognizers)
+        expected = fit_population(weights, self.pixels != 0)
+        with FitnessEvaluator(self.pixels, max_workers=2) as evaluator:
+            self.assertEqual(7, len(evaluator))
+            numpy.testing.assert_allclose(
+                expected, evaluator.evaluate(weights))
+            numpy.testing.assert_allclose(
+                expected[:, [1, 4]],
+                evaluator.evaluate(weights, numpy.array([1, 4])))
+
+
+class TestIncrementalFitness(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        self.bw_pixels = rng.random((50, 64)) < 0.3
+        self.values = rng.integers(0, 9, size=50)  # no image shows a 9
+        self.incremental = IncrementalFitness(self.bw_pixels, self.values)
+        self.parent = Genome(rng.integers(0, 1 << 16, size=64))
+        self.other = Genome(rng.integers(0, 1 << 16, size=64))
+        self.rng = rng
+
+    def full_fitness(self, digit, genomes):
+        return recognition_fitness(
+            fit_population([genome.as_numbers() for genome in genomes],
+                           self.bw_pixels),
+            self.values == digit)
+
+    def test_fitness_matches_recognition_fitness(self):
+        for digit in (3, 9):
+            numpy.testing.assert_allclose(
+                self.full_fitness(digit, [self.parent, self.other]),
+                self.incremental.fitness(
+                    digit, [self.parent.as_numbers(),
+                            self.other.as_numbers()]))
+
+    def test_derive_mutated_child(self):
+        child = mutate(self.parent, 0.01, self.rng)
+        self.assertAlmostEqual(
+            self.full_fitness(3, [child])[0],
+            self.incremental.derive(
+                3, self.full_fitness(3, [self.parent])[0], self.parent,
+                child))
+
+    def test_derive_population(self):
+        population = [self.parent, self.other]
+        next_population = [
+            *single_point_crossover(self.parent, self.other, self.rng),
+            mutate(self.other, 0.01, self.rng),
+            self.parent,
+        ]
+        numpy.testing.assert_allclose(
+            self.full_fitness(5, next_population),
+            self.incremental.derive_population(
+                5, population, self.full_fitness(5, population),
+                next_population, [(0, 1), (1, 0), (1,), (0,)]))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import random
+import unittest
+import unittest.mock
+
+import numpy
+
+import gaislands
+from gadigits import DigitsRecognizer
+from gadigits import GAConfig
+from gaislands import migrate
+from gaislands import migration_targets
+from test_gadigits import make_digit_images
+
+
+class TestMigration(unittest.TestCase):
+    def test_ring(self):
+        self.assertEqual([[1], [2], [0]], migration_targets('ring', 3, None))
+
+    def test_complete(self):
+        self.assertEqual([[1, 2], [0, 2], [0, 1]],
+                         migration_targets('complete', 3, None))
+
+    def test_random_never_targets_the_source(self):
+        rng = numpy.random.default_rng(0)
+        for _ in range(20):
+            for island, targets in enumerate(
+                    migration_targets('random', 4, rng)):
+                self.assertEqual(1, len(targets))
+                self.assertNotEqual(island, targets[0])
+
+    def test_single_island(self):
+        self.assertEqual([[]], migration_targets('ring', 1, None))
+
+    def test_unknown_topology(self):
+        with self.assertRaises(ValueError):
+            migration_targets('star', 3, None)
+
+    def test_migrants_replace_the_newest_offspring(self):
+        # island i, digit d, individual r: all genes i * 100 + d * 10 + r
+        island_genes = [
+            numpy.fromfunction(
+                lambda d, r, p: island * 100 + d * 10 + r, (10, 4, 3),
+                dtype=numpy.uint16)
+            for island in range(3)
+        ]
+        migrate(island_genes, [[1, 2], [2], []], count=2, keep=1)
+        numpy.testing.assert_array_equal(
+            [0, 1, 2, 3], island_genes[0][5, :, 0] - 50)
+        numpy.testing.assert_array_equal(
+            [100, 101, 0, 1], island_genes[1][0, :, 0])
+        # 4 arrivals for 3 free places: the first ones win
+        numpy.testing.assert_array_equal(
+            [200, 0, 1, 100], island_genes[2][0, :, 0])
+
+
+class TestTrainIslands(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+
+    def test_train_improves_recognition(self):
+        images, labels = make_digit_images(300)
+        dr = DigitsRecognizer(population_size=6, dim=4)
+        success_rate_before = dr.test(images, labels)
+        history = dr.train(images, labels, GAConfig(
+            generations=12, batch_size=100, mutation_rate=0.01, seed=0,
+            islands=3, migration_interval=4, topology='complete'))
+        self.assertEqual([12] * 10, [len(h) for h in history])
+        for digit_history in history:
+            self.assertGreater(max(digit_history), digit_history[0])
+        self.assertGreater(dr.test(images, labels), success_rate_before)
+        self.assertEqual((10, 6, 16), dr.genes.shape)
+
+    def test_only_the_scored_elite_migrates(self):
+        images, labels = make_digit_images(100)
+        dr = DigitsRecognizer(population_size=6, dim=4)
+        with unittest.mock.patch(
+                "gaislands.migrate", wraps=gaislands.migrate) as migrate_mock:
+            dr.train(images, labels, GAConfig(
+                generations=4, batch_size=50, seed=0, islands=2,
+                migration_interval=2, migration_count=3, elite_count=2))
+        self.assertEqual(1, migrate_mock.call_count)
+        self.assertEqual(2, migrate_mock.call_args.args[2])
+
+    def test_unknown_topology(self):
+        images, labels = make_digit_images(20)
+        dr = DigitsRecognizer(population_size=2, dim=4)
+        with self.assertRaises(ValueError):
+            dr.train(images, labels, GAConfig(islands=2, topology='star'))
+
+
+if __name__ == '__main__':
+    unittest.main()
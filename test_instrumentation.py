@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import instrumentation
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.saved = (instrumentation.verbosity,
+                      instrumentation.metrics_enabled)
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.configure(*self.saved)
+        instrumentation.reset()
+
+    def test_verbosity(self):
+        with unittest.mock.patch("builtins.print") as print_mock:
+            instrumentation.configure(level=instrumentation.QUIET)
+            instrumentation.info("info {}", 1)
+            instrumentation.trace("trace {}", 2)
+            print_mock.assert_not_called()
+
+            instrumentation.configure(level=instrumentation.INFO)
+            instrumentation.info("info {}", 1)
+            instrumentation.trace("trace {}", 2)
+            print_mock.assert_called_once_with("info 1")
+
+            instrumentation.configure(level=instrumentation.TRACE)
+            instrumentation.trace("trace {}", 2)
+            print_mock.assert_called_with("trace 2")
+
+    def test_sampled(self):
+        instrumentation.configure(level=instrumentation.INFO)
+        self.assertFalse(any(
+            instrumentation.sampled("x", every=2) for i in range(10)))
+        instrumentation.configure(level=instrumentation.TRACE)
+        self.assertEqual(
+            [False, True, False, True],
+            [instrumentation.sampled("x", every=2) for i in range(4)])
+
+    def test_metrics_disabled(self):
+        instrumentation.configure(metrics=False)
+        with instrumentation.timer("t"):
+            instrumentation.count("c")
+        self.assertEqual(
+            {"counters": {}, "timers": {}}, instrumentation.report())
+
+    def test_metrics_enabled(self):
+        instrumentation.configure(metrics=True)
+        for i in range(3):
+            with instrumentation.timer("t"):
+                instrumentation.count("c", 2)
+        report = instrumentation.report()
+        self.assertEqual({"c": 6}, report["counters"])
+        self.assertEqual(3, report["timers"]["t"]["calls"])
+        self.assertGreaterEqual(report["timers"]["t"]["seconds"], 0)
+
+    def test_capture(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            for mode in ("cprofile", "tracemalloc"):
+                filename = os.path.join(dirname, mode)
+                with instrumentation.capture(mode, filename):
+                    sum(range(1000))
+                self.assertGreater(os.path.getsize(filename), 0)
+        with self.assertRaises(ValueError):
+            with instrumentation.capture("unknown"):
+                pass
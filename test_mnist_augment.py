@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import random
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy
+
+import mnist_pipeline
+import nndigits
+from gadigits import DigitsRecognizer
+from gadigits import GAConfig
+from mnist_augment import AugmentConfig
+from mnist_augment import augment
+from mnist_augment import augment_batch
+from mnist_augment import augment_images
+from mnist_augment import bilinear_sample
+from mnist_augment import change_thickness
+from mnist_augment import gaussian_filter
+from test_gadigits import make_digit_images
+from test_mnist_utils import write_idx_files
+from test_nndigits import make_separable_images
+
+
+NO_AUGMENTATION = AugmentConfig(
+    max_shift=0, max_rotation=0, elastic_alpha=0, thickness=0)
+
+
+def make_bars(count, size=12):
+    """Images with a vertical bar of width 2 at column 4 + i % 4."""
+    images = numpy.zeros((count, size, size), dtype=numpy.uint8)
+    for i in range(count):
+        images[i, 2:-2, 4 + i % 4:6 + i % 4] = 255
+    return images.reshape(count, size * size)
+
+
+class TestTransformations(unittest.TestCase):
+    def test_bilinear_sample(self):
+        images = numpy.arange(9, dtype=numpy.uint8).reshape(1, 3, 3)
+        sampled = bilinear_sample(
+            images, numpy.array([[[0.5, 1.0, -1.0]]]),
+            numpy.array([[[0.5, 2.0, 0.0]]]))
+        numpy.testing.assert_allclose([[[2.0, 5.0, 0.0]]], sampled)
+
+    def test_change_thickness(self):
+        images = numpy.zeros((3, 5, 5), dtype=numpy.uint8)
+        images[:, 1:4, 1:4] = 255
+        changed = change_thickness(images, numpy.array([1, 0, -1]))
+        self.assertEqual([21, 9, 1], (changed > 0).sum(axis=(1, 2)).tolist())
+        numpy.testing.assert_array_equal(images[1], changed[1])
+
+    def test_gaussian_filter_keeps_the_mean_inside(self):
+        fields = numpy.ones((2, 20, 20))
+        filtered = gaussian_filter(fields, 1.0)
+        numpy.testing.assert_allclose(1.0, filtered[:, 5:-5, 5:-5])
+        self.assertLess(filtered[0, 0, 0], 1.0)
+
+
+class TestAugmentBatch(unittest.TestCase):
+    def setUp(self):
+        self.pixels = make_bars(8)
+
+    def test_no_augmentation_is_identity(self):
+        numpy.testing.assert_array_equal(self.pixels, augment_batch(
+            self.pixels, 12, 12, NO_AUGMENTATION, rng=0))
+
+    def test_shift_moves_the_bars(self):
+        config = NO_AUGMENTATION._replace(max_shift=2.0)
+        augmented = augment_batch(self.pixels, 12, 12, config, rng=0)
+        self.assertEqual((8, 144), augmented.shape)
+        self.assertEqual(numpy.uint8, augmented.dtype)
+        columns = numpy.arange(12)
+
+        def center(pixels):
+            weights = pixels.reshape(-1, 12, 12).sum(axis=1)
+            return (weights * columns).sum(axis=1) / weights.sum(axis=1)
+
+        moved = center(augmented) - center(self.pixels)
+        self.assertTrue((numpy.abs(moved) <= 2.0 + 1e-9).all())
+        self.assertGreater(numpy.abs(moved).max(), 0.1)
+
+    def test_every_image_gets_its_own_variant(self):
+        pixels = numpy.repeat(self.pixels[:1], 4, axis=0)
+        augmented = augment_batch(pixels, 12, 12, AugmentConfig(), rng=0)
+        self.assertEqual(4, len({row.tobytes() for row in augmented}))
+
+    def test_same_rng_same_variants(self):
+        numpy.testing.assert_array_equal(
+            augment_batch(self.pixels, 12, 12, rng=3),
+            augment_batch(self.pixels, 12, 12, rng=3))
+
+
+class TestAugmentStage(unittest.TestCase):
+    def setUp(self):
+        self.pixels = make_bars(40)
+        self.labels = [i % 10 for i in range(40)]
+        self.batches = [
+            (self.pixels[start:start + 8], self.labels[start:start + 8])
+            for start in range(0, 40, 8)
+        ]
+
+    def test_workers_do_not_change_the_output(self):
+        expected = list(augment(self.batches, 12, 12, seed=5))
+        for workers in (1, 3):
+            augmented = list(augment(
+                self.batches, 12, 12, seed=5, workers=workers))
+            self.assertEqual(len(expected), len(augmented))
+            for (expected_pixels, expected_labels), (pixels, labels) in zip(
+                    expected, augmented):
+                numpy.testing.assert_array_equal(expected_pixels, pixels)
+                numpy.testing.assert_array_equal(expected_labels, labels)
+
+    def test_augment_images_in_chunks(self):
+        expected = augment_images(self.pixels, 12, 12, seed=5, chunk_size=8)
+        self.assertEqual((40, 144), expected.shape)
+        numpy.testing.assert_array_equal(expected, augment_images(
+            self.pixels, 12, 12, seed=5, workers=3, chunk_size=8))
+
+    def test_minibatches_augment_every_epoch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            image_filename, label_filename = write_idx_files(
+                tmpdir, self.pixels.reshape(40, 12, 12), self.labels)
+            batches = list(mnist_pipeline.minibatches(
+                image_filename, label_filename, batch_size=40, epochs=2,
+                seed=0, augment=AugmentConfig(), augment_workers=2))
+        (first, first_labels), (second, second_labels) = batches
+        numpy.testing.assert_array_equal(self.labels, first_labels)
+        numpy.testing.assert_array_equal(self.labels, second_labels)
+        self.assertFalse((first == self.pixels).all())
+        self.assertFalse((first == second).all())
+
+
+class TestTrainingWithAugmentation(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+
+    def test_use_layer(self):
+        pixels, values = make_separable_images(60)
+        layer = nndigits.init_layer()
+        random.seed(1)
+        trained = nndigits.use_layer(
+            layer, pixels, values, train=True, batch_size=10,
+            augment=AugmentConfig(max_rotation=5, elastic_alpha=0))
+        self.assertIsInstance(trained, nndigits.MatrixLayer)
+        self.assertFalse(numpy.array_equal(
+            nndigits.MatrixLayer.from_layer(layer).weights, trained.weights))
+        random.seed(1)
+        threaded = nndigits.use_layer(
+            layer, pixels, values, train=True, batch_size=10,
+            augment=AugmentConfig(max_rotation=5, elastic_alpha=0),
+            augment_workers=2)
+        numpy.testing.assert_array_equal(trained.weights, threaded.weights)
+
+    def test_ga_train(self):
+        images, labels = make_digit_images(100)
+        config = GAConfig(generations=3, batch_size=50, seed=0,
+                          crossover='single_point',
+                          augment=AugmentConfig(max_shift=1, max_rotation=0,
+                                                elastic_alpha=0, thickness=0))
+        histories = []
+        for incremental, workers in ((False, 0), (False, 2), (True, 2)):
+            random.seed(0)
+            dr = DigitsRecognizer(population_size=4, dim=4)
+            histories.append(dr.train(images, labels, config._replace(
+                incremental=incremental, augment_workers=workers)))
+            self.assertEqual([3] * 10, [len(h) for h in histories[-1]])
+        numpy.testing.assert_allclose(histories[0], histories[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import os
+import random
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy
+
+import nncheckpoint
+import nndigits
+from mnist_evaluation import evaluate
+from mnist_evaluation import load_evaluation
+from mnist_evaluation import save_evaluation
+from test_nndigits import make_separable_images
+
+
+def one_hot_scores(digits, runner_up=None):
+    """Scores of 1 for the digits, 0.5 for the runner-up digits."""
+    scores = numpy.zeros((len(digits), 10))
+    scores[numpy.arange(len(digits)), digits] = 1.0
+    if runner_up is not None:
+        scores[numpy.arange(len(digits)), runner_up] = 0.5
+    return scores
+
+
+class TestEvaluate(unittest.TestCase):
+    def setUp(self):
+        self.labels = numpy.array([0, 0, 1, 1, 2, 2, 3], dtype=numpy.uint8)
+        predicted = numpy.array([0, 1, 1, 1, 2, 0, 3])
+        self.scores = one_hot_scores(
+            predicted, runner_up=[1, 0, 0, 0, 0, 2, 0])
+        # image 5 is less wrong than image 1
+        self.scores[1, 1] = 2.0
+
+    def test_confusion_precision_recall(self):
+        evaluation = evaluate(self.scores, self.labels)
+        self.assertEqual(7, evaluation.image_count)
+        self.assertAlmostEqual(5 / 7, evaluation.accuracy)
+        self.assertEqual(1, evaluation.confusion[0, 1])
+        self.assertEqual(1, evaluation.confusion[2, 0])
+        self.assertEqual(5, numpy.trace(evaluation.confusion))
+        numpy.testing.assert_allclose(
+            [1 / 2, 2 / 3, 1, 1, 0, 0, 0, 0, 0, 0], evaluation.precision)
+        numpy.testing.assert_allclose(
+            [1 / 2, 1, 1 / 2, 1, 0, 0, 0, 0, 0, 0], evaluation.recall)
+
+    def test_top_k_accuracy(self):
+        evaluation = evaluate(self.scores, self.labels, k=3)
+        numpy.testing.assert_allclose(
+            [5 / 7, 1, 1], evaluation.top_k_accuracy)
+
+    def test_hardest_misrecognized_first(self):
+        self.assertEqual([1, 5], evaluate(
+            self.scores, self.labels).hardest.tolist())
+        self.assertEqual([1], evaluate(
+            self.scores, self.labels, hardest_count=1).hardest.tolist())
+
+    def test_json_round_trip(self):
+        evaluation = evaluate(self.scores, self.labels)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "evaluation.json")
+            save_evaluation(evaluation, filename)
+            loaded = load_evaluation(filename)
+            self.assertEqual(["evaluation.json"], os.listdir(tmpdir))
+        for expected, actual in zip(evaluation, loaded):
+            numpy.testing.assert_allclose(expected, actual)
+
+
+class TestEpochEvaluation(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print = self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+
+    def test_evaluate_layer_matches_predict_batch(self):
+        pixels, values = make_separable_images(50)
+        layer = nndigits.use_layer(
+            nndigits.init_layer(), pixels, values, train=True, batch_size=10)
+        evaluation = nndigits.evaluate_layer(layer, pixels, values)
+        digits, _ = nndigits.predict_batch(layer, pixels)
+        self.assertAlmostEqual(
+            numpy.mean(digits[:, 0] == values), evaluation.accuracy)
+
+    def test_checkpointed_training_reports_every_epoch(self):
+        pixels, values = make_separable_images(60)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            nncheckpoint.train_with_checkpoints(
+                nndigits.init_layer(), pixels, values,
+                os.path.join(tmpdir, "train.ckpt"), epochs=3, batch_size=10,
+                validation=(pixels[:20], values[:20]))
+        reports = [
+            call.args[0] for call in self.print.call_args_list
+            if "validation success rate" in call.args[0]
+        ]
+        self.assertEqual(3, len(reports))
+        self.assertTrue(reports[-1].startswith("Epoch 3"))
+
+
+if __name__ == '__main__':
+    unittest.main()
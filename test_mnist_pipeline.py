@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import tempfile
+import unittest
+
+import numpy
+
+import mnist_pipeline
+from test_mnist_utils import gzip_file
+from test_mnist_utils import write_idx_files
+
+
+class TestMinibatches(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.count = 103
+        # image i is filled with i % 256, label i % 10: easy to track
+        self.pixels = numpy.repeat(
+            numpy.arange(self.count) % 256, 16).reshape(self.count, 4, 4)
+        self.labels = [i % 10 for i in range(self.count)]
+        self.image_filename, self.label_filename = write_idx_files(
+            self.tmpdir.name, self.pixels, self.labels)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def collect(self, batches):
+        batches = list(batches)
+        for pixels, labels in batches:
+            numpy.testing.assert_array_equal(pixels[:, 0] % 10, labels)
+        firsts = [pixels[:, 0] for pixels, _ in batches]
+        return batches, numpy.concatenate(firsts)
+
+    def test_file_order(self):
+        batches, ids = self.collect(mnist_pipeline.minibatches(
+            self.image_filename, self.label_filename, batch_size=10,
+            chunk_size=7))
+        self.assertEqual([10] * 10 + [3], [len(b[1]) for b in batches])
+        self.assertEqual(list(range(self.count)), ids.tolist())
+
+    def test_gzipped_files(self):
+        batches, ids = self.collect(mnist_pipeline.minibatches(
+            gzip_file(self.image_filename), gzip_file(self.label_filename),
+            batch_size=10, chunk_size=7))
+        self.assertEqual(list(range(self.count)), ids.tolist())
+
+    def test_shuffled_epochs(self):
+        batches, ids = self.collect(mnist_pipeline.minibatches(
+            self.image_filename, self.label_filename, batch_size=16,
+            epochs=2, shuffle_buffer_size=20, seed=0, chunk_size=8))
+        first, second = ids[:self.count], ids[self.count:]
+        self.assertEqual(list(range(self.count)), sorted(first.tolist()))
+        self.assertEqual(list(range(self.count)), sorted(second.tolist()))
+        self.assertNotEqual(first.tolist(), second.tolist())
+        self.assertNotEqual(list(range(self.count)), first.tolist())
+
+    def test_shuffle_buffer_is_bounded(self):
+        chunks = mnist_pipeline.read_chunks(
+            self.image_filename, self.label_filename, chunk_size=5)
+        rng = numpy.random.default_rng(0)
+        position = 0
+        for pixels, labels in mnist_pipeline.shuffle(chunks, 10, rng):
+            # never more than buffer_size + chunk_size images are held
+            self.assertLessEqual(len(labels), 10)
+            for image_id in pixels[:, 0].tolist():
+                self.assertLess(image_id - position, 10 + 5)
+                position += 1
+
+    def test_train_validation_split(self):
+        _, train_ids = self.collect(mnist_pipeline.minibatches(
+            self.image_filename, self.label_filename, subset='train',
+            validation_fraction=0.2))
+        _, validation_ids = self.collect(mnist_pipeline.minibatches(
+            self.image_filename, self.label_filename, subset='validation',
+            validation_fraction=0.2))
+        self.assertEqual(list(range(82)), train_ids.tolist())
+        self.assertEqual(list(range(82, self.count)), validation_ids.tolist())
+
+    def test_prefetch(self):
+        _, ids = self.collect(mnist_pipeline.minibatches(
+            self.image_filename, self.label_filename, batch_size=4,
+            prefetch_depth=2))
+        self.assertEqual(list(range(self.count)), ids.tolist())
+
+    def test_prefetch_reraises_and_stops(self):
+        def failing():
+            yield 1
+            raise RuntimeError("boom")
+        with self.assertRaises(RuntimeError):
+            list(mnist_pipeline.prefetch(failing()))
+        batches = mnist_pipeline.prefetch(iter(range(1000)), depth=1)
+        self.assertEqual(0, next(batches))
+        batches.close()
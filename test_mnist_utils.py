@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import gzip
+import os
+import struct
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy
+
+import mnist_utils
+from mnist_utils import IMAGE_FILE_MAGIC
+from mnist_utils import LABEL_FILE_MAGIC
+from mnist_utils import MNISTImage
+from mnist_utils import MNISTLabel
+from mnist_utils import active_index_of
+from mnist_utils import active_pixels
+from mnist_utils import atomic_write
+from mnist_utils import build_active_index
+from mnist_utils import mnist_filenames
+from mnist_utils import open_dataset
+from mnist_utils import open_image_file
+from mnist_utils import open_label_file
+from mnist_utils import read_image_file
+from mnist_utils import read_label_file
+from mnist_utils import read_payload
+from mnist_utils import unpack_bw_bits
+from mnist_utils import write_label_file
+
+
+def write_idx_files(dirname, pixels, labels):
+    image_filename = os.path.join(dirname, "images-idx3-ubyte")
+    label_filename = os.path.join(dirname, "labels-idx1-ubyte")
+    count, height, width = pixels.shape
+    with open(image_filename, "wb") as image_file:
+        image_file.write(struct.pack(
+            '>4i', IMAGE_FILE_MAGIC, count, width, height))
+        image_file.write(pixels.astype(numpy.uint8).tobytes())
+    with open(label_filename, "wb") as label_file:
+        label_file.write(struct.pack('>2i', LABEL_FILE_MAGIC, len(labels)))
+        label_file.write(bytes(labels))
+    return image_filename, label_filename
+
+
+class TestIDXFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = numpy.random.default_rng(0)
+        self.pixels = rng.integers(0, 256, size=(5, 28, 28))
+        self.pixels[self.pixels < 128] = 0
+        self.labels = [3, 1, 4, 1, 5]
+        self.image_filename, self.label_filename = write_idx_files(
+            self.tmpdir.name, self.pixels, self.labels)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_images_are_mapped_as_contiguous_array(self):
+        images = open_image_file(self.image_filename)
+        self.assertEqual(5, len(images))
+        self.assertEqual((5, 784), images.pixels.shape)
+        self.assertEqual(numpy.uint8, images.pixels.dtype)
+        self.assertTrue(images.pixels.flags.c_contiguous)
+        numpy.testing.assert_array_equal(
+            self.pixels.reshape(5, 784), images.pixels)
+
+    def test_image_view_is_compatible_with_mnist_image(self):
+        images = open_image_file(self.image_filename)
+        legacy_images = read_image_file(self.image_filename)
+        for image, legacy_image in zip(images, legacy_images):
+            self.assertEqual(list(legacy_image.pixels), image.pixels.tolist())
+            self.assertEqual(legacy_image.bw_pixels, image.bw_pixels.tolist())
+        self.assertEqual(2, len(images[1:3]))
+
+    def test_labels(self):
+        labels = open_label_file(self.label_filename)
+        self.assertEqual(5, len(labels))
+        self.assertEqual(MNISTLabel(4), labels[2])
+        self.assertEqual(read_label_file(self.label_filename), list(labels))
+        self.assertEqual(self.labels, labels.values.tolist())
+
+    def test_bad_magic_number(self):
+        with self.assertRaises(ValueError):
+            open_image_file(self.label_filename)
+        with self.assertRaises(ValueError):
+            open_label_file(self.image_filename)
+
+    def test_truncated_file(self):
+        with open(self.image_filename, "r+b") as image_file:
+            image_file.truncate(16 + 784 * 4)
+        with self.assertRaises(ValueError):
+            open_image_file(self.image_filename)
+
+
+class TestBlackWhiteBits(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(2)
+        self.pixels = rng.integers(0, 256, size=(5, 784)).astype(numpy.uint8)
+        self.pixels[self.pixels < 200] = 0
+
+    def test_image_keeps_98_bytes(self):
+        image = MNISTImage(tuple(self.pixels[0].tolist()))
+        self.assertEqual(98, len(image.bw_bits))
+        self.assertEqual(
+            [int(bool(pixel)) for pixel in self.pixels[0]], image.bw_pixels)
+
+    def test_unpack_mapped_image_bits(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            image_filename, _ = write_idx_files(
+                dirname, self.pixels.reshape(5, 28, 28), [0] * 5)
+            images = open_image_file(image_filename)
+            self.assertEqual((5, 98), images.bw_bits.shape)
+            numpy.testing.assert_array_equal(
+                self.pixels != 0, unpack_bw_bits(images.bw_bits, 784))
+            self.assertEqual(images.bw_bits[3].tobytes(), images[3].bw_bits)
+            del images
+
+    def test_active_pixels(self):
+        for pixels in self.pixels:
+            expected = numpy.flatnonzero(pixels).tolist()
+            self.assertEqual(
+                expected, active_pixels(MNISTImage(pixels.tolist())))
+            self.assertEqual(
+                expected,
+                active_pixels(unittest.mock.Mock(bw_pixels=pixels != 0)))
+
+    def test_active_index(self):
+        with unittest.mock.patch("mnist_utils.INDEX_CHUNK_SIZE", 2):
+            index = build_active_index(self.pixels)
+        self.assertEqual(len(self.pixels) + 1, len(index.offsets))
+        for pixels, start, stop in zip(
+                self.pixels, index.offsets[:-1], index.offsets[1:]):
+            self.assertEqual(numpy.flatnonzero(pixels).tolist(),
+                             index.indices[start:stop].tolist())
+            numpy.testing.assert_array_equal(
+                pixels[pixels != 0], index.values[start:stop])
+
+    def test_mapped_images_build_the_index_once(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            image_filename, _ = write_idx_files(
+                dirname, self.pixels.reshape(5, 28, 28), [0] * 5)
+            images = open_image_file(image_filename)
+            index = active_index_of(images)
+            self.assertIs(index, active_index_of(images))
+            numpy.testing.assert_array_equal(
+                build_active_index(self.pixels).indices, index.indices)
+            del images
+
+
+def gzip_file(filename):
+    with open(filename, "rb") as source, \
+            gzip.open(filename + ".gz", "wb") as target:
+        target.write(source.read())
+    os.remove(filename)
+    return filename + ".gz"
+
+
+class TestGzipFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = numpy.random.default_rng(4)
+        self.pixels = rng.integers(0, 256, size=(7, 28, 28))
+        self.labels = [3, 1, 4, 1, 5, 9, 2]
+        image_filename, label_filename = write_idx_files(
+            self.tmpdir.name, self.pixels, self.labels)
+        self.image_filename = gzip_file(image_filename)
+        self.label_filename = gzip_file(label_filename)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_open_files(self):
+        images = open_image_file(self.image_filename)
+        self.assertEqual(7, images.header.maxImages)
+        numpy.testing.assert_array_equal(
+            self.pixels.reshape(7, 784), images.pixels)
+        self.assertFalse(images.pixels.flags.writeable)
+        numpy.testing.assert_array_equal(
+            self.labels, open_label_file(self.label_filename).values)
+
+    def test_legacy_readers(self):
+        images = read_image_file(self.image_filename)
+        self.assertEqual(tuple(self.pixels[6].ravel()), images[6].pixels)
+        self.assertEqual(
+            self.labels, [label.value for label in
+                          read_label_file(self.label_filename)])
+
+    def test_dataset_cache(self):
+        images, labels = open_dataset(self.image_filename, self.label_filename)
+        numpy.testing.assert_array_equal(
+            self.pixels.reshape(7, 784), images.pixels)
+        numpy.testing.assert_array_equal(
+            numpy.packbits(self.pixels.reshape(7, 784) != 0, axis=1),
+            images.bw_bits)
+        numpy.testing.assert_array_equal(self.labels, labels.values)
+
+    def test_read_payload_in_background(self):
+        for background in (False, True):
+            buffer = numpy.zeros((7, 784), dtype=numpy.uint8)
+            ranges = list(read_payload(self.image_filename, 16, buffer,
+                                       chunk_size=1000, background=background))
+            self.assertEqual((0, 1000), ranges[0])
+            self.assertEqual((5000, 5488), ranges[-1])
+            numpy.testing.assert_array_equal(
+                self.pixels.reshape(7, 784), buffer)
+
+    def test_truncated_file(self):
+        with gzip.open(self.image_filename, "rb") as idx_file:
+            data = idx_file.read()
+        with gzip.open(self.image_filename, "wb") as idx_file:
+            idx_file.write(data[:-10])
+        with self.assertRaises(ValueError):
+            open_image_file(self.image_filename)
+
+    def test_mnist_filenames_fall_back_to_gz(self):
+        image_filename = os.path.join(
+            self.tmpdir.name, "t10k-images-idx3-ubyte")
+        os.rename(self.image_filename, image_filename + ".gz")
+        write_label_file(
+            os.path.join(self.tmpdir.name, "t10k-labels-idx1-ubyte"),
+            self.labels)
+        self.assertEqual(
+            (image_filename + ".gz", os.path.join(
+                self.tmpdir.name, "t10k-labels-idx1-ubyte")),
+            mnist_filenames("test", self.tmpdir.name))
+
+    def test_mnist_filenames_of_bbox_images(self):
+        self.assertEqual(
+            (os.path.join("data", "train-images-bbox20-idx3-ubyte"),
+             os.path.join("data", "train-labels-idx1-ubyte")),
+            mnist_filenames("train", "data", bbox=20))
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "file")
+        with open(self.filename, "w") as file_obj:
+            file_obj.write("old")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_replaces_the_file(self):
+        with atomic_write(self.filename) as tmp_filename:
+            with open(tmp_filename, "w") as file_obj:
+                file_obj.write("new")
+        with open(self.filename) as file_obj:
+            self.assertEqual("new", file_obj.read())
+        self.assertEqual(["file"], os.listdir(self.tmpdir.name))
+
+    def test_failed_write_removes_the_temporary_file(self):
+        with self.assertRaises(RuntimeError):
+            with atomic_write(self.filename) as tmp_filename:
+                with open(tmp_filename, "w") as file_obj:
+                    file_obj.write("partial")
+                raise RuntimeError()
+        with open(self.filename) as file_obj:
+            self.assertEqual("old", file_obj.read())
+        self.assertEqual(["file"], os.listdir(self.tmpdir.name))
+
+
+class TestDatasetCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = numpy.random.default_rng(0)
+        self.pixels = rng.integers(0, 256, size=(6, 28, 28))
+        self.pixels[self.pixels < 128] = 0
+        self.labels = [9, 2, 6, 5, 3, 5]
+        self.image_filename, self.label_filename = write_idx_files(
+            self.tmpdir.name, self.pixels, self.labels)
+        self.cache_filename = os.path.join(self.tmpdir.name, "dataset.cache")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def open_dataset(self):
+        return open_dataset(
+            self.image_filename, self.label_filename, self.cache_filename)
+
+    def test_failed_cache_write_leaves_no_file(self):
+        with unittest.mock.patch.object(
+                mnist_utils, "pack_bw_pixels", side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                self.open_dataset()
+        self.assertEqual(
+            [], [name for name in os.listdir(self.tmpdir.name)
+                 if name.startswith("dataset.cache")])
+
+    def test_cached_dataset_content(self):
+        images, labels = self.open_dataset()
+        self.assertTrue(os.path.isfile(self.cache_filename))
+        numpy.testing.assert_array_equal(
+            self.pixels.reshape(6, 784), images.pixels)
+        numpy.testing.assert_array_equal(
+            numpy.packbits(self.pixels.reshape(6, 784) != 0, axis=1),
+            images.bw_bits)
+        self.assertEqual(self.labels, labels.values.tolist())
+        self.assertEqual(MNISTLabel(6), labels[2])
+        self.assertEqual(28, images.header.imgWidth)
+
+    def test_warm_start_reuses_cache(self):
+        self.open_dataset()
+        with unittest.mock.patch("mnist_utils.write_dataset_cache") as write:
+            images, labels = self.open_dataset()
+            write.assert_not_called()
+        self.assertIsInstance(images.pixels, numpy.memmap)
+        self.assertEqual(self.labels, labels.values.tolist())
+
+    def test_touched_source_with_same_content_reuses_cache(self):
+        self.open_dataset()
+        os.utime(self.image_filename, ns=(0, 0))
+        with unittest.mock.patch("mnist_utils.write_dataset_cache") as write:
+            self.open_dataset()
+            write.assert_not_called()
+
+    def test_touched_sources_are_hashed_once(self):
+        self.open_dataset()
+        os.utime(self.image_filename, ns=(0, 0))
+        os.utime(self.label_filename, ns=(0, 0))
+        with unittest.mock.patch(
+                "mnist_utils._file_hash",
+                wraps=mnist_utils._file_hash) as file_hash:
+            self.open_dataset()
+            self.assertEqual(2, file_hash.call_count)
+            images, labels = self.open_dataset()
+            self.assertEqual(2, file_hash.call_count)
+        self.assertEqual(self.labels, labels.values.tolist())
+
+    def test_changed_source_invalidates_cache(self):
+        self.open_dataset()
+        self.labels[0] = 7
+        write_idx_files(self.tmpdir.name, self.pixels, self.labels)
+        images, labels = self.open_dataset()
+        self.assertEqual(7, labels[0].value)
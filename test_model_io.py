@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import os
+import random
+import tempfile
+import unittest
+
+import numpy
+
+import model_io
+from gadigits import DigitsRecognizer
+from gadigits import load_recognizer_genes
+from gadigits import load_recognizers
+from gadigits import save_recognizers
+from nndigits import Network
+from nndigits import init_layer
+from nndigits import load_layer
+from nndigits import save_layer
+
+
+class TestModelFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "test.model")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        array = numpy.arange(24, dtype=numpy.uint16).reshape(2, 3, 4)
+        model_io.save_model(self.filename, model_io.GA_RECOGNIZERS, array)
+        self.assertEqual(
+            model_io.HEADER_LEN + array.nbytes,
+            os.path.getsize(self.filename))
+        header = model_io.read_model_header(self.filename)
+        self.assertEqual(model_io.MODEL_VERSION, header.version)
+        self.assertEqual((2, 3, 4), header.dims)
+        loaded = model_io.load_model(self.filename, model_io.GA_RECOGNIZERS)
+        self.assertIsInstance(loaded, numpy.memmap)
+        numpy.testing.assert_array_equal(array, loaded)
+
+    def test_wrong_kind(self):
+        model_io.save_model(self.filename, model_io.NN_LAYER, numpy.zeros(3))
+        with self.assertRaises(ValueError):
+            model_io.load_model(self.filename, model_io.GA_RECOGNIZERS)
+
+    def test_not_a_model_file(self):
+        with open(self.filename, "wb") as model_file:
+            model_file.write(b'\0' * 100)
+        with self.assertRaises(ValueError):
+            model_io.read_model_header(self.filename)
+
+    def test_truncated_payload(self):
+        model_io.save_model(self.filename, model_io.NN_LAYER, numpy.zeros(8))
+        with open(self.filename, "r+b") as model_file:
+            model_file.truncate(model_io.HEADER_LEN + 4)
+        with self.assertRaises(ValueError):
+            model_io.load_model(self.filename, model_io.NN_LAYER)
+
+    def test_nn_layer(self):
+        random.seed(0)
+        layer = init_layer()
+        save_layer(layer, self.filename)
+        loaded = load_layer(self.filename)
+        self.assertEqual(numpy.float32, loaded.weights.dtype)
+        self.assertFalse(loaded.weights.flags.writeable)
+        numpy.testing.assert_allclose(
+            [cell.weight for cell in layer.cells], loaded.weights, rtol=1e-6)
+        writable = load_layer(self.filename, writable=True)
+        self.assertEqual(numpy.float64, writable.weights.dtype)
+        writable.weights += 1
+
+    def test_nn_network(self):
+        network = Network([16, 8, 4, 10], hidden_activation='relu',
+                          output_activation='sigmoid', seed=0)
+        save_layer(network, self.filename)
+        loaded = load_layer(self.filename)
+        self.assertIsInstance(loaded, Network)
+        self.assertEqual([16, 8, 4, 10], loaded.sizes)
+        self.assertEqual('relu', loaded.hidden_activation)
+        self.assertEqual('sigmoid', loaded.output_activation)
+        numpy.testing.assert_allclose(
+            network.parameters, loaded.parameters, rtol=1e-6)
+        self.assertFalse(loaded.parameters.flags.writeable)
+        self.assertTrue(load_layer(
+            self.filename, writable=True).parameters.flags.writeable)
+
+    def test_ga_recognizers(self):
+        random.seed(0)
+        dr = DigitsRecognizer(population_size=3, dim=4)
+        save_recognizers(dr, self.filename)
+        self.assertEqual(
+            (10, 3, 16), load_recognizer_genes(self.filename).shape)
+        loaded = load_recognizers(self.filename)
+        for drs, loaded_drs in zip(dr.digits_recognizers,
+                                   loaded.digits_recognizers):
+            self.assertEqual(drs.digit, loaded_drs.digit)
+            self.assertEqual(
+                [r.weights_combined for r in drs.digit_recognizers],
+                [r.weights_combined for r in loaded_drs.digit_recognizers])
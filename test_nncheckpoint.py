@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import os
+import random
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy
+
+import nncheckpoint
+import nndigits
+from mnist_augment import AugmentConfig
+from mnist_utils import mnist_filenames
+from mnist_utils import write_image_file
+from mnist_utils import write_label_file
+from nncheckpoint import TrainingState
+from nncheckpoint import load_checkpoint
+from nncheckpoint import save_checkpoint
+from nncheckpoint import train_with_checkpoints
+from test_nndigits import make_separable_images
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.layer = nndigits.MatrixLayer.from_layer(nndigits.init_layer())
+        self.pixels, self.values = make_separable_images(150)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "train.ckpt")
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+        self.tmpdir.cleanup()
+
+    def train(self, count=150, filename=None, **kwargs):
+        return train_with_checkpoints(
+            self.layer, self.pixels[:count], self.values[:count],
+            filename or self.filename, batch_size=10, **kwargs)
+
+    def test_save_and_load(self):
+        network = nndigits.init_network(784, [16], seed=0)
+        rng = numpy.random.default_rng(5)
+        state = TrainingState(2, 40, 150, rng.bit_generator.state)
+        for layer in (self.layer, network):
+            save_checkpoint(self.filename, layer, state)
+            loaded, loaded_state = load_checkpoint(self.filename)
+            self.assertIs(type(layer), type(loaded))
+            numpy.testing.assert_array_equal(
+                nndigits.model_parameters(layer),
+                nndigits.model_parameters(loaded))
+            self.assertEqual(state, loaded_state)
+        self.assertEqual([16], loaded.sizes[1:-1])
+        self.assertEqual(["train.ckpt"], os.listdir(self.tmpdir.name))
+
+    def test_does_not_change_the_initial_layer(self):
+        weights = self.layer.weights.copy()
+        self.train()
+        numpy.testing.assert_array_equal(weights, self.layer.weights)
+
+    def test_resume_after_interruption_matches_full_run(self):
+        options = dict(epochs=3, shuffle=True, seed=7, interval=40)
+        expected = self.train(
+            filename=os.path.join(self.tmpdir.name, "full.ckpt"), **options)
+
+        save = nncheckpoint.save_checkpoint
+        saves = []
+
+        def interrupting_save(*args):
+            save(*args)
+            saves.append(args[2])
+            if len(saves) == 5:
+                raise Interrupted()
+
+        with unittest.mock.patch(
+                "nncheckpoint.save_checkpoint", interrupting_save):
+            with self.assertRaises(Interrupted):
+                self.train(**options)
+        self.assertEqual(1, saves[-1].epoch)
+        resumed = self.train(**options)
+        numpy.testing.assert_allclose(expected.weights, resumed.weights)
+        _, state = load_checkpoint(self.filename)
+        self.assertEqual((2, 150), (state.epoch, state.position))
+
+    def test_continue_on_appended_images(self):
+        expected = self.train(
+            filename=os.path.join(self.tmpdir.name, "full.ckpt"))
+        self.train(count=100)
+        use_layer_batches = nncheckpoint.use_layer_batches
+        trained = []
+
+        def counting_use_layer_batches(layer, batches, train):
+            def counted():
+                for batch_pixels, batch_values in batches:
+                    trained.append(len(batch_values))
+                    yield batch_pixels, batch_values
+            return use_layer_batches(layer, counted(), train)
+
+        with unittest.mock.patch("nncheckpoint.use_layer_batches",
+                                 counting_use_layer_batches):
+            resumed = self.train()
+        self.assertEqual(50, sum(trained))
+        numpy.testing.assert_allclose(expected.weights, resumed.weights)
+        _, state = load_checkpoint(self.filename)
+        self.assertEqual((0, 150, 100), state[:3])
+
+    def test_checkpoints_only_count_trained_batches(self):
+        use_layer_batches = nncheckpoint.use_layer_batches
+        save = nncheckpoint.save_checkpoint
+        trained = []
+        saves = []
+
+        def counting_use_layer_batches(layer, batches, train):
+            def counted():
+                for batch_pixels, batch_values in batches:
+                    trained.append(len(batch_values))
+                    yield batch_pixels, batch_values
+            return use_layer_batches(layer, counted(), train)
+
+        def recording_save(*args):
+            save(*args)
+            saves.append((args[2].position, sum(trained)))
+
+        with unittest.mock.patch("nncheckpoint.use_layer_batches",
+                                 counting_use_layer_batches), \
+                unittest.mock.patch("nncheckpoint.save_checkpoint",
+                                    recording_save):
+            # the augment threads draw batches ahead of training
+            self.train(interval=20, augment=AugmentConfig(),
+                       augment_workers=2)
+        self.assertEqual(8, len(saves))
+        for position, trained_count in saves:
+            self.assertEqual(trained_count, position)
+
+    def test_finished_training_is_not_repeated(self):
+        trained = self.train()
+        resumed = self.train()
+        numpy.testing.assert_array_equal(trained.weights, resumed.weights)
+
+
+class TestTrainLayer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmpdir.name
+        self.pixels, self.values = make_separable_images(120)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+        self.tmpdir.cleanup()
+
+    def write_train_files(self, count):
+        image_filename, label_filename = mnist_filenames(
+            "train", self.data_dir)
+        write_image_file(image_filename, self.pixels[:count], 28, 28)
+        write_label_file(label_filename, self.values[:count])
+
+    def train_layer(self, name, **options):
+        random.seed(1)
+        return nndigits.train_layer(
+            batch_size=20, data_dir=self.data_dir,
+            model_filename=os.path.join(self.data_dir, name),
+            checkpoint_filename=os.path.join(self.data_dir, name + ".ckpt"),
+            **options)
+
+    def test_several_epochs_shuffle_by_default(self):
+        self.write_train_files(120)
+        shuffled = self.train_layer("shuffled.model", epochs=2, seed=3,
+                                    shuffle=True)
+        in_order = self.train_layer("in_order.model", epochs=2, seed=3,
+                                    shuffle=False)
+        default = self.train_layer("default.model", epochs=2, seed=3)
+        self.assertFalse(numpy.allclose(shuffled.weights, in_order.weights))
+        numpy.testing.assert_array_equal(shuffled.weights, default.weights)
+
+    def test_resume_on_appended_training_images(self):
+        self.write_train_files(120)
+        expected = self.train_layer("full.model")
+        self.write_train_files(80)
+        self.train_layer("nn.model")
+        self.write_train_files(120)
+        resumed = self.train_layer("nn.model")
+        numpy.testing.assert_allclose(expected.weights, resumed.weights)
+        numpy.testing.assert_allclose(
+            resumed.weights,
+            nndigits.load_layer(os.path.join(self.data_dir, "nn.model")
+                                ).weights, rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import copy
+import random
+import unittest
+import unittest.mock
+
+import numpy
+
+import nndigits
+from mnist_utils import MNISTImage
+from mnist_utils import MNISTLabel
+
+
+def make_images(count, seed=0):
+    rng = numpy.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(count, 784))
+    pixels[pixels < 160] = 0
+    images = [MNISTImage(tuple(row.tolist())) for row in pixels]
+    labels = [MNISTLabel(int(x)) for x in rng.integers(0, 10, size=count)]
+    return images, labels
+
+
+class TestMatrixLayer(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.layer = nndigits.init_layer()
+        self.images, self.labels = make_images(20)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+
+    def test_batch_size_one_matches_per_cell_training(self):
+        legacy_layer = nndigits.use_layer(
+            copy.deepcopy(self.layer), self.images, self.labels, train=True)
+        matrix_layer = nndigits.use_layer(
+            self.layer, self.images, self.labels, train=True, batch_size=1)
+        self.assertIsInstance(matrix_layer, nndigits.MatrixLayer)
+        numpy.testing.assert_allclose(
+            [cell.weight for cell in legacy_layer.cells],
+            matrix_layer.weights, rtol=1e-12)
+
+    def test_sparse_training_matches_dense_minibatches(self):
+        pixels = numpy.array([image.pixels for image in self.images])
+        values = numpy.array([label.value for label in self.labels])
+        sparse_layer = nndigits.use_sparse_layer(
+            self.layer, pixels, values, train=True)
+        dense_layer = nndigits.use_layer_batches(
+            self.layer, ((pixels[i:i + 1], values[i:i + 1])
+                         for i in range(len(pixels))), train=True)
+        numpy.testing.assert_allclose(
+            dense_layer.weights, sparse_layer.weights, rtol=1e-12)
+        numpy.testing.assert_allclose(
+            dense_layer.outputs, sparse_layer.outputs, rtol=1e-12)
+
+    def test_outputs_match_calc_cell_output(self):
+        matrix_layer = nndigits.MatrixLayer.from_layer(self.layer)
+        pixels = numpy.array([image.pixels for image in self.images])
+        outputs = nndigits.calc_layer_outputs(matrix_layer, pixels)
+        for image, image_outputs in zip(self.images, outputs):
+            for cell, output in zip(self.layer.cells, image_outputs):
+                nndigits.calc_cell_output(cell, image)
+                self.assertAlmostEqual(cell.output, output)
+            self.assertEqual(
+                nndigits.get_layer_prediction(self.layer),
+                nndigits.get_layer_predictions(image_outputs[None, :])[0])
+
+    def test_minibatch_training(self):
+        matrix_layer = nndigits.use_layer(
+            self.layer, self.images, self.labels, train=True, batch_size=8)
+        self.assertEqual((10, 784), matrix_layer.weights.shape)
+        self.assertFalse(numpy.allclose(
+            [cell.weight for cell in self.layer.cells], matrix_layer.weights))
+
+    def test_epochs(self):
+        expected = self.layer
+        for epoch in range(3):
+            expected = nndigits.use_layer(
+                expected, self.images, self.labels, train=True, batch_size=4)
+        trained = nndigits.use_layer(
+            self.layer, self.images, self.labels, train=True, batch_size=4,
+            epochs=3)
+        numpy.testing.assert_array_equal(expected.weights, trained.weights)
+        shuffled = nndigits.use_layer(
+            self.layer, self.images, self.labels, train=True, batch_size=4,
+            epochs=3, shuffle=True, seed=0, validation=(self.images,
+                                                        self.labels))
+        self.assertFalse(numpy.allclose(expected.weights, shuffled.weights))
+
+    def test_training_options_are_checked(self):
+        for options in (dict(epochs=2), dict(shuffle=True),
+                        dict(train=True, interval=10)):
+            with self.assertRaises(ValueError):
+                nndigits.use_layer(
+                    self.layer, self.images, self.labels, **options)
+        with self.assertRaises(TypeError):
+            nndigits.use_layer(self.layer, self.images, self.labels,
+                               train=True, bogus_option=1)
+
+    def test_predictions_default_to_zero_without_positive_output(self):
+        outputs = numpy.array([[-1.0, -0.5, -2.0], [0.1, 0.3, 0.2]])
+        self.assertEqual(
+            [0, 1], nndigits.get_layer_predictions(outputs).tolist())
+
+
+class TestPredictBatch(unittest.TestCase):
+    def setUp(self):
+        random.seed(2)
+        self.layer = nndigits.init_layer()
+        self.images, self.labels = make_images(30)
+
+    def test_top_prediction_matches_get_layer_prediction(self):
+        digits, scores = nndigits.predict_batch(self.layer, self.images, k=3)
+        self.assertEqual((30, 3), digits.shape)
+        for image, image_digits, image_scores in zip(
+                self.images, digits, scores):
+            for cell in self.layer.cells:
+                nndigits.calc_cell_output(cell, image)
+            self.assertEqual(
+                nndigits.get_layer_prediction(self.layer), image_digits[0])
+            self.assertAlmostEqual(
+                self.layer.cells[image_digits[1]].output, image_scores[1])
+            self.assertTrue(image_scores[0] >= image_scores[1] >=
+                            image_scores[2])
+
+    def test_does_not_touch_layer_outputs(self):
+        matrix_layer = nndigits.MatrixLayer.from_layer(self.layer)
+        with unittest.mock.patch.object(nndigits, "PREDICT_CHUNK_SIZE", 7):
+            digits, scores = nndigits.predict_batch(
+                matrix_layer, self.images, k=10)
+        self.assertEqual([0] * 10, matrix_layer.outputs.tolist())
+        self.assertEqual(list(range(10)), sorted(digits[0].tolist()))
+
+
+def make_separable_images(count, seed=0):
+    """Images where digit d lights the pixel block d (plus noise)."""
+    rng = numpy.random.default_rng(seed)
+    values = rng.integers(0, 10, size=count)
+    pixels = (rng.random((count, 784)) < 0.05) * 255
+    for i, value in enumerate(values):
+        pixels[i, value * 70:value * 70 + 70] = 255
+    return pixels.astype(numpy.uint8), values.astype(numpy.uint8)
+
+
+class TestNetwork(unittest.TestCase):
+    def setUp(self):
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+
+    def test_contiguous_parameters(self):
+        network = nndigits.Network([784, 30, 20, 10], seed=0)
+        self.assertEqual(
+            784 * 30 + 30 + 30 * 20 + 20 + 20 * 10 + 10,
+            network.parameters.size)
+        self.assertEqual((30, 784), network.weights[0].shape)
+        network.weights[1][0, 0] = 42
+        network.biases[2][9] = 43
+        self.assertIn(42, network.parameters)
+        self.assertEqual(43, network.parameters[-1])
+
+    def test_unknown_activation(self):
+        with self.assertRaises(ValueError):
+            nndigits.Network([4, 2], hidden_activation='tanh')
+
+    def test_gradient(self):
+        for hidden, output in (('sigmoid', 'softmax'), ('relu', 'sigmoid'),
+                               ('sigmoid', 'linear'), ('softmax', 'softmax'),
+                               ('softmax', 'sigmoid')):
+            network = nndigits.Network(
+                [6, 5, 10], hidden_activation=hidden,
+                output_activation=output, learning_rate=1.0, seed=1)
+            rng = numpy.random.default_rng(2)
+            pixels = rng.integers(0, 256, size=(4, 6))
+            values = rng.integers(0, 10, size=4)
+
+            def loss(parameters):
+                trial = nndigits.Network(
+                    [6, 5, 10], hidden_activation=hidden,
+                    output_activation=output, parameters=parameters.copy())
+                outputs = nndigits.calc_network_activations(trial, pixels)[-1]
+                targets = nndigits.get_target_outputs(values)
+                if output == 'softmax':
+                    return -numpy.sum(targets * numpy.log(outputs)) / 4
+                return numpy.sum((outputs - targets) ** 2) / 2 / 4
+
+            parameters = network.parameters.copy()
+            numeric = numpy.zeros_like(parameters)
+            for i in range(len(parameters)):
+                step = numpy.zeros_like(parameters)
+                step[i] = 1e-6
+                numeric[i] = (loss(parameters + step) -
+                              loss(parameters - step)) / 2e-6
+            nndigits.train_network(network, pixels, values)
+            numpy.testing.assert_allclose(
+                parameters - network.parameters, numeric, atol=1e-6)
+
+    def test_training_learns(self):
+        pixels, values = make_separable_images(500)
+        images = [unittest.mock.Mock(pixels=row) for row in pixels]
+        labels = [unittest.mock.Mock(value=value) for value in values]
+        network = nndigits.init_network(hidden_sizes=(32,), seed=0,
+                                        hidden_activation='relu',
+                                        learning_rate=0.5)
+        for epoch in range(5):
+            network = nndigits.use_layer(
+                network, images, labels, train=True, batch_size=16)
+        digits, scores = nndigits.predict_batch(network, images, k=2)
+        self.assertGreater(numpy.mean(digits[:, 0] == values), 0.9)
+        self.assertTrue((scores[:, 0] >= scores[:, 1]).all())
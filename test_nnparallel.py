@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Run with pytest."""
+
+import random
+import unittest
+import unittest.mock
+
+import numpy
+
+import nndigits
+import nnparallel
+from test_nndigits import make_images
+
+
+class TestTrainParallel(unittest.TestCase):
+    def setUp(self):
+        random.seed(3)
+        self.layer = nndigits.init_layer()
+        self.images, self.labels = make_images(60)
+        self.print_patcher = unittest.mock.patch("builtins.print")
+        self.print_patcher.start()
+
+    def tearDown(self):
+        self.print_patcher.stop()
+
+    def test_single_worker_matches_sequential_training(self):
+        trained = nnparallel.train_parallel(
+            self.layer, self.images, self.labels, workers=1, batch_size=8,
+            sync_batches=1, seed=5)
+        order = numpy.random.default_rng(5).permutation(60)
+        pixels = numpy.array([self.images[i].pixels for i in order])
+        values = numpy.array([self.labels[i].value for i in order])
+        expected = nndigits.use_layer_batches(self.layer, (
+            (pixels[start:start + 8], values[start:start + 8])
+            for start in range(0, 60, 8)), train=True)
+        numpy.testing.assert_allclose(expected.weights, trained.weights)
+
+    def test_averaging_is_deterministic(self):
+        runs = [
+            nnparallel.train_parallel(
+                self.layer, self.images, self.labels, workers=3, epochs=2,
+                batch_size=4, sync_batches=2, seed=7)
+            for i in range(2)
+        ]
+        numpy.testing.assert_array_equal(runs[0].weights, runs[1].weights)
+        self.assertFalse(numpy.allclose(
+            [cell.weight for cell in self.layer.cells], runs[0].weights))
+
+    def test_hogwild(self):
+        trained = nnparallel.train_parallel(
+            self.layer, self.images, self.labels, workers=2, batch_size=4,
+            mode='hogwild', seed=1)
+        self.assertEqual((10, 784), trained.weights.shape)
+        self.assertFalse(numpy.allclose(
+            [cell.weight for cell in self.layer.cells], trained.weights))
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            nnparallel.train_parallel(
+                self.layer, self.images, self.labels, mode='magic')
+
+    def test_network(self):
+        network = nndigits.init_network(hidden_sizes=(8,), seed=0)
+        initial = network.parameters.copy()
+        for mode in ('average', 'hogwild'):
+            trained = nnparallel.train_parallel(
+                network, self.images, self.labels, workers=2, batch_size=4,
+                mode=mode, seed=1)
+            self.assertIs(network, trained)
+            self.assertFalse(numpy.allclose(initial, trained.parameters))